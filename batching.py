@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Объединение операций записи подписок в пакеты.
+
+При всплеске /start и /unsubscribe каждая команда не занимает отдельное
+соединение из пула: операции копятся несколько миллисекунд и выполняются
+одним запросом, а каждый вызывающий получает свой результат через future.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, List, Set, Tuple
+
+from config import WRITE_BATCH_MAX_SIZE, WRITE_BATCH_WINDOW_MS
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ADD = 'add'
+REMOVE = 'remove'
+
+# Функция пакетной вставки: строки (user_id, username, first_name, last_name, language_code)
+# -> ID добавленных
+AddFunc = Callable[[List[Tuple]], Awaitable[Set[int]]]
+# Функция пакетного удаления: список ID -> ID удаленных
+RemoveFunc = Callable[[List[int]], Awaitable[Set[int]]]
+
+
+def _segments(batch: List[tuple]) -> Iterable[List[tuple]]:
+    """
+    Разбить пакет на сегменты, в которых каждый пользователь встречается один раз.
+
+    Так подписка и отписка одного пользователя в одном окне выполняются
+    в исходном порядке, а внутри сегмента порядок операций не важен.
+    """
+    segment = []
+    seen = set()
+    for item in batch:
+        user_id = item[1]
+        if user_id in seen:
+            yield segment
+            segment = []
+            seen = set()
+        segment.append(item)
+        seen.add(user_id)
+    if segment:
+        yield segment
+
+
+class WriteBatcher:
+    """Буфер операций подписки/отписки с пакетной записью"""
+
+    def __init__(self, add_many: AddFunc, remove_many: RemoveFunc,
+                 window_ms: float = WRITE_BATCH_WINDOW_MS,
+                 max_size: int = WRITE_BATCH_MAX_SIZE):
+        """
+        Args:
+            add_many: пакетная вставка пользователей
+            remove_many: пакетное удаление пользователей
+            window_ms (float): сколько миллисекунд копить операции перед записью
+            max_size (int): записать немедленно, если накопилось столько операций
+        """
+        self.add_many = add_many
+        self.remove_many = remove_many
+        self.window = max(window_ms, 0) / 1000
+        self.max_size = max(1, max_size)
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+
+    def _submit(self, op: str, user_id: int, args: tuple) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((op, user_id, args, future))
+
+        if len(self._pending) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return future
+
+    def add(self, user_id: int, username: str = None, first_name: str = None,
+            last_name: str = None, language_code: str = None) -> asyncio.Future:
+        """Поставить добавление в очередь. Future вернет True, если пользователь добавлен"""
+        return self._submit(ADD, user_id, (user_id, username, first_name, last_name, language_code))
+
+    def remove(self, user_id: int) -> asyncio.Future:
+        """Поставить удаление в очередь. Future вернет True, если пользователь удален"""
+        return self._submit(REMOVE, user_id, (user_id,))
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[tuple]):
+        """Записать пакет и раздать результаты"""
+        for segment in _segments(batch):
+            adds = [item for item in segment if item[0] == ADD]
+            removes = [item for item in segment if item[0] == REMOVE]
+            if adds:
+                await self._apply(adds, self.add_many, [item[2] for item in adds])
+            if removes:
+                await self._apply(removes, self.remove_many, [item[1] for item in removes])
+
+    @staticmethod
+    async def _apply(items: List[tuple], func: Callable, payload: list):
+        try:
+            changed = await func(payload)
+        except Exception as e:
+            logger.error(f"Ошибка пакетной записи ({len(items)} операций): {e}")
+            for _, _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for _, user_id, _, future in items:
+            if not future.done():
+                future.set_result(user_id in changed)
+
+    async def drain(self):
+        """Записать все накопленные операции и дождаться окончания записи"""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная замена Bot API для нагрузочных тестов.
+
+aiohttp-сервер отвечает на запросы бота так же, как Telegram, но позволяет
+задать задержку ответа, долю ответов 429 (Too Many Requests) с retry_after
+и долю пользователей, заблокировавших бота (403 Forbidden).
+
+Бот подключается к нему через TelegramAPIServer.from_base(url). Запуск отдельно:
+    python -m benchmarks.fake_telegram --port 8081 --latency 0.05 --rate-limit 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+# Методы, которые отправляют сообщение и поэтому могут получить 429 или 403
+SEND_METHODS = {
+    "sendmessage", "sendphoto", "sendvideo", "sendanimation", "sendaudio", "sendvoice",
+    "senddocument", "sendvideonote", "sendsticker", "sendmediagroup", "copymessage",
+}
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeTelegramAPI:
+    """Сервер, имитирующий Bot API"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit_ratio: float = 0.0, retry_after: int = 1,
+                 forbidden_ratio: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency (float): средняя задержка ответа, секунды
+            jitter (float): разброс задержки, секунды (равномерно ±jitter)
+            rate_limit_ratio (float): доля запросов отправки, получающих 429
+            retry_after (int): значение retry_after в ответе 429
+            forbidden_ratio (float): доля пользователей, заблокировавших бота
+            seed (int): зерно генератора для воспроизводимых прогонов
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.forbidden_ratio = forbidden_ratio
+        self.requests = Counter()
+        self.delivered = 0
+        self.throttled = 0
+        self.forbidden = 0
+        self.url = None
+        self.webhook_url = ""
+        self._random = random.Random(seed)
+        self._message_id = 0
+        self._runner = None
+
+    def is_forbidden(self, chat_id: int) -> bool:
+        """Заблокировал ли пользователь бота (одинаково для повторных запросов)"""
+        return zlib.crc32(str(chat_id).encode()) % 10_000 < self.forbidden_ratio * 10_000
+
+    def _message(self, chat_id: int, **fields) -> Dict[str, Any]:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+
+    def _result(self, method: str, data) -> Any:
+        chat_id = int(data.get("chat_id", 0))
+        if method == "getme":
+            return BOT_USER
+        if method == "setwebhook":
+            self.webhook_url = data.get("url", "")
+        if method == "deletewebhook":
+            self.webhook_url = ""
+        if method == "getwebhookinfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "sendmessage":
+            return self._message(chat_id, text=data.get("text", ""))
+        if method == "sendmediagroup":
+            return [self._message(chat_id) for _ in json.loads(data.get("media", "[]"))]
+        if method == "copymessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        if method in SEND_METHODS:
+            return self._message(chat_id)
+        return True
+
+    @staticmethod
+    def _error(status: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": status, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=status)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = await request.post()
+        self.requests[method] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+        if method in SEND_METHODS:
+            if self.rate_limit_ratio and self._random.random() < self.rate_limit_ratio:
+                self.throttled += 1
+                return self._error(
+                    429, f"Too Many Requests: retry after {self.retry_after}",
+                    retry_after=self.retry_after,
+                )
+            if self.forbidden_ratio and self.is_forbidden(int(data.get("chat_id", 0))):
+                self.forbidden += 1
+                return self._error(403, "Forbidden: bot was blocked by the user")
+            self.delivered += 1
+
+        return web.json_response({"ok": True, "result": self._result(method, data)})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": sum(self.requests.values()),
+            "delivered": self.delivered,
+            "throttled": self.throttled,
+            "forbidden": self.forbidden,
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запустить сервер. Возвращает базовый URL для TelegramAPIServer.from_base"""
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{bound_port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    api = FakeTelegramAPI(args.latency, args.jitter, args.rate_limit, args.retry_after, args.forbidden)
+    url = await api.start(args.host, args.port)
+    print(f"Fake Bot API: {url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(api.stats())
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, секунды")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответе 429")
+    parser.add_argument("--forbidden", type=float, default=0.0, help="доля заблокировавших бота")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Создание бота и диспетчера.
+
+Используется главным процессом и процессами-обработчиками апдейтов,
+чтобы все они были настроены одинаково.
+"""
+
+from aiogram import Bot, Dispatcher
+
+import metrics
+from config import BOT_TOKEN
+from database import db
+from dedup import UpdateDeduplicator
+from fsm_storage import DatabaseFSMStorage
+from handlers import router
+from throttling import ThrottlingMiddleware
+
+
+def create_bot() -> Bot:
+    """Экземпляр бота с токеном из конфигурации"""
+    return Bot(token=BOT_TOKEN)
+
+
+def create_dispatcher(bot: Bot) -> Dispatcher:
+    """Диспетчер с роутером обработчиков и сбором метрик"""
+    # Состояния FSM хранятся в базе данных и переживают перезапуск
+    dp = Dispatcher(storage=DatabaseFSMStorage(db))
+
+    # Слишком частые апдейты одного пользователя отбрасываются первыми — до
+    # обработчиков и любых запросов к базе, в том числе отметки апдейта.
+    # event_from_user к этому моменту уже заполнил встроенный UserContextMiddleware
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    # Повторные доставки апдейтов отбрасываются до обработчиков
+    dp.update.outer_middleware(UpdateDeduplicator(db))
+
+    # Подключаем роутер с обработчиками
+    dp.include_router(router)
+
+    # Сбор метрик: время обработки апдейтов, запросы к Bot API и к базе
+    metrics.setup(dp, bot, db)
+    return dp
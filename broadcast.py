@@ -0,0 +1,708 @@
+# -*- coding: utf-8 -*-
+"""
+Движок рассылки сообщений подписчикам.
+
+Сообщения отправляются пулом воркеров с ограниченной конкурентностью,
+скорость ограничивается «ведром токенов» под глобальный лимит Telegram
+и интервалом между сообщениями в один чат.
+
+Каждая рассылка хранится в таблице broadcasts вместе с контрольной точкой,
+поэтому после перезапуска процесса она продолжается с места остановки.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import AsyncIterable, Iterable, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import (
+    BROADCAST_CHAT_INTERVAL,
+    BROADCAST_CHECKPOINT_INTERVAL,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_MAX_RETRIES,
+    BROADCAST_RATE,
+)
+from content import TEXT, MessageContent
+from database import db
+from metrics import (
+    BROADCAST_MESSAGES,
+    BROADCAST_QUEUE_SIZE,
+    BROADCAST_RETRY_AFTER,
+    BROADCASTS_ACTIVE,
+)
+from segments import Segment
+from storage import Position
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Результаты отправки одного сообщения
+DELIVERED = 'delivered'
+# Пользователь заблокировал бота, удалил аккаунт или чат не существует
+UNREACHABLE = 'unreachable'
+# Временная ошибка сети или Telegram — пользователь остается в рассылке
+TRANSIENT = 'transient'
+# Прочие ошибки
+FAILED = 'failed'
+
+# Ответы Bad Request, означающие, что чат недоступен навсегда
+UNREACHABLE_MARKERS = ("chat not found", "user not found", "user is deactivated", "peer_id_invalid")
+
+
+def load_outcomes(value) -> Counter:
+    """Итоги рассылки по результатам из колонки outcomes (JSON или словарь)"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return Counter(value or {})
+
+
+def classify_error(error: Exception) -> str:
+    """Тип ошибки отправки: UNREACHABLE, TRANSIENT или FAILED"""
+    if isinstance(error, TelegramForbiddenError):
+        return UNREACHABLE
+    if isinstance(error, TelegramBadRequest):
+        message = str(error).lower()
+        if any(marker in message for marker in UNREACHABLE_MARKERS):
+            return UNREACHABLE
+        return FAILED
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)):
+        return TRANSIENT
+    return FAILED
+
+
+class TokenBucket:
+    """Ограничитель скорости «ведро токенов» с возможностью паузы"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        Args:
+            rate (float): количество токенов (сообщений) в секунду
+            capacity (float): максимальный запас токенов (размер всплеска)
+        """
+        self.rate = max(rate, 0.001)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Приостановить выдачу токенов для всех ожидающих на заданное время"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class ChatLimiter:
+    """Минимальный интервал между сообщениями в один и тот же чат"""
+
+    def __init__(self, interval: float, max_size: int = 100_000):
+        self.interval = interval
+        self.max_size = max_size
+        self._next_allowed = {}
+
+    async def wait(self, chat_id: int):
+        """Дождаться момента, когда в чат снова можно писать"""
+        if self.interval <= 0:
+            return
+
+        now = time.monotonic()
+        ready_at = self._next_allowed.get(chat_id, 0.0)
+        self._next_allowed[chat_id] = max(now, ready_at) + self.interval
+
+        # Не даем словарю расти бесконечно: выбрасываем устаревшие записи
+        if len(self._next_allowed) > self.max_size:
+            self._next_allowed = {
+                key: value for key, value in self._next_allowed.items() if value > now
+            }
+
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+
+class BroadcastJob:
+    """Рассылка и ее прогресс"""
+
+    SCHEDULED = 'scheduled'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, job_id: int, content: MessageContent, report_chat_id: int,
+                 status: str = RUNNING, last_user_id: Optional[int] = None,
+                 done_ahead: Iterable[int] = (), successful: int = 0, failed: int = 0,
+                 pruned: int = 0, segment: Optional[Segment] = None,
+                 max_rate: Optional[float] = None, outcomes: Optional[dict] = None,
+                 last_subscribed_at: Optional[datetime] = None):
+        self.id = job_id
+        self.content = content
+        self.report_chat_id = report_chat_id
+        # Получатели рассылки (пустой сегмент — все подписчики)
+        self.segment = segment or Segment()
+        # Собственный лимит скорости растянутой рассылки (в дополнение к общему)
+        self.max_rate = max_rate
+        self.bucket = TokenBucket(max_rate) if max_rate else None
+        self.status = status
+        self.successful = successful
+        self.failed = failed
+        # Сколько недоступных пользователей помечено по итогам рассылки
+        self.pruned = pruned
+        # Отправки, начатые воркерами и еще не завершенные
+        self.sending = 0
+        # Количество отправок по результатам: DELIVERED, UNREACHABLE, TRANSIENT, FAILED
+        self.outcomes = Counter(outcomes or {})
+        self.task = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+        # Контрольная точка: все получатели до позиции (last_subscribed_at, last_user_id)
+        # в порядке чтения сегмента уже обработаны (см. Storage.iter_recipients)
+        self.last_user_id = last_user_id
+        self.last_subscribed_at = last_subscribed_at
+        # Позиции получателей, выданных воркерам, в порядке чтения
+        self._pending = deque()
+        # Обработанные ID, которые еще не вошли в контрольную точку
+        self._done = set()
+        # ID, обработанные до перезапуска, — их пропускаем
+        self._skip = set(done_ahead)
+        # Недоступные пользователи, которых еще нужно пометить в базе
+        self._unreachable = []
+        self._dirty = False
+        # Статус, записанный в базу. Статус пишется, только если рассылка сама
+        # его изменила, — иначе контрольная точка затерла бы команду другого процесса
+        self.stored_status = status
+
+        # Воркеры ждут этого события перед каждой отправкой (пауза рассылки)
+        self.resume_event = asyncio.Event()
+        if status == self.RUNNING:
+            self.resume_event.set()
+
+    @classmethod
+    def from_row(cls, row: dict) -> "BroadcastJob":
+        """Создание задачи из строки таблицы broadcasts"""
+        return cls(
+            row['id'], MessageContent.from_row(row), row['report_chat_id'],
+            status=row['status'],
+            last_user_id=row['last_user_id'],
+            done_ahead=row['done_ahead'] or (),
+            successful=row['successful'],
+            failed=row['failed'],
+            pruned=row.get('pruned') or 0,
+            segment=Segment.from_json(row.get('segment')),
+            max_rate=row.get('max_rate'),
+            outcomes=load_outcomes(row.get('outcomes')),
+            last_subscribed_at=row.get('last_subscribed_at'),
+        )
+
+    @property
+    def position(self) -> Optional[Position]:
+        """Позиция контрольной точки, с которой продолжается чтение получателей"""
+        if self.last_user_id is None:
+            return None
+        return self.last_subscribed_at, self.last_user_id
+
+    def should_skip(self, user_id: int) -> bool:
+        return user_id in self._skip
+
+    def skipped(self, position: Position):
+        """Пропустить получателя, обработанного до перезапуска: контрольная точка проходит через него"""
+        self._skip.discard(position[1])
+        self._pending.append(position)
+        self._done.add(position[1])
+        self._advance()
+
+    def dispatched(self, position: Position):
+        """Отметить, что сообщение для получателя передано воркеру"""
+        self._pending.append(position)
+
+    def completed(self, user_id: int, outcome: str):
+        """Отметить, что отправка для user_id завершена, и сдвинуть контрольную точку"""
+        self.outcomes[outcome] += 1
+        if outcome == DELIVERED:
+            self.successful += 1
+        else:
+            self.failed += 1
+            if outcome == UNREACHABLE:
+                self._unreachable.append(user_id)
+        self._done.add(user_id)
+        self._advance()
+        self._dirty = True
+
+    def _advance(self):
+        """Сдвинуть контрольную точку по обработанным получателям"""
+        while self._pending and self._pending[0][1] in self._done:
+            self.last_subscribed_at, self.last_user_id = self._pending.popleft()
+            self._done.discard(self.last_user_id)
+
+    def done_ahead(self) -> List[int]:
+        """Обработанные ID за контрольной точкой"""
+        return sorted(self._done | self._skip)
+
+    def pause(self):
+        self.status = self.PAUSED
+        self.resume_event.clear()
+        self._dirty = True
+
+    def resume(self):
+        self.status = self.RUNNING
+        self.resume_event.set()
+        self._dirty = True
+
+    async def prune_unreachable(self):
+        """Пометить накопленных недоступных пользователей одним запросом"""
+        if not self._unreachable:
+            return
+        user_ids, self._unreachable = self._unreachable, []
+        self.pruned += await db.mark_users_unreachable(user_ids)
+        self._dirty = True
+
+    async def checkpoint(self, force: bool = False) -> Optional[str]:
+        """
+        Сохранить прогресс в базу данных, если он изменился.
+
+        Returns:
+            str: статус рассылки в базе или None, если сохранять было нечего
+        """
+        await self.prune_unreachable()
+        if not (self._dirty or force):
+            return None
+        self._dirty = False
+        stored = await db.save_broadcast_progress(
+            self.id, self.last_user_id, self.done_ahead(),
+            self.successful, self.failed,
+            self.status if self.status != self.stored_status else None,
+            self.pruned, dict(self.outcomes), self.last_subscribed_at,
+        )
+        if stored is not None:
+            self.stored_status = stored
+        return stored
+
+    async def refresh(self) -> Optional[str]:
+        """Сохранить прогресс и прочитать статус, который могла изменить команда в другом процессе"""
+        stored = await self.checkpoint()
+        if stored is None:
+            row = await db.get_broadcast(self.id)
+            stored = row['status'] if row else None
+            if stored is not None:
+                self.stored_status = stored
+        return stored
+
+    def apply_status(self, status: str):
+        """Применить статус, измененный в базе другим процессом"""
+        self.status = status
+        if status == self.RUNNING:
+            self.resume_event.set()
+        else:
+            self.resume_event.clear()
+
+    def snapshot(self) -> dict:
+        """Текущее состояние в формате строки таблицы broadcasts"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'last_user_id': self.last_user_id,
+            'successful': self.successful,
+            'failed': self.failed,
+            'pruned': self.pruned,
+            'outcomes': dict(self.outcomes),
+            'segment': self.segment.to_json(),
+        }
+
+    @property
+    def total(self) -> int:
+        return self.successful + self.failed
+
+    @property
+    def duration(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Фактическая скорость отправки, сообщений в секунду"""
+        return self.total / self.duration if self.duration > 0 else 0.0
+
+
+class Broadcaster:
+    """Фоновая рассылка с ограничением скорости и конкурентности"""
+
+    def __init__(self, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 chat_interval: float = BROADCAST_CHAT_INTERVAL,
+                 max_retries: int = BROADCAST_MAX_RETRIES,
+                 checkpoint_interval: float = BROADCAST_CHECKPOINT_INTERVAL,
+                 runs_jobs: bool = True):
+        # Ведро общее для всех рассылок процесса, поэтому параллельные
+        # рассылки вместе не превышают глобальный лимит Telegram
+        self.bucket = TokenBucket(rate)
+        self.chat_limiter = ChatLimiter(chat_interval)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.checkpoint_interval = checkpoint_interval
+        # False в процессах-обработчиках апдейтов: рассылки выполняет только основной
+        # процесс, а команды управляют ими через статус в базе
+        self.runs_jobs = runs_jobs
+        # В процессах-обработчиках: передать основному процессу ID рассылки,
+        # которую он должен выполнить (см. Scheduler.forward_to)
+        self.handoff = None
+        # Рассылки, выполняющиеся в этом процессе
+        self._jobs = {}
+
+    async def _send_one(self, bot: Bot, user_id: int, content: MessageContent) -> str:
+        """
+        Отправка одного сообщения с учетом лимитов.
+
+        Returns:
+            str: DELIVERED, UNREACHABLE, TRANSIENT или FAILED
+        """
+        for _ in range(self.max_retries + 1):
+            await self.chat_limiter.wait(user_id)
+            # Альбом Telegram засчитывает как несколько сообщений
+            for _ in range(content.cost):
+                await self.bucket.acquire()
+            try:
+                await content.send(bot, user_id)
+                return DELIVERED
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать — останавливаем все ведро, а не только этот запрос
+                BROADCAST_RETRY_AFTER.inc()
+                logger.warning(f"Превышен лимит Telegram, пауза рассылки на {e.retry_after} с")
+                self.bucket.pause(e.retry_after)
+            except Exception as e:
+                outcome = classify_error(e)
+                if outcome == FAILED:
+                    logger.error(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
+                else:
+                    # Пользователь заблокировал бота, чат не найден или временная ошибка
+                    logger.warning(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+                return outcome
+
+        logger.warning(f"Не удалось отправить сообщение пользователю {user_id}: исчерпаны повторы")
+        return TRANSIENT
+
+    async def run(self, bot: Bot, job: BroadcastJob,
+                  batches: AsyncIterable[List[Position]]) -> BroadcastJob:
+        """
+        Разослать сообщение задачи и дождаться завершения.
+
+        Получатели читаются из batches по мере отправки: очередь воркеров
+        ограничена, поэтому следующая порция запрашивается только когда
+        предыдущая почти разослана.
+        """
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        queued = 0
+
+        async def worker():
+            nonlocal queued
+            while True:
+                user_id = await queue.get()
+                if user_id is None:
+                    return
+                queued -= 1
+                BROADCAST_QUEUE_SIZE.dec()
+                await job.resume_event.wait()
+                if job.bucket is not None:
+                    for _ in range(job.content.cost):
+                        await job.bucket.acquire()
+                job.sending += 1
+                try:
+                    outcome = await self._send_one(bot, user_id, job.content)
+                finally:
+                    job.sending -= 1
+                BROADCAST_MESSAGES.inc(outcome)
+                job.completed(user_id, outcome)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            async for batch in batches:
+                for position in batch:
+                    user_id = position[1]
+                    if job.should_skip(user_id):
+                        job.skipped(position)
+                        continue
+                    job.dispatched(position)
+                    await queue.put(user_id)
+                    queued += 1
+                    BROADCAST_QUEUE_SIZE.inc()
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            # Неразосланные получатели при отмене остаются в очереди
+            BROADCAST_QUEUE_SIZE.dec(amount=queued)
+            job.finished_at = time.monotonic()
+
+        return job
+
+    async def _checkpoint_loop(self, job: BroadcastJob):
+        """Периодическое сохранение прогресса и применение статуса из базы"""
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            known = job.stored_status
+            status = await job.refresh()
+            # Свои изменения статуса рассылка уже применила, а пока шло сохранение,
+            # его могла изменить команда в этом же процессе
+            if status is None or status in (known, job.status):
+                continue
+            logger.info(f"Рассылка #{job.id}: статус изменен на '{status}' в другом процессе")
+            job.apply_status(status)
+            if status in (BroadcastJob.CANCELLED, BroadcastJob.COMPLETED):
+                job.task.cancel()
+                return
+
+    async def _run_job(self, bot: Bot, job: BroadcastJob):
+        """Выполнить рассылку, сохраняя прогресс, и отправить отчет администратору"""
+        checkpointer = asyncio.create_task(self._checkpoint_loop(job))
+        try:
+            try:
+                await self.run(bot, job, db.iter_recipients(job.segment, job.position))
+                job.status = BroadcastJob.COMPLETED
+                report = (
+                    f"📊 Рассылка #{job.id} завершена!\n\n"
+                    f"✅ Успешно отправлено: {job.successful}\n"
+                    f"❌ Не удалось отправить: {job.failed}\n"
+                    f"⏳ Из них временные ошибки: {job.outcomes[TRANSIENT]}\n"
+                    f"🧹 Удалено недоступных: {job.pruned}\n"
+                    f"📝 Всего пользователей: {job.total}\n"
+                    f"⏱ Время: {job.duration:.1f} с ({job.rate:.1f} сообщ./с)"
+                )
+                logger.info(f"Рассылка #{job.id} завершена: {job.successful} успешно, {job.failed} ошибок")
+            except asyncio.CancelledError:
+                # Статус остается 'running' при остановке процесса (рассылка продолжится
+                # после перезапуска) и становится 'cancelled' при отмене администратором
+                logger.warning(f"Рассылка #{job.id} прервана, статус: {job.status}")
+                await job.checkpoint(force=True)
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка во время рассылки #{job.id}: {e}")
+                job.pause()
+                report = (
+                    f"⏸ Рассылка #{job.id} приостановлена из-за ошибки.\n"
+                    f"Используйте /resume {job.id} для продолжения."
+                )
+            finally:
+                checkpointer.cancel()
+
+            # Отмена из другого процесса, пришедшая после последней контрольной точки
+            if await job.checkpoint(force=True) == BroadcastJob.CANCELLED:
+                report = f"🚫 Рассылка #{job.id} отменена."
+        finally:
+            # Рассылка остается в списке до последней контрольной точки, иначе основной
+            # процесс мог бы принять ее за прерванную и запустить второй раз
+            self._jobs.pop(job.id, None)
+
+        try:
+            await bot.send_message(job.report_chat_id, report)
+        except Exception as e:
+            logger.error(f"Не удалось отправить отчет о рассылке #{job.id}: {e}")
+
+    def _launch(self, bot: Bot, job: BroadcastJob) -> BroadcastJob:
+        """Запустить задачу рассылки в фоне"""
+        # Храним ссылку на задачу, иначе ее может собрать сборщик мусора
+        job.task = asyncio.create_task(self._run_job(bot, job))
+        self._jobs[job.id] = job
+        return job
+
+    async def create(self, bot: Bot, report_chat_id: int, content: Union[str, MessageContent],
+                     segment: Optional[Segment] = None) -> BroadcastJob:
+        """
+        Создать и запустить рассылку в фоне. Отчет придет в report_chat_id.
+
+        Args:
+            content: текст или содержимое сообщения (медиа передается по file_id)
+            segment (Segment): получатели (по умолчанию все подписчики)
+        """
+        if isinstance(content, str):
+            content = MessageContent.from_text(content)
+        segment = segment or Segment()
+        job_id = await self._store(report_chat_id, content, segment)
+        job = BroadcastJob(job_id, content, report_chat_id, segment=segment)
+        if not self.runs_jobs:
+            # Рассылку со статусом 'running' выполнит основной процесс
+            self._hand_off(job_id)
+            return job
+        return self._launch(bot, job)
+
+    @staticmethod
+    async def _store(report_chat_id: int, content: MessageContent, segment: Segment,
+                     scheduled_at: Optional[datetime] = None,
+                     max_rate: Optional[float] = None) -> int:
+        """Сохранить рассылку в базу. Возвращает ее ID"""
+        # Текстовые рассылки хранятся как раньше, в колонке text
+        payload = None if content.kind == TEXT and not content.entities else content.to_json()
+        return await db.create_broadcast(
+            content.text or "", report_chat_id, segment.to_json(), payload,
+            scheduled_at=scheduled_at, max_rate=max_rate,
+        )
+
+    async def schedule(self, report_chat_id: int, content: Union[str, MessageContent],
+                       scheduled_at: datetime, segment: Optional[Segment] = None,
+                       max_rate: Optional[float] = None) -> int:
+        """
+        Сохранить отложенную рассылку. Запускает ее scheduler.Scheduler.
+
+        Args:
+            scheduled_at (datetime): время запуска (с часовым поясом)
+            max_rate (float): скорость этой рассылки, чтобы растянуть ее во времени
+
+        Returns:
+            int: ID рассылки
+        """
+        if isinstance(content, str):
+            content = MessageContent.from_text(content)
+        return await self._store(report_chat_id, content, segment or Segment(), scheduled_at, max_rate)
+
+    async def start_scheduled(self, bot: Bot, job_id: int) -> Optional[BroadcastJob]:
+        """
+        Запустить отложенную рассылку.
+
+        Returns:
+            BroadcastJob: запущенная рассылка или None, если ее отменили
+                или уже запустил другой процесс
+        """
+        if not await db.start_scheduled_broadcast(job_id):
+            return None
+        row = await db.get_broadcast(job_id)
+        if row is None:
+            return None
+        return self._launch(bot, BroadcastJob.from_row(row))
+
+    async def resume_unfinished(self, bot: Bot) -> int:
+        """
+        Продолжить рассылки, прерванные перезапуском процесса или
+        запущенные командами в процессах-обработчиках.
+
+        Returns:
+            int: количество запущенных рассылок
+        """
+        launched = 0
+        for row in await db.get_unfinished_broadcasts():
+            if row['id'] in self._jobs:
+                continue
+            job = self._launch(bot, BroadcastJob.from_row(row))
+            logger.info(f"Рассылка #{job.id} продолжена после ID {job.last_user_id}")
+            launched += 1
+        return launched
+
+    def get_job(self, job_id: int) -> Optional[BroadcastJob]:
+        """Рассылка, выполняющаяся в этом процессе"""
+        return self._jobs.get(job_id)
+
+    async def pause(self, job_id: int) -> bool:
+        """Приостановить рассылку. Возвращает False, если она не выполняется"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            # Рассылка выполняется в другом процессе: он применит статус
+            # при следующей контрольной точке
+            return await db.set_broadcast_status(job_id, BroadcastJob.PAUSED, expected=(BroadcastJob.RUNNING,))
+        if job.status != BroadcastJob.RUNNING:
+            return False
+        job.pause()
+        await job.checkpoint()
+        return True
+
+    async def resume(self, bot: Bot, job_id: int) -> bool:
+        """Продолжить приостановленную рассылку, в том числе после перезапуска"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            if job.status != BroadcastJob.PAUSED:
+                return False
+            job.resume()
+            await job.checkpoint()
+            return True
+
+        # Переход paused -> running выполняется условно, поэтому рассылку
+        # продолжит только один процесс
+        if not await db.set_broadcast_status(job_id, BroadcastJob.RUNNING, expected=(BroadcastJob.PAUSED,)):
+            return False
+        if self.runs_jobs:
+            row = await db.get_broadcast(job_id)
+            if row is not None:
+                self._launch(bot, BroadcastJob.from_row(row))
+        else:
+            self._hand_off(job_id)
+        return True
+
+    def _hand_off(self, job_id: int):
+        if self.handoff is not None:
+            self.handoff(job_id)
+
+    async def cancel(self, job_id: int) -> bool:
+        """Отменить рассылку"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.status = BroadcastJob.CANCELLED
+            job.task.cancel()
+            return True
+
+        # Рассылку в другом процессе остановит ее контрольная точка
+        return await db.set_broadcast_status(job_id, BroadcastJob.CANCELLED, expected=(
+            BroadcastJob.SCHEDULED, BroadcastJob.RUNNING, BroadcastJob.PAUSED,
+        ))
+
+    async def shutdown(self, timeout: float) -> int:
+        """
+        Остановить рассылки процесса перед его завершением.
+
+        Воркеры перестают брать новых получателей, а начатые отправки
+        завершаются (не дольше timeout), чтобы сообщение не ушло дважды
+        после перезапуска. Затем рассылки сохраняют контрольную точку;
+        статус в базе не меняется, и рассылки продолжаются после перезапуска.
+
+        Returns:
+            int: количество остановленных рассылок
+        """
+        jobs = list(self._jobs.values())
+        for job in jobs:
+            job.resume_event.clear()
+
+        deadline = time.monotonic() + timeout
+        while any(job.sending for job in jobs) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        for job in jobs:
+            job.task.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+        return len(jobs)
+
+    @property
+    def active(self) -> int:
+        """Количество рассылок, выполняющихся в этом процессе"""
+        return len(self._jobs)
+
+
+# Общий экземпляр движка рассылки
+broadcaster = Broadcaster()
+BROADCASTS_ACTIVE.callback = lambda: broadcaster.active
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Кэши в памяти процесса.
+
+TTLCache — LRU-кэш с ограниченным размером и временем жизни записей.
+SubscriptionCache хранит результат проверки «подписан / не подписан»,
+чтобы повторные /start не обращались к базе данных.
+
+Кэш у каждого процесса свой. Изменения, сделанные другим процессом
+(пометка недоступных во время рассылки, импорт из командной строки),
+он видит только после истечения TTL записи.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from config import SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_CACHE_TTL
+
+
+class TTLCache:
+    """LRU-кэш с ограниченным размером и временем жизни записей"""
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Args:
+            max_size (int): максимальное количество записей (0 — кэш отключен)
+            ttl (float): время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение из кэша или None, если его нет или оно устарело"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Как get, но без учета в счетчиках и без обновления порядка LRU"""
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Записать значение"""
+        if self.max_size <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Удалить запись"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        """Счетчики для подбора размера кэша"""
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio,
+        }
+
+
+class SubscriptionCache(TTLCache):
+    """Кэш состояния подписки: user_id -> True/False"""
+
+    def __init__(self, max_size: int = SUBSCRIPTION_CACHE_SIZE,
+                 ttl: float = SUBSCRIPTION_CACHE_TTL):
+        super().__init__(max_size, ttl)
+        # True — подписки меняет только этот процесс и кэш всегда актуален
+        self.exclusive = True
+
+    def share(self, ttl: float):
+        """
+        Перевести кэш в режим, когда подписки меняют и другие процессы.
+
+        Время жизни записей ограничивается ttl, а ответ «подписан»
+        больше не считается окончательным (см. Storage.cached_subscription).
+        """
+        self.exclusive = False
+        self.ttl = min(self.ttl, ttl)
+        self.clear()
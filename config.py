@@ -28,6 +28,30 @@ def _get_admin_id() -> int:
         return 0
 
 
+def _get_int(name: str, default: int) -> int:
+    """Прочитать целое число из окружения, при ошибке вернуть значение по умолчанию"""
+    value = os.getenv(name, "").strip()
+    try:
+        return int(value) if value else default
+    except Exception:
+        return default
+
+
+def _get_float(name: str, default: float) -> float:
+    """Прочитать дробное число из окружения, при ошибке вернуть значение по умолчанию"""
+    value = os.getenv(name, "").strip()
+    try:
+        return float(value) if value else default
+    except Exception:
+        return default
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    """Прочитать флаг (1/true/yes) из окружения, если переменная не задана — значение по умолчанию"""
+    value = os.getenv(name, "").strip().lower()
+    return value in ("1", "true", "yes") if value else default
+
+
 # Токен бота (обязательно)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 
@@ -55,4 +79,97 @@ WEBHOOK_BASE_URL = (
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip() or "/webhook"
 
 # Секрет вебхука (опционально). Если задан, Telegram будет отправлять заголовок X-Telegram-Bot-Api-Secret-Token
-WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
\ No newline at end of file
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Параметры рассылки.
+# Глобальный лимит Telegram — около 30 сообщений в секунду, в один чат — около 1 в секунду.
+BROADCAST_RATE = _get_float("BROADCAST_RATE", 25.0)
+# Количество одновременных запросов к Bot API во время рассылки
+BROADCAST_CONCURRENCY = _get_int("BROADCAST_CONCURRENCY", 10)
+# Минимальный интервал (в секундах) между сообщениями в один и тот же чат
+BROADCAST_CHAT_INTERVAL = _get_float("BROADCAST_CHAT_INTERVAL", 1.0)
+# Сколько ID подписчиков читать из базы за один запрос во время рассылки
+BROADCAST_BATCH_SIZE = _get_int("BROADCAST_BATCH_SIZE", 1000)
+# Сколько раз повторять отправку после TelegramRetryAfter
+BROADCAST_MAX_RETRIES = _get_int("BROADCAST_MAX_RETRIES", 3)
+# Как часто (в секундах) сохранять контрольную точку рассылки в базу данных
+BROADCAST_CHECKPOINT_INTERVAL = _get_float("BROADCAST_CHECKPOINT_INTERVAL", 2.0)
+
+# Кэш состояния подписки: максимальное число пользователей и время жизни записи (секунды)
+SUBSCRIPTION_CACHE_SIZE = _get_int("SUBSCRIPTION_CACHE_SIZE", 100_000)
+SUBSCRIPTION_CACHE_TTL = _get_float("SUBSCRIPTION_CACHE_TTL", 300.0)
+# Предел времени жизни записи в процессах-обработчиках (UPDATE_QUEUE_BACKEND=process):
+# их кэш не видит пометки недоступных, которые делает рассылка в основном процессе
+SUBSCRIPTION_CACHE_PROCESS_TTL = _get_float("SUBSCRIPTION_CACHE_PROCESS_TTL", 30.0)
+
+# Пакетная запись подписок: окно накопления (миллисекунды) и максимальный размер пакета
+WRITE_BATCH_WINDOW_MS = _get_float("WRITE_BATCH_WINDOW_MS", 5.0)
+WRITE_BATCH_MAX_SIZE = _get_int("WRITE_BATCH_MAX_SIZE", 500)
+
+# Пул соединений PostgreSQL
+DB_POOL_MIN_SIZE = _get_int("DB_POOL_MIN_SIZE", 2)
+DB_POOL_MAX_SIZE = _get_int("DB_POOL_MAX_SIZE", 10)
+# Закрывать соединения, простаивающие дольше этого времени (секунды, 0 — никогда)
+DB_MAX_INACTIVE_LIFETIME = _get_float("DB_MAX_INACTIVE_LIFETIME", 300.0)
+# Размер кэша подготовленных запросов на одно соединение
+DB_STATEMENT_CACHE_SIZE = _get_int("DB_STATEMENT_CACHE_SIZE", 100)
+# Таймаут одного запроса и ожидания свободного соединения (секунды)
+DB_COMMAND_TIMEOUT = _get_float("DB_COMMAND_TIMEOUT", 10.0)
+DB_ACQUIRE_TIMEOUT = _get_float("DB_ACQUIRE_TIMEOUT", 10.0)
+# Серверный statement_timeout для каждого соединения (миллисекунды, 0 — не задавать)
+DB_STATEMENT_TIMEOUT_MS = _get_int("DB_STATEMENT_TIMEOUT_MS", 0)
+# Повторные попытки подключения при старте: количество и начальная задержка (секунды)
+DB_CONNECT_RETRIES = _get_int("DB_CONNECT_RETRIES", 5)
+DB_CONNECT_BACKOFF = _get_float("DB_CONNECT_BACKOFF", 1.0)
+
+# Прием вебхуков: апдейт подтверждается сразу и попадает в очередь обработки.
+# asyncio — обработчики-задачи в этом процессе, process — отдельные процессы
+UPDATE_QUEUE_BACKEND = os.getenv("UPDATE_QUEUE_BACKEND", "asyncio").strip().lower() or "asyncio"
+# Количество обработчиков очереди. Апдейты одного чата всегда идут в один обработчик
+UPDATE_WORKERS = _get_int("UPDATE_WORKERS", 8)
+# Максимальная длина очереди одного обработчика; при переполнении вебхук отвечает 503
+UPDATE_QUEUE_SIZE = _get_int("UPDATE_QUEUE_SIZE", 1000)
+# Как часто процессы-обработчики отправляют свои метрики основному процессу (секунды)
+UPDATE_WORKER_METRICS_INTERVAL = _get_float("UPDATE_WORKER_METRICS_INTERVAL", 5.0)
+# Сколько секунд дается на остановку по SIGTERM: доработать очередь апдейтов,
+# завершить начатые отправки рассылок и закрыть соединения. Render и Heroku
+# принудительно завершают процесс через 30 секунд после SIGTERM
+SHUTDOWN_TIMEOUT = _get_float("SHUTDOWN_TIMEOUT", 25.0)
+
+# Отложенные рассылки (/schedule).
+# Часовой пояс, в котором администратор указывает время
+SCHEDULE_TIMEZONE = os.getenv("SCHEDULE_TIMEZONE", "UTC").strip() or "UTC"
+# Рассылки больше SCHEDULE_SPREAD_THRESHOLD получателей растягиваются
+# на SCHEDULE_SPREAD_WINDOW секунд, чтобы не создавать пик нагрузки
+SCHEDULE_SPREAD_THRESHOLD = _get_int("SCHEDULE_SPREAD_THRESHOLD", 10_000)
+SCHEDULE_SPREAD_WINDOW = _get_float("SCHEDULE_SPREAD_WINDOW", 1800.0)
+
+# Статистика подписчиков (/stats).
+# Часовой пояс, по которому считаются сутки в дневной истории
+STATS_TIMEZONE = os.getenv("STATS_TIMEZONE", "").strip() or SCHEDULE_TIMEZONE
+# Как часто сверять счетчик подписчиков с таблицей users (секунды)
+STATS_RECONCILE_INTERVAL = _get_float("STATS_RECONCILE_INTERVAL", 3600.0)
+
+# Кэш состояний FSM поверх хранилища в базе данных. Перед чтением из кэша
+# версия записи сверяется с базой, поэтому TTL ограничивает только память
+FSM_CACHE_SIZE = _get_int("FSM_CACHE_SIZE", 10_000)
+FSM_CACHE_TTL = _get_float("FSM_CACHE_TTL", 60.0)
+# Окно (секунды), в течение которого повторная доставка апдейта отбрасывается
+UPDATE_DEDUP_WINDOW = _get_float("UPDATE_DEDUP_WINDOW", 600.0)
+# Отмечать обработанные апдейты в базе данных, чтобы повтор, пришедший на другую
+# реплику, тоже отбрасывался. По умолчанию включено для PostgreSQL
+UPDATE_DEDUP_SHARED = _get_bool(
+    "UPDATE_DEDUP_SHARED", (DATABASE_URL or "").startswith(("postgres://", "postgresql://")))
+
+# Ограничение частоты апдейтов от одного пользователя (администратор не ограничивается).
+# Правила через запятую: команда=количество/секунды; default — для остальных апдейтов.
+# Пустая строка отключает ограничение
+THROTTLE_RULES = os.getenv("THROTTLE_RULES", "start=3/60,unsubscribe=3/60,default=20/60").strip()
+# Сколько пользователей помнить; давно не писавшие вытесняются первыми
+THROTTLE_MAX_USERS = _get_int("THROTTLE_MAX_USERS", 100_000)
+
+# Импорт и экспорт подписчиков (/export, /import, python transfer.py):
+# сколько строк читать из базы или файла и записывать одной транзакцией
+TRANSFER_BATCH_SIZE = _get_int("TRANSFER_BATCH_SIZE", 5000)
+# Как часто (в секундах) обновлять сообщение о ходе /export и /import
+TRANSFER_PROGRESS_INTERVAL = _get_float("TRANSFER_PROGRESS_INTERVAL", 5.0)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Содержимое рассылки: текст, медиа или альбом.
+
+Администратор отвечает командой /send на любое сообщение. Файл этого
+сообщения уже загружен в Telegram, поэтому рассылка сохраняет только его
+file_id и отправляет каждому получателю send_photo/send_video/... с этим
+file_id — повторной загрузки нет, каждый получатель стоит одного короткого
+запроса. Сообщения, у которых нет файла (опросы, геопозиция и т.п.),
+рассылаются через copy_message.
+
+Содержимое сериализуется в JSON и хранится в таблице broadcasts,
+чтобы рассылка продолжалась после перезапуска.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import (
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+    MessageEntity,
+)
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEXT = 'text'
+ALBUM = 'album'
+COPY = 'copy'
+
+# Тип медиа -> поддерживает ли он подпись. Порядок важен: у анимации
+# Telegram также заполняет document, поэтому animation проверяется раньше
+MEDIA_TYPES = OrderedDict([
+    ('photo', True),
+    ('video', True),
+    ('animation', True),
+    ('audio', True),
+    ('voice', True),
+    ('document', True),
+    ('video_note', False),
+    ('sticker', False),
+])
+
+# Типы, которые можно отправить в альбоме
+ALBUM_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'audio': InputMediaAudio,
+    'document': InputMediaDocument,
+}
+
+KIND_LABELS = {
+    TEXT: 'текст',
+    COPY: 'копия сообщения',
+    'photo': 'фото',
+    'video': 'видео',
+    'animation': 'GIF',
+    'audio': 'аудио',
+    'voice': 'голосовое сообщение',
+    'document': 'документ',
+    'video_note': 'видеосообщение',
+    'sticker': 'стикер',
+}
+
+
+def _dump_entities(entities: Optional[Iterable[MessageEntity]]) -> List[dict]:
+    return [entity.model_dump(exclude_none=True) for entity in entities or ()]
+
+
+def _load_entities(entities: List[dict]) -> Optional[List[MessageEntity]]:
+    return [MessageEntity(**entity) for entity in entities] or None
+
+
+class MessageContent:
+    """Сообщение рассылки, которое можно отправить любому получателю"""
+
+    def __init__(self, kind: str, text: Optional[str] = None, entities: Iterable[dict] = (),
+                 file_id: Optional[str] = None, items: Iterable["MessageContent"] = (),
+                 from_chat_id: Optional[int] = None, message_id: Optional[int] = None):
+        """
+        Args:
+            kind (str): TEXT, ALBUM, COPY или тип медиа из MEDIA_TYPES
+            text (str): текст сообщения или подпись к медиа
+            entities: форматирование текста (MessageEntity в виде словарей)
+            file_id (str): file_id медиа
+            items: элементы альбома
+            from_chat_id, message_id: исходное сообщение для COPY
+        """
+        self.kind = kind
+        self.text = text
+        self.entities = list(entities)
+        self.file_id = file_id
+        self.items = list(items)
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+
+    @classmethod
+    def from_text(cls, text: str) -> "MessageContent":
+        return cls(TEXT, text=text)
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageContent":
+        """Содержимое сообщения: file_id медиа вместо повторной загрузки"""
+        if message.text:
+            return cls(TEXT, text=message.text, entities=_dump_entities(message.entities))
+
+        for kind, has_caption in MEDIA_TYPES.items():
+            media = getattr(message, kind, None)
+            if not media:
+                continue
+            # Для фото берем самый крупный размер
+            file_id = media[-1].file_id if kind == 'photo' else media.file_id
+            if not has_caption:
+                return cls(kind, file_id=file_id)
+            return cls(kind, text=message.caption, file_id=file_id,
+                       entities=_dump_entities(message.caption_entities))
+
+        return cls(COPY, text=message.caption, from_chat_id=message.chat.id,
+                   message_id=message.message_id)
+
+    @classmethod
+    def from_album(cls, messages: List[Message]) -> "MessageContent":
+        """Альбом из сообщений одной медиагруппы"""
+        items = [cls.from_message(message) for message in sorted(messages, key=lambda m: m.message_id)]
+        items = [item for item in items if item.kind in ALBUM_MEDIA]
+        if len(items) < 2:
+            return items[0] if items else cls.from_message(messages[0])
+        caption = next((item.text for item in items if item.text), None)
+        return cls(ALBUM, text=caption, items=items)
+
+    @property
+    def cost(self) -> int:
+        """Сколько сообщений Telegram засчитывает за одну отправку"""
+        return len(self.items) if self.kind == ALBUM else 1
+
+    def describe(self) -> str:
+        """Тип содержимого для администратора"""
+        if self.kind == ALBUM:
+            return f"альбом из {len(self.items)}"
+        return KIND_LABELS.get(self.kind, self.kind)
+
+    async def send(self, bot: Bot, chat_id: int):
+        """Отправить содержимое в чат"""
+        if self.kind == TEXT:
+            await bot.send_message(chat_id, self.text, entities=_load_entities(self.entities))
+        elif self.kind == ALBUM:
+            await bot.send_media_group(chat_id, [
+                ALBUM_MEDIA[item.kind](
+                    media=item.file_id, caption=item.text,
+                    caption_entities=_load_entities(item.entities),
+                )
+                for item in self.items
+            ])
+        elif self.kind == COPY:
+            await bot.copy_message(chat_id, self.from_chat_id, self.message_id)
+        else:
+            kwargs = {self.kind: self.file_id}
+            if MEDIA_TYPES.get(self.kind):
+                kwargs['caption'] = self.text
+                kwargs['caption_entities'] = _load_entities(self.entities)
+            await getattr(bot, f"send_{self.kind}")(chat_id, **kwargs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {'kind': self.kind}
+        for key in ('text', 'file_id', 'from_chat_id', 'message_id'):
+            if getattr(self, key) is not None:
+                data[key] = getattr(self, key)
+        if self.entities:
+            data['entities'] = self.entities
+        if self.items:
+            data['items'] = [item.to_dict() for item in self.items]
+        return data
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MessageContent":
+        return cls(
+            data['kind'],
+            text=data.get('text'),
+            entities=data.get('entities') or (),
+            file_id=data.get('file_id'),
+            items=[cls.from_dict(item) for item in data.get('items') or ()],
+            from_chat_id=data.get('from_chat_id'),
+            message_id=data.get('message_id'),
+        )
+
+    @classmethod
+    def from_row(cls, row: dict) -> "MessageContent":
+        """Содержимое из строки таблицы broadcasts (старые рассылки — только текст)"""
+        payload = row.get('payload')
+        if not payload:
+            return cls.from_text(row['text'])
+        return cls.from_dict(json.loads(payload) if isinstance(payload, str) else payload)
+
+
+class AlbumCollector:
+    """
+    Последние медиагруппы, присланные администратором.
+
+    Telegram присылает каждое фото альбома отдельным апдейтом, а в ответе
+    на альбом есть только одно из них, поэтому элементы запоминаются по
+    media_group_id по мере поступления.
+    """
+
+    def __init__(self, max_groups: int = 20):
+        self.max_groups = max_groups
+        self._groups = OrderedDict()
+
+    def add(self, message: Message):
+        group = self._groups.setdefault(message.media_group_id, {})
+        group[message.message_id] = message
+        self._groups.move_to_end(message.media_group_id)
+        while len(self._groups) > self.max_groups:
+            self._groups.popitem(last=False)
+
+    def get(self, media_group_id: str) -> List[Message]:
+        return list(self._groups.get(media_group_id, {}).values())
+
+    def content_for(self, message: Message) -> MessageContent:
+        """Содержимое сообщения, на которое ответил администратор, с учетом альбома"""
+        if message.media_group_id:
+            messages = self.get(message.media_group_id)
+            if message.message_id not in {m.message_id for m in messages}:
+                messages.append(message)
+            return MessageContent.from_album(messages)
+        return MessageContent.from_message(message)
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для router.message: запоминает элементы альбомов
+    администратора до фильтров обработчиков.
+
+    Элемент с командой в подписи (например, /send у первого фото) уходит
+    в обработчик команды, но в альбом все равно попадает, поэтому
+    последующий /send в ответ на альбом разошлет его целиком.
+    """
+
+    def __init__(self, collector: AlbumCollector, admin_id: int):
+        self.collector = collector
+        self.admin_id = admin_id
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Message,
+                       data: Dict[str, Any]) -> Any:
+        if event.media_group_id and event.from_user and event.from_user.id == self.admin_id:
+            self.collector.add(event)
+        return await handler(event, data)
+
+
+# Альбомы администратора для /send в ответ на медиагруппу
+albums = AlbumCollector()
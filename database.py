@@ -1,18 +1,195 @@
 # -*- coding: utf-8 -*-
 """
-Модуль для работы с базой данных PostgreSQL
+Модуль для работы с базой данных PostgreSQL.
+
+Реализация выбирается по DATABASE_URL: для postgres:// используется Database,
+иначе — локальная SQLite (см. sqlite_database.py).
 """
 
+import asyncio
 import asyncpg
+import json
 import logging
-from config import DATABASE_URL
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+from config import (
+    BROADCAST_BATCH_SIZE,
+    DATABASE_NAME,
+    DATABASE_URL,
+    DB_ACQUIRE_TIMEOUT,
+    DB_COMMAND_TIMEOUT,
+    DB_CONNECT_BACKOFF,
+    DB_CONNECT_RETRIES,
+    DB_MAX_INACTIVE_LIFETIME,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_STATEMENT_TIMEOUT_MS,
+)
+from segments import Segment
+from sqlite_database import SqliteDatabase
+from storage import USER_COLUMNS, BaseStorage, Position, stats_day
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class Database:
+# Часто выполняемые запросы. Текст запроса — ключ кэша подготовленных запросов
+# asyncpg, поэтому каждый из них подготавливается один раз на соединение.
+SQL_IS_SUBSCRIBED = "SELECT user_id FROM users WHERE user_id = $1 AND blocked_at IS NULL"
+SQL_INSERT_USERS = '''
+    INSERT INTO users (user_id, username, first_name, last_name, language_code)
+    SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[], $4::text[], $5::text[])
+    ON CONFLICT (user_id) DO UPDATE
+    SET blocked_at = NULL, language_code = COALESCE(EXCLUDED.language_code, users.language_code)
+    WHERE users.blocked_at IS NOT NULL
+    RETURNING user_id
+'''
+SQL_DELETE_USERS = (
+    "DELETE FROM users WHERE user_id = ANY($1::bigint[]) RETURNING user_id, blocked_at IS NULL AS active"
+)
+SQL_USERS_FIRST_PAGE = "SELECT user_id FROM users WHERE blocked_at IS NULL ORDER BY user_id LIMIT $1"
+SQL_USERS_NEXT_PAGE = (
+    "SELECT user_id FROM users WHERE user_id > $1 AND blocked_at IS NULL ORDER BY user_id LIMIT $2"
+)
+SQL_RECORDS_FIRST_PAGE = f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY user_id LIMIT $1"
+SQL_RECORDS_NEXT_PAGE = (
+    f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2"
+)
+SQL_RECORD_DAILY_STATS = '''
+    INSERT INTO stats_daily (day, subscribed, unsubscribed, blocked) VALUES ($1, $2, $3, $4)
+    ON CONFLICT (day) DO UPDATE
+    SET subscribed = stats_daily.subscribed + EXCLUDED.subscribed,
+        unsubscribed = stats_daily.unsubscribed + EXCLUDED.unsubscribed,
+        blocked = stats_daily.blocked + EXCLUDED.blocked
+'''
+# Пока счетчика нет (до первой сверки), обновление ничего не меняет
+SQL_ADD_SUBSCRIBERS = "UPDATE stats_counters SET value = value + $1 WHERE name = 'subscribers'"
+
+SQL_APPLIED_MIGRATIONS = "SELECT version FROM schema_migrations"
+SQL_CREATE_MIGRATIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+# Ключ pg_advisory_xact_lock, под которым применяются миграции
+MIGRATIONS_LOCK_ID = 7_410_020
+
+# Миграции схемы: (версия, описание, SQL). Новые добавляются в конец со следующей версией.
+# Миграции 1-7 повторяют схему, которая раньше создавалась при каждом запуске, и написаны
+# с IF NOT EXISTS: база, созданная до появления schema_migrations, проходит их без изменений.
+MIGRATIONS = (
+    (1, "Пользователи и рассылки", '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            subscribed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id BIGSERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            report_chat_id BIGINT,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id BIGINT,
+            done_ahead BIGINT[] NOT NULL DEFAULT '{}',
+            successful INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP WITH TIME ZONE
+        );
+    '''),
+    # Недоступные пользователи (заблокировали бота, удалили аккаунт)
+    # не удаляются, а помечаются и пропускаются при рассылке
+    (2, "Недоступные пользователи", '''
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS pruned INTEGER NOT NULL DEFAULT 0;
+    '''),
+    # Атрибуты для адресных рассылок. Индексы частичные (только активные
+    # подписчики) и заканчиваются на user_id, чтобы keyset-пагинация
+    # по сегменту оставалась индексным сканированием
+    (3, "Сегменты: язык, теги и индексы", '''
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS language_code TEXT;
+        ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS segment JSONB;
+        CREATE TABLE IF NOT EXISTS user_tags (
+            tag TEXT NOT NULL,
+            user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            PRIMARY KEY (tag, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS user_tags_user_id_idx ON user_tags (user_id);
+        CREATE INDEX IF NOT EXISTS users_language_code_idx
+            ON users (language_code, user_id) WHERE blocked_at IS NULL;
+        CREATE INDEX IF NOT EXISTS users_subscribed_at_idx
+            ON users (subscribed_at, user_id) WHERE blocked_at IS NULL;
+        CREATE INDEX IF NOT EXISTS users_sample_bucket_idx
+            ON users ((user_id % 100), user_id) WHERE blocked_at IS NULL;
+    '''),
+    # Содержимое медиа-рассылок: file_id и подписи (см. content.py)
+    (4, "Медиа-рассылки", "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS payload JSONB"),
+    # Отложенные рассылки и ограничение скорости для растянутых рассылок
+    (5, "Отложенные рассылки", '''
+        ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS max_rate DOUBLE PRECISION;
+        CREATE INDEX IF NOT EXISTS broadcasts_scheduled_at_idx
+            ON broadcasts (scheduled_at) WHERE status = 'scheduled';
+    '''),
+    (6, "Состояния FSM и обработанные апдейты", '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id BIGINT PRIMARY KEY,
+            processed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS processed_updates_processed_at_idx
+            ON processed_updates (processed_at);
+    '''),
+    # Статистика: счетчик подписчиков, дневная история и итоги рассылок по типам
+    (7, "Статистика подписчиков", '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL,
+            reconciled_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day DATE PRIMARY KEY,
+            subscribed INTEGER NOT NULL DEFAULT 0,
+            unsubscribed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0
+        );
+        ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS outcomes JSONB;
+    '''),
+    # Контрольная точка рассылки по дате подписки: позиция (subscribed_at, user_id)
+    (8, "Позиция рассылки по дате подписки",
+     "ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS last_subscribed_at TIMESTAMP WITH TIME ZONE"),
+    # Версия записи FSM растет при каждой записи: по ней реплика проверяет свой кэш
+    (9, "Версия записей FSM",
+     "ALTER TABLE fsm_storage ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0"),
+)
+
+
+def _segment_where(segment: Segment) -> Tuple[str, list]:
+    """Условие сегмента с плейсхолдерами $1, $2, ... и значения параметров"""
+    params = []
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    return segment.where(param), params
+
+
+class Database(BaseStorage):
     """Класс для асинхронной работы с базой данных PostgreSQL"""
 
     def __init__(self, db_url: str = DATABASE_URL):
@@ -22,123 +199,689 @@ class Database:
         Args:
             db_url (str): URL для подключения к PostgreSQL
         """
+        super().__init__()
         self.db_url = db_url
         self.pool = None
 
     async def connect(self):
-        """Создание пула соединений и инициализация таблицы"""
-        if not self.pool:
+        """
+        Создание пула соединений и инициализация таблиц.
+
+        При ошибке подключение повторяется с экспоненциальной задержкой.
+        Если все попытки исчерпаны, исключение пробрасывается дальше,
+        чтобы бот не запускался без базы данных.
+        """
+        if self.pool:
+            return
+
+        delay = DB_CONNECT_BACKOFF
+        for attempt in range(1, DB_CONNECT_RETRIES + 1):
             try:
-                self.pool = await asyncpg.create_pool(self.db_url)
+                self.pool = await asyncpg.create_pool(
+                    self.db_url,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=max(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+                    max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+                    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                    command_timeout=DB_COMMAND_TIMEOUT or None,
+                    init=self._init_connection,
+                )
                 logger.info("Пул соединений к PostgreSQL создан успешно")
                 await self.init_database()
+                return
             except Exception as e:
-                logger.error(f"Ошибка при подключении к базе данных: {e}")
+                if self.pool:
+                    await self.pool.close()
+                    self.pool = None
+                if attempt >= DB_CONNECT_RETRIES:
+                    logger.error(f"Не удалось подключиться к базе данных: {e}")
+                    raise
+                logger.warning(
+                    f"Ошибка при подключении к базе данных (попытка {attempt}/{DB_CONNECT_RETRIES}): {e}. "
+                    f"Повтор через {delay:.1f} с"
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    @staticmethod
+    async def _init_connection(conn):
+        """Настройка каждого нового соединения пула"""
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            await conn.execute(f"SET statement_timeout = {int(DB_STATEMENT_TIMEOUT_MS)}")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Получение соединения из пула с учетом времени ожидания и использования"""
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT or None)
+        except asyncio.TimeoutError:
+            self.pool_stats.timeouts += 1
+            raise
+        acquired = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+            self.pool_stats.record(acquired - started, time.perf_counter() - acquired)
+
+    def get_pool_stats(self) -> dict:
+        """Метрики пула соединений"""
+        stats = super().get_pool_stats()
+        if self.pool:
+            stats['size'] = self.pool.get_size()
+            stats['idle'] = self.pool.get_idle_size()
+        return stats
 
     async def init_database(self):
-        """Создание таблицы пользователей, если она не существует"""
-        try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id BIGINT PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        subscribed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                logger.info("Таблица 'users' инициализирована успешно")
+        """
+        Применение миграций схемы, которых еще нет в schema_migrations.
+
+        Если схема актуальна, выполняется один SELECT. Миграции выполняются
+        в одной транзакции под advisory-блокировкой, чтобы процессы-обработчики,
+        запущенные одновременно, не применяли их дважды.
+        """
+        try:
+            async with self.acquire() as conn:
+                try:
+                    applied = {row['version'] for row in await conn.fetch(SQL_APPLIED_MIGRATIONS)}
+                except asyncpg.UndefinedTableError:
+                    applied = set()
+                if all(version in applied for version, _, _ in MIGRATIONS):
+                    logger.info(f"Схема базы данных актуальна (версия {max(applied)})")
+                    return
+
+                async with conn.transaction():
+                    # Блокировка берется до CREATE TABLE: одновременные CREATE TABLE IF NOT EXISTS
+                    # из разных процессов конфликтуют на уникальном индексе системного каталога
+                    await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATIONS_LOCK_ID)
+                    await conn.execute(SQL_CREATE_MIGRATIONS_TABLE)
+                    # Другой процесс мог применить миграции, пока мы ждали блокировку
+                    applied = {row['version'] for row in await conn.fetch(SQL_APPLIED_MIGRATIONS)}
+                    for version, name, sql in MIGRATIONS:
+                        if version in applied:
+                            continue
+                        await conn.execute(sql)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+                        )
+                        logger.info(f"Миграция {version} применена: {name}")
         except Exception as e:
             logger.error(f"Ошибка при инициализации таблицы: {e}")
+            raise
+
+    @staticmethod
+    async def _record_stats(conn, subscribed: int = 0, unsubscribed: int = 0, blocked: int = 0):
+        """Обновление счетчика подписчиков и дневной статистики в текущей транзакции"""
+        if not (subscribed or unsubscribed or blocked):
+            return
+        await conn.execute(SQL_RECORD_DAILY_STATS, stats_day(), subscribed, unsubscribed, blocked)
+        await conn.execute(SQL_ADD_SUBSCRIBERS, subscribed - unsubscribed - blocked)
+
+    async def _insert_users(self, rows: List[Tuple]) -> Set[int]:
+        """Пакетное добавление пользователей одним запросом"""
+        user_ids, usernames, first_names, last_names, languages = (list(column) for column in zip(*rows))
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                # INSERT ... ON CONFLICT - безопасный способ добавить запись, ничего не делая,
+                # если активный пользователь уже существует. Пользователь, ранее отмеченный
+                # как недоступный, снова становится подписчиком.
+                # RETURNING возвращает только вставленные и восстановленные строки.
+                inserted = await conn.fetch(
+                    SQL_INSERT_USERS, user_ids, usernames, first_names, last_names, languages
+                )
+                await self._record_stats(conn, subscribed=len(inserted))
+        return {row['user_id'] for row in inserted}
+
+    async def _delete_users(self, user_ids: List[int]) -> Set[int]:
+        """Пакетное удаление пользователей. Возвращает ID удаленных"""
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                deleted = await conn.fetch(SQL_DELETE_USERS, user_ids)
+                # Недоступные пользователи уже вычтены из счетчика при пометке
+                await self._record_stats(conn, unsubscribed=sum(row['active'] for row in deleted))
+        return {row['user_id'] for row in deleted}
+
+    async def _fetch_subscribed(self, user_id: int) -> bool:
+        async with self.acquire() as conn:
+            return await conn.fetchrow(SQL_IS_SUBSCRIBED, user_id) is not None
+
+    async def get_all_users(self) -> list:
+        """Получение списка ID всех подписанных пользователей"""
+        try:
+            async with self.acquire() as conn:
+                rows = await conn.fetch("SELECT user_id FROM users WHERE blocked_at IS NULL")
+                return [row['user_id'] for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка пользователей: {e}")
+            return []
+
+    async def _iter_id_pages(self, segment: Segment, after: Optional[int],
+                             batch_size: int) -> AsyncIterator[List[int]]:
+        """Keyset-пагинация ID подписчиков сегмента по возрастанию user_id"""
+        if segment:
+            # Текст запроса одинаков для всех страниц рассылки (и для всех частей
+            # сегмента), поэтому он тоже подготавливается один раз на соединение
+            where, params = _segment_where(segment)
+            n = len(params)
+            first_page = f"SELECT user_id FROM users WHERE {where} ORDER BY user_id LIMIT ${n + 1}"
+            next_page = (
+                f"SELECT user_id FROM users WHERE {where} AND user_id > ${n + 1} "
+                f"ORDER BY user_id LIMIT ${n + 2}"
+            )
+        else:
+            first_page, next_page, params = SQL_USERS_FIRST_PAGE, SQL_USERS_NEXT_PAGE, []
+
+        last_id = after
+        while True:
+            async with self.acquire() as conn:
+                if last_id is None:
+                    rows = await conn.fetch(first_page, *params, batch_size)
+                else:
+                    rows = await conn.fetch(next_page, *params, last_id, batch_size)
+            if not rows:
+                return
+
+            batch = [row['user_id'] for row in rows]
+            last_id = batch[-1]
+            yield batch
+
+            if len(batch) < batch_size:
+                return
+
+    async def _iter_subscription_pages(self, segment: Segment, after: Optional[Position],
+                                       batch_size: int) -> AsyncIterator[List[Position]]:
+        """Keyset-пагинация подписчиков сегмента по индексу (subscribed_at, user_id)"""
+        where, params = _segment_where(segment)
+        n = len(params)
+        first_page = (
+            f"SELECT subscribed_at, user_id FROM users WHERE {where} "
+            f"ORDER BY subscribed_at, user_id LIMIT ${n + 1}"
+        )
+        next_page = (
+            f"SELECT subscribed_at, user_id FROM users WHERE {where} "
+            f"AND (subscribed_at, user_id) > (${n + 1}, ${n + 2}) "
+            f"ORDER BY subscribed_at, user_id LIMIT ${n + 3}"
+        )
 
-    async def add_user(self, user_id: int, username: str = None, 
-                       first_name: str = None, last_name: str = None) -> bool:
+        position = after
+        while True:
+            async with self.acquire() as conn:
+                if position is None:
+                    rows = await conn.fetch(first_page, *params, batch_size)
+                else:
+                    rows = await conn.fetch(next_page, *params, *position, batch_size)
+            if not rows:
+                return
+
+            batch = [(row['subscribed_at'], row['user_id']) for row in rows]
+            position = batch[-1]
+            yield batch
+
+            if len(batch) < batch_size:
+                return
+
+    async def get_users_count(self, segment: Optional[Segment] = None) -> int:
+        """Получение количества подписанных пользователей (всех или сегмента)"""
+        where, params = _segment_where(segment or Segment())
+        try:
+            async with self.acquire() as conn:
+                count = await conn.fetchval(f"SELECT COUNT(*) FROM users WHERE {where}", *params)
+                return count
+        except Exception as e:
+            logger.error(f"Ошибка при подсчете пользователей: {e}")
+            return 0
+            
+    async def iter_user_records(self, batch_size: int = BROADCAST_BATCH_SIZE) -> AsyncIterator[List[tuple]]:
         """
-        Добавление пользователя в базу данных.
-        
+        Постраничное чтение всех строк users (включая недоступных) для экспорта.
+
+        Yields:
+            List[tuple]: строки с колонками USER_COLUMNS, по возрастанию user_id
+        """
+        last_id = None
+        while True:
+            async with self.acquire() as conn:
+                if last_id is None:
+                    rows = await conn.fetch(SQL_RECORDS_FIRST_PAGE, batch_size)
+                else:
+                    rows = await conn.fetch(SQL_RECORDS_NEXT_PAGE, last_id, batch_size)
+            if not rows:
+                return
+
+            last_id = rows[-1]['user_id']
+            yield [tuple(row) for row in rows]
+
+            if len(rows) < batch_size:
+                return
+
+    async def import_user_records(self, records: List[tuple]) -> Set[int]:
+        """
+        Загрузка пачки строк users в одной транзакции.
+
+        Строки передаются через COPY во временную таблицу, откуда переносятся
+        в users; пользователи, которые уже есть в базе, не изменяются.
+
+        Args:
+            records: строки с колонками USER_COLUMNS (subscribed_at=None — текущее время)
+
+        Returns:
+            Set[int]: ID добавленных пользователей
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("CREATE TEMP TABLE users_import (LIKE users) ON COMMIT DROP")
+                await conn.copy_records_to_table('users_import', records=records, columns=USER_COLUMNS)
+                inserted = await conn.fetch(f'''
+                    INSERT INTO users ({', '.join(USER_COLUMNS)})
+                    SELECT user_id, username, first_name, last_name, language_code,
+                           COALESCE(subscribed_at, CURRENT_TIMESTAMP), blocked_at
+                    FROM users_import
+                    ON CONFLICT (user_id) DO NOTHING
+                    RETURNING user_id, blocked_at IS NULL AS active
+                ''')
+                # Перенос подписчиков — не новые подписки, поэтому дневная история не меняется
+                await conn.execute(SQL_ADD_SUBSCRIBERS, sum(row['active'] for row in inserted))
+        for row in inserted:
+            self.cache.invalidate(row['user_id'])
+        return {row['user_id'] for row in inserted}
+
+    async def mark_users_unreachable(self, user_ids: List[int]) -> int:
+        """
+        Пометка пользователей, которым невозможно доставить сообщение.
+
+        Returns:
+            int: количество помеченных пользователей
+        """
+        if not user_ids:
+            return 0
+        try:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    result = await conn.execute('''
+                        UPDATE users SET blocked_at = CURRENT_TIMESTAMP
+                        WHERE user_id = ANY($1::bigint[]) AND blocked_at IS NULL
+                    ''', user_ids)
+                    marked = int(result.split()[-1])
+                    await self._record_stats(conn, blocked=marked)
+            for user_id in user_ids:
+                self.cache.set(user_id, False)
+            return marked
+        except Exception as e:
+            logger.error(f"Ошибка при пометке недоступных пользователей: {e}")
+            return 0
+
+    async def get_subscribers_count(self) -> Optional[int]:
+        """
+        Количество подписчиков по счетчику — чтение одной строки.
+
+        Returns:
+            Optional[int]: значение счетчика или None, если он еще не сверялся с таблицей
+        """
+        try:
+            async with self.acquire() as conn:
+                return await conn.fetchval("SELECT value FROM stats_counters WHERE name = 'subscribers'")
+        except Exception as e:
+            logger.error(f"Ошибка при чтении счетчика подписчиков: {e}")
+            return None
+
+    async def reconcile_subscribers_count(self) -> Tuple[Optional[int], int]:
+        """
+        Пересчет счетчика подписчиков по таблице users.
+
+        Записи, выполненные во время подсчета, могут внести небольшое
+        расхождение — оно исправляется следующей сверкой.
+
+        Returns:
+            tuple: (значение счетчика до сверки, фактическое количество)
+        """
+        async with self.acquire() as conn:
+            previous = await conn.fetchval("SELECT value FROM stats_counters WHERE name = 'subscribers'")
+            actual = await conn.fetchval('''
+                INSERT INTO stats_counters (name, value)
+                SELECT 'subscribers', COUNT(*) FROM users WHERE blocked_at IS NULL
+                ON CONFLICT (name) DO UPDATE
+                SET value = EXCLUDED.value, reconciled_at = CURRENT_TIMESTAMP
+                RETURNING value
+            ''')
+        return previous, actual
+
+    async def get_daily_stats(self, days: int) -> list:
+        """Подписки, отписки и недоступные по дням за последние days суток (по возрастанию)"""
+        try:
+            async with self.acquire() as conn:
+                rows = await conn.fetch('''
+                    SELECT day, subscribed, unsubscribed, blocked FROM stats_daily
+                    WHERE day > $1 ORDER BY day
+                ''', stats_day() - timedelta(days=days))
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении дневной статистики: {e}")
+            return []
+
+    async def get_user_tags(self, user_ids: List[int]) -> Dict[int, List[str]]:
+        """
+        Теги пользователей для экспорта.
+
         Returns:
-            bool: True если пользователь добавлен, False если уже существует
+            dict: user_id -> теги по алфавиту (пользователи без тегов пропускаются)
         """
+        if not user_ids:
+            return {}
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT user_id, tag FROM user_tags WHERE user_id = ANY($1::bigint[]) ORDER BY user_id, tag",
+                user_ids,
+            )
+        tags = {}
+        for row in rows:
+            tags.setdefault(row['user_id'], []).append(row['tag'])
+        return tags
+
+    async def tag_users(self, tag: str, user_ids: List[int]) -> int:
+        """
+        Добавление тега пользователям.
+
+        Returns:
+            int: сколько подписчиков получили тег (неизвестные ID пропускаются)
+        """
+        if not user_ids:
+            return 0
         try:
-            async with self.pool.acquire() as conn:
-                # INSERT ... ON CONFLICT DO NOTHING - безопасный способ добавить запись,
-                # ничего не делая, если пользователь уже существует.
+            async with self.acquire() as conn:
                 result = await conn.execute('''
-                    INSERT INTO users (user_id, username, first_name, last_name)
-                    VALUES ($1, $2, $3, $4)
-                    ON CONFLICT (user_id) DO NOTHING
-                ''', user_id, username, first_name, last_name)
-                
-                # result в формате 'INSERT 0 1' означает, что 1 строка добавлена
-                if result == 'INSERT 0 1':
-                    logger.info(f"Пользователь {user_id} добавлен в базу данных")
-                    return True
-                else:
-                    logger.info(f"Пользователь {user_id} уже существует")
-                    return False
+                    INSERT INTO user_tags (tag, user_id)
+                    SELECT $1, user_id FROM users WHERE user_id = ANY($2::bigint[])
+                    ON CONFLICT DO NOTHING
+                ''', tag, user_ids)
+                return int(result.split()[-1])
         except Exception as e:
-            logger.error(f"Ошибка при добавлении пользователя: {e}")
-            return False
+            logger.error(f"Ошибка при добавлении тега {tag}: {e}")
+            return 0
+
+    async def untag_users(self, tag: str, user_ids: List[int]) -> int:
+        """Удаление тега у пользователей. Возвращает количество снятых тегов"""
+        if not user_ids:
+            return 0
+        try:
+            async with self.acquire() as conn:
+                result = await conn.execute(
+                    "DELETE FROM user_tags WHERE tag = $1 AND user_id = ANY($2::bigint[])",
+                    tag, user_ids,
+                )
+                return int(result.split()[-1])
+        except Exception as e:
+            logger.error(f"Ошибка при удалении тега {tag}: {e}")
+            return 0
 
-    async def remove_user(self, user_id: int) -> bool:
+    async def create_broadcast(self, text: str, report_chat_id: int,
+                               segment: Optional[str] = None,
+                               payload: Optional[str] = None,
+                               scheduled_at: Optional[datetime] = None,
+                               max_rate: Optional[float] = None) -> int:
         """
-        Удаление пользователя из базы данных.
-        
+        Создание записи о рассылке. Возвращает ID рассылки.
+
+        Args:
+            text (str): текст рассылки или подпись к медиа
+            segment (str): сегмент получателей в JSON (None — все подписчики)
+            payload (str): содержимое медиа-рассылки в JSON (None — только текст)
+            scheduled_at (datetime): время запуска; рассылка создается со статусом 'scheduled'
+            max_rate (float): ограничение скорости этой рассылки, сообщений в секунду
+        """
+        status = 'scheduled' if scheduled_at else 'running'
+        async with self.acquire() as conn:
+            return await conn.fetchval('''
+                INSERT INTO broadcasts (text, report_chat_id, segment, payload, status, scheduled_at, max_rate)
+                VALUES ($1, $2, $3::jsonb, $4::jsonb, $5, $6, $7)
+                RETURNING id
+            ''', text, report_chat_id, segment, payload, status, scheduled_at, max_rate)
+
+    async def start_scheduled_broadcast(self, broadcast_id: int) -> bool:
+        """
+        Перевод отложенной рассылки в статус 'running'.
+
+        Условное обновление: рассылку запускает только один процесс,
+        а отмененная до запуска рассылка не запускается.
+
         Returns:
-            bool: True если пользователь удален, False если не найден
+            bool: True если рассылка была запланирована и теперь запущена
         """
         try:
-            async with self.pool.acquire() as conn:
-                result = await conn.execute("DELETE FROM users WHERE user_id = $1", user_id)
-                # result в формате 'DELETE 1' означает, что 1 строка удалена
-                if result == 'DELETE 1':
-                    logger.info(f"Пользователь {user_id} удален из базы данных")
-                    return True
-                else:
-                    logger.info(f"Пользователь {user_id} не найден в базе данных")
-                    return False
+            async with self.acquire() as conn:
+                result = await conn.execute('''
+                    UPDATE broadcasts SET status = 'running', updated_at = CURRENT_TIMESTAMP
+                    WHERE id = $1 AND status = 'scheduled'
+                ''', broadcast_id)
+                return result == 'UPDATE 1'
         except Exception as e:
-            logger.error(f"Ошибка при удалении пользователя: {e}")
+            logger.error(f"Ошибка при запуске отложенной рассылки {broadcast_id}: {e}")
             return False
 
-    async def is_user_subscribed(self, user_id: int) -> bool:
-        """Проверка подписки пользователя"""
+    async def save_broadcast_progress(self, broadcast_id: int, last_user_id: Optional[int],
+                                      done_ahead: List[int], successful: int, failed: int,
+                                      status: Optional[str] = None, pruned: int = 0,
+                                      outcomes: Optional[dict] = None,
+                                      last_subscribed_at: Optional[datetime] = None) -> Optional[str]:
+        """
+        Сохранение контрольной точки рассылки.
+
+        Завершенная или отмененная рассылка сохраняет свой статус: отмену
+        могла выполнить команда в другом процессе.
+
+        Args:
+            last_user_id (int): все подписчики до этого ID в порядке чтения сегмента
+                уже обработаны
+            done_ahead (List[int]): обработанные ID после last_user_id
+                (воркеры завершают отправку не строго по порядку)
+            status (str): новый статус рассылки, если он изменился
+            pruned (int): сколько недоступных пользователей помечено
+            outcomes (dict): количество отправок по результатам (см. broadcast.py)
+            last_subscribed_at (datetime): subscribed_at пользователя last_user_id,
+                если сегмент читается по дате подписки (Segment.by_subscription)
+
+        Returns:
+            str: статус рассылки в базе после сохранения (None при ошибке)
+        """
+        try:
+            async with self.acquire() as conn:
+                return await conn.fetchval('''
+                    UPDATE broadcasts
+                    SET last_user_id = $2, done_ahead = $3, successful = $4, failed = $5,
+                        status = CASE WHEN status IN ('completed', 'cancelled')
+                                      THEN status ELSE COALESCE($6, status) END,
+                        pruned = $7,
+                        outcomes = COALESCE($8::jsonb, outcomes),
+                        last_subscribed_at = $9,
+                        updated_at = CURRENT_TIMESTAMP,
+                        finished_at = CASE WHEN $6 IN ('completed', 'cancelled')
+                                                AND status NOT IN ('completed', 'cancelled')
+                                           THEN CURRENT_TIMESTAMP ELSE finished_at END
+                    WHERE id = $1
+                    RETURNING status
+                ''', broadcast_id, last_user_id, done_ahead, successful, failed, status, pruned,
+                    json.dumps(outcomes) if outcomes else None, last_subscribed_at)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении прогресса рассылки {broadcast_id}: {e}")
+            return None
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str,
+                                   expected: Sequence[str] = ()) -> bool:
+        """
+        Изменение статуса рассылки.
+
+        Args:
+            expected: статусы, из которых разрешен переход (пусто — из любого)
+
+        Returns:
+            bool: True если рассылка найдена и статус изменен
+        """
+        condition = "AND status = ANY($3::text[])" if expected else ""
+        params = (broadcast_id, status, list(expected)) if expected else (broadcast_id, status)
         try:
-            async with self.pool.acquire() as conn:
-                user = await conn.fetchrow("SELECT user_id FROM users WHERE user_id = $1", user_id)
-                return user is not None
+            async with self.acquire() as conn:
+                result = await conn.execute(f'''
+                    UPDATE broadcasts
+                    SET status = $2,
+                        updated_at = CURRENT_TIMESTAMP,
+                        finished_at = CASE WHEN $2 IN ('completed', 'cancelled')
+                                           THEN CURRENT_TIMESTAMP ELSE finished_at END
+                    WHERE id = $1 {condition}
+                ''', *params)
+                return result == 'UPDATE 1'
         except Exception as e:
-            logger.error(f"Ошибка при проверке подписки: {e}")
+            logger.error(f"Ошибка при изменении статуса рассылки {broadcast_id}: {e}")
             return False
 
-    async def get_all_users(self) -> list:
-        """Получение списка ID всех подписанных пользователей"""
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        """Получение рассылки по ID"""
         try:
-            async with self.pool.acquire() as conn:
-                rows = await conn.fetch("SELECT user_id FROM users")
-                return [row['user_id'] for row in rows]
+            async with self.acquire() as conn:
+                row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", broadcast_id)
+                return dict(row) if row else None
         except Exception as e:
-            logger.error(f"Ошибка при получении списка пользователей: {e}")
+            logger.error(f"Ошибка при получении рассылки {broadcast_id}: {e}")
+            return None
+
+    async def get_unfinished_broadcasts(self) -> list:
+        """Получение рассылок, которые были прерваны во время выполнения"""
+        try:
+            async with self.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id"
+                )
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении незавершенных рассылок: {e}")
             return []
 
-    async def get_users_count(self) -> int:
-        """Получение количества подписанных пользователей"""
+    async def get_scheduled_broadcasts(self) -> list:
+        """Получение отложенных рассылок в порядке времени запуска"""
         try:
-            async with self.pool.acquire() as conn:
-                count = await conn.fetchval("SELECT COUNT(*) FROM users")
-                return count
+            async with self.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT * FROM broadcasts WHERE status = 'scheduled' ORDER BY scheduled_at"
+                )
+                return [dict(row) for row in rows]
         except Exception as e:
-            logger.error(f"Ошибка при подсчете пользователей: {e}")
+            logger.error(f"Ошибка при получении отложенных рассылок: {e}")
+            return []
+
+    async def get_recent_broadcasts(self, limit: int = 10) -> list:
+        """Получение последних рассылок"""
+        try:
+            async with self.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT * FROM broadcasts ORDER BY id DESC LIMIT $1", limit
+                )
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка рассылок: {e}")
+            return []
+
+    async def get_fsm(self, key: str) -> Optional[Tuple[Optional[str], dict, int]]:
+        """Состояние, данные и версия записи FSM по ключу или None, если записи нет"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT state, data::text AS data, version FROM fsm_storage WHERE key = $1", key
+            )
+        if row is None:
+            return None
+        return row['state'], json.loads(row['data']), row['version']
+
+    async def get_fsm_version(self, key: str) -> int:
+        """Версия записи FSM (0, если записи нет)"""
+        async with self.acquire() as conn:
+            version = await conn.fetchval("SELECT version FROM fsm_storage WHERE key = $1", key)
+        return version or 0
+
+    async def set_fsm_state(self, key: str, state: Optional[str]) -> int:
+        """Сохранение состояния FSM. Возвращает новую версию записи"""
+        async with self.acquire() as conn:
+            return await conn.fetchval('''
+                INSERT INTO fsm_storage (key, state, version) VALUES ($1, $2, 1)
+                ON CONFLICT (key) DO UPDATE
+                SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP,
+                    version = fsm_storage.version + 1
+                RETURNING version
+            ''', key, state)
+
+    async def set_fsm_data(self, key: str, data: dict) -> int:
+        """Сохранение данных FSM. Возвращает новую версию записи"""
+        async with self.acquire() as conn:
+            return await conn.fetchval('''
+                INSERT INTO fsm_storage (key, data, version) VALUES ($1, $2::jsonb, 1)
+                ON CONFLICT (key) DO UPDATE
+                SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP,
+                    version = fsm_storage.version + 1
+                RETURNING version
+            ''', key, json.dumps(data))
+
+    async def claim_update(self, update_id: int) -> bool:
+        """
+        Отметка апдейта как обрабатываемого.
+
+        Returns:
+            bool: True если апдейт встречается впервые, False если он уже обработан
+        """
+        try:
+            async with self.acquire() as conn:
+                claimed = await conn.fetchval('''
+                    INSERT INTO processed_updates (update_id) VALUES ($1)
+                    ON CONFLICT (update_id) DO NOTHING
+                    RETURNING update_id
+                ''', update_id)
+                return claimed is not None
+        except Exception as e:
+            # Лучше обработать апдейт повторно, чем потерять его
+            logger.error(f"Ошибка при отметке апдейта {update_id}: {e}")
+            return True
+
+    async def release_update(self, update_id: int):
+        """Снятие отметки с апдейта, обработка которого завершилась ошибкой"""
+        try:
+            async with self.acquire() as conn:
+                await conn.execute("DELETE FROM processed_updates WHERE update_id = $1", update_id)
+        except Exception as e:
+            logger.error(f"Ошибка при снятии отметки с апдейта {update_id}: {e}")
+
+    async def prune_processed_updates(self, max_age: float) -> int:
+        """Удаление отметок об апдейтах старше max_age секунд"""
+        try:
+            async with self.acquire() as conn:
+                result = await conn.execute(
+                    "DELETE FROM processed_updates WHERE processed_at < NOW() - make_interval(secs => $1)",
+                    float(max_age),
+                )
+                return int(result.split()[-1])
+        except Exception as e:
+            logger.error(f"Ошибка при очистке обработанных апдейтов: {e}")
             return 0
-            
+
     async def close(self):
-        """Закрытие пула соединений"""
+        """Запись накопленных операций и закрытие пула соединений"""
         if self.pool:
+            await self.writer.drain()
             await self.pool.close()
             logger.info("Пул соединений к PostgreSQL закрыт")
 
 
+def create_database(url: Optional[str] = DATABASE_URL) -> BaseStorage:
+    """
+    Создание хранилища по URL.
+
+    postgres:// и postgresql:// — PostgreSQL, sqlite:///путь — SQLite,
+    пустой URL — SQLite в файле DATABASE_NAME.
+    """
+    if url and url.startswith(("postgres://", "postgresql://")):
+        return Database(url)
+    if url and url.startswith("sqlite:///"):
+        return SqliteDatabase(url[len("sqlite:///"):])
+    if url:
+        raise ValueError(f"Неподдерживаемый DATABASE_URL: {url.split(':', 1)[0]}://...")
+    return SqliteDatabase(DATABASE_NAME)
+
+
 # Создаем экземпляр базы данных
 # Теперь подключение будет управляться в основном файле бота
-db = Database()
\ No newline at end of file
+db = create_database()
\ No newline at end of file
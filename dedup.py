@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Отбрасывание повторно доставленных апдейтов.
+
+Telegram повторяет доставку вебхука, если не получил ответ вовремя,
+поэтому один и тот же апдейт может прийти дважды. Middleware запоминает
+update_id в скользящем окне и не передает повтор обработчикам.
+
+Если обработчик завершился ошибкой, отметка снимается: повторная доставка
+того же апдейта будет обработана, а не отброшена.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from config import UPDATE_DEDUP_SHARED, UPDATE_DEDUP_WINDOW
+from metrics import REGISTRY
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DUPLICATE_UPDATES = REGISTRY.counter(
+    "bot_duplicate_updates_total", "Отброшенные повторные доставки апдейтов")
+
+# Максимальное число update_id в памяти, независимо от окна
+MAX_REMEMBERED = 100_000
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    """
+    Внешний middleware для dp.update.
+
+    Локально помнит update_id за последние window секунд. Если shared=True
+    (по умолчанию для PostgreSQL), дополнительно отмечает апдейт в таблице
+    processed_updates, чтобы повтор, пришедший на другую реплику, тоже был отброшен.
+    """
+
+    def __init__(self, storage, window: float = UPDATE_DEDUP_WINDOW,
+                 shared: bool = UPDATE_DEDUP_SHARED):
+        self.storage = storage
+        self.window = window
+        self.shared = shared
+        self._seen = OrderedDict()
+        self._last_prune = time.monotonic()
+        self._prune_task = None
+
+    def _remember(self, update_id: int, now: float) -> bool:
+        """Запомнить update_id. False, если он уже встречался в окне"""
+        seen_at = self._seen.get(update_id)
+        if seen_at is not None and now - seen_at < self.window:
+            return False
+        self._seen[update_id] = now
+        self._seen.move_to_end(update_id)
+
+        # Окно скользящее: самые старые записи в начале словаря
+        while self._seen:
+            oldest_id, oldest_at = next(iter(self._seen.items()))
+            if now - oldest_at < self.window and len(self._seen) <= MAX_REMEMBERED:
+                break
+            del self._seen[oldest_id]
+        return True
+
+    def _schedule_prune(self, now: float):
+        """Раз в окно удалять старые отметки из базы в фоне"""
+        if now - self._last_prune < self.window:
+            return
+        if self._prune_task is not None and not self._prune_task.done():
+            return
+        self._last_prune = now
+        self._prune_task = asyncio.create_task(self.storage.prune_processed_updates(self.window))
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Update,
+                       data: Dict[str, Any]) -> Any:
+        update_id = event.update_id
+        now = time.monotonic()
+
+        duplicate = not self._remember(update_id, now)
+        if not duplicate and self.shared:
+            duplicate = not await self.storage.claim_update(update_id)
+            self._schedule_prune(now)
+
+        if duplicate:
+            DUPLICATE_UPDATES.inc()
+            logger.info(f"Апдейт {update_id} уже обработан, повтор отброшен")
+            return None
+
+        try:
+            return await handler(event, data)
+        except Exception:
+            await self._release(update_id)
+            raise
+
+    async def _release(self, update_id: int):
+        """Забыть апдейт, который не удалось обработать"""
+        self._seen.pop(update_id, None)
+        if self.shared:
+            await self.storage.release_update(update_id)
+        logger.info(f"Обработка апдейта {update_id} не удалась, повторная доставка будет принята")
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище состояний FSM aiogram в базе данных бота.
+
+Состояние и данные сохраняются в таблицу fsm_storage через тот же пул
+соединений (PostgreSQL или SQLite), поэтому переживают перезапуск и видны
+всем репликам.
+
+Каждая запись увеличивает версию строки. Процесс держит в кэше последнюю
+прочитанную или записанную им версию, но перед каждым чтением сверяет ее
+с базой: если запись изменила другая реплика, строка читается заново.
+Кэш экономит перенос и разбор данных, а не сам запрос.
+"""
+
+import copy
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from cache import TTLCache
+from config import FSM_CACHE_SIZE, FSM_CACHE_TTL
+
+
+class DatabaseFSMStorage(BaseStorage):
+    """FSM-хранилище поверх Storage с проверяемым по версии кэшем"""
+
+    def __init__(self, storage, key_builder: Optional[KeyBuilder] = None,
+                 cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL):
+        """
+        Args:
+            storage: хранилище бота (database.db)
+            key_builder: построитель строкового ключа из StorageKey
+            cache_size (int): сколько записей держать в памяти
+            cache_ttl (float): время жизни записи кэша в секундах
+        """
+        self.storage = storage
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        # Ключ -> (состояние, данные, версия записи)
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        record = self.cache.get(key)
+        if record is not None and record[2] != await self.storage.get_fsm_version(key):
+            record = None
+        if record is None:
+            record = await self.storage.get_fsm(key) or (None, {}, 0)
+            self.cache.set(key, record)
+        return record[0], record[1]
+
+    def _remember(self, key: str, version: int, state: Optional[str] = None,
+                  data: Optional[Dict[str, Any]] = None):
+        """
+        Обновить кэш после записи версии version.
+
+        Вторая колонка берется из кэша, только если между кэшированной версией
+        и записью никто другой ключ не менял; иначе запись из кэша удаляется.
+        """
+        record = self.cache.peek(key)
+        if record is None and version == 1:
+            # Запись только что создана этим процессом
+            record = (None, {}, 0)
+        if record is None or record[2] != version - 1:
+            self.cache.invalidate(key)
+            return
+        self.cache.set(key, (
+            record[0] if data is not None else state,
+            record[1] if data is None else data,
+            version,
+        ))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        string_key = self.key_builder.build(key)
+        version = await self.storage.set_fsm_state(string_key, state)
+        self._remember(string_key, version, state=state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        string_key = self.key_builder.build(key)
+        data = copy.deepcopy(data)
+        version = await self.storage.set_fsm_data(string_key, data)
+        self._remember(string_key, version, data=data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        # Копия, чтобы изменения в обработчике не портили кэш
+        return copy.deepcopy(data)
+
+    async def close(self) -> None:
+        # Пул соединений закрывается вместе с базой данных в main
+        self.cache.clear()
@@ -3,14 +3,32 @@
 Обработчики команд для Telegram-бота
 """
 
+import asyncio
 import logging
-from aiogram import Router
-from aiogram.types import Message
-from aiogram.filters import Command
-from aiogram.exceptions import TelegramBadRequest
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from aiogram import F, Router
+from aiogram.types import FSInputFile, Message
+from aiogram.filters import Command, CommandObject
 
-from config import ADMIN_ID
+from config import (
+    ADMIN_ID,
+    SCHEDULE_SPREAD_THRESHOLD,
+    SCHEDULE_SPREAD_WINDOW,
+    SCHEDULE_TIMEZONE,
+    TRANSFER_PROGRESS_INTERVAL,
+)
 from database import db  # db теперь асинхронный
+from broadcast import FAILED, TRANSIENT, UNREACHABLE, broadcaster, load_outcomes
+from content import AlbumMiddleware, MessageContent, albums
+from scheduler import parse_duration, parse_schedule_time, scheduler
+from segments import Segment, TAG_RE, parse_segment
+from stats import reconciler, summarize
+from transfer import CSV, JSONL, detect_format, export_users, import_users
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +36,108 @@ logger = logging.getLogger(__name__)
 
 # Создаем роутер
 router = Router()
+# Элементы альбомов администратора запоминаются до выбора обработчика
+router.message.outer_middleware(AlbumMiddleware(albums, ADMIN_ID))
+
+# Подписи статусов рассылок
+BROADCAST_STATUS_LABELS = {
+    'scheduled': '⏰ запланирована',
+    'running': '▶️ выполняется',
+    'paused': '⏸ приостановлена',
+    'completed': '✅ завершена',
+    'cancelled': '🚫 отменена',
+}
+
+
+# Подписи ошибок отправки в итогах рассылки
+OUTCOME_LABELS = {
+    UNREACHABLE: 'недоступны',
+    TRANSIENT: 'временные ошибки',
+    FAILED: 'прочие ошибки',
+}
+
+# Периоды итогов в /stats (сутки) и сколько последних дней показывать подробно
+STATS_PERIODS = (1, 7, 30)
+STATS_DAILY_ROWS = 7
+
+# Bot API не отдает ботам файлы больше 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+# Выполняющиеся /export и /import: ссылки на задачи, чтобы их не удалил сборщик мусора
+_transfers = set()
+
+
+def _parse_job_id(command: CommandObject):
+    """Получить ID рассылки из аргумента команды, None если он не указан или некорректен"""
+    try:
+        return int(command.args.strip())
+    except Exception:
+        return None
+
+
+def _format_broadcast(row: dict) -> str:
+    """Краткое описание рассылки для администратора"""
+    status = BROADCAST_STATUS_LABELS.get(row['status'], row['status'])
+    segment = Segment.from_json(row.get('segment'))
+    scheduled_at = row.get('scheduled_at') if row['status'] == 'scheduled' else None
+    return (
+        f"#{row['id']} — {status}\n"
+        + (f"🕒 Запуск: {_format_time(scheduled_at)}\n" if scheduled_at else "")
+        + (f"🎯 {segment.describe()}\n" if segment else "")
+        + f"✅ {row['successful']} / ❌ {row['failed']} / 🧹 {row.get('pruned') or 0}, "
+        f"последний обработанный ID: {row['last_user_id'] or '—'}"
+        + (f"\n❌ {_format_failures(row)}" if row['failed'] else "")
+    )
+
+
+def _format_failures(row: dict) -> str:
+    """Ошибки рассылки по типам (для старых рассылок разбивки нет)"""
+    outcomes = load_outcomes(row.get('outcomes'))
+    parts = [f"{label}: {outcomes[outcome]}" for outcome, label in OUTCOME_LABELS.items() if outcomes[outcome]]
+    return ", ".join(parts) if parts else f"ошибок: {row['failed']}"
+
+
+def _format_period(title: str, period) -> str:
+    return (
+        f"{title}: +{period.subscribed} / −{period.unsubscribed} отписались / "
+        f"−{period.blocked} недоступны, прирост {period.net:+d}, отток {period.churn:.1%}"
+    )
+
+
+def _format_time(moment) -> str:
+    """Время в часовом поясе расписания"""
+    return f"{moment.astimezone(ZoneInfo(SCHEDULE_TIMEZONE)):%Y-%m-%d %H:%M} ({SCHEDULE_TIMEZONE})"
+
+
+def _broadcast_request(message: Message, args: str):
+    """
+    Сегмент и содержимое рассылки из аргументов /send и /schedule.
+
+    В ответ на сообщение рассылается оно само (медиа по file_id),
+    иначе — текст после фильтров. Содержимое None, если рассылать нечего.
+
+    Raises:
+        ValueError: если фильтры некорректны
+    """
+    segment, text = parse_segment(args)
+    reply = message.reply_to_message
+    if reply:
+        if text:
+            raise ValueError("При ответе на сообщение после команды можно указать только фильтры.")
+        # Медиа уже загружено в Telegram: рассылка использует его file_id
+        return segment, albums.content_for(reply)
+    return segment, MessageContent.from_text(text) if text else None
+
+
+def _parse_tag_args(command: CommandObject):
+    """Тег и список ID из аргументов /tag и /untag, None если аргументы некорректны"""
+    parts = (command.args or "").split()
+    if len(parts) < 2 or not TAG_RE.match(parts[0]):
+        return None
+    try:
+        return parts[0], [int(part) for part in parts[1:]]
+    except ValueError:
+        return None
 
 
 @router.message(Command("start"))
@@ -30,29 +150,35 @@ async def start_command(message: Message):
     username = message.from_user.username
     first_name = message.from_user.first_name
     last_name = message.from_user.last_name
+    language_code = message.from_user.language_code
     
     try:
-        # Проверяем, подписан ли пользователь
-        if await db.is_user_subscribed(user_id):
+        # Проверяем подписку по кэшу. Если в кэше пусто, сразу пытаемся добавить:
+        # INSERT ... ON CONFLICT сам сообщит, была ли запись, — это один запрос вместо двух
+        if db.cached_subscription(user_id):
+            await message.answer(
+                "✅ Вы уже подписаны на рассылку!\n\n"
+                "Используйте /unsubscribe для отписки."
+            )
+        elif await db.add_user(user_id, username, first_name, last_name, language_code):
+            await message.answer(
+                "🎉 Добро пожаловать!\n\n"
+                "Вы успешно подписались на рассылку.\n"
+                "Используйте /unsubscribe для отписки.\n"
+                "/help - чтобы посмотреть прочие комманды"
+            )
+            logger.info(f"Новый пользователь {user_id} подписался")
+        elif db.cache.peek(user_id):
+            # add_user вернул False, но запись уже была — пользователь подписан
             await message.answer(
                 "✅ Вы уже подписаны на рассылку!\n\n"
                 "Используйте /unsubscribe для отписки."
             )
         else:
-            # Добавляем пользователя в базу данных
-            if await db.add_user(user_id, username, first_name, last_name):
-                await message.answer(
-                    "🎉 Добро пожаловать!\n\n"
-                    "Вы успешно подписались на рассылку.\n"
-                    "Используйте /unsubscribe для отписки.\n"
-                    "/help - чтобы посмотреть прочие комманды"
-                )
-                logger.info(f"Новый пользователь {user_id} подписался")
-            else:
-                await message.answer(
-                    "❌ Произошла ошибка при подписке.\n"
-                    "Попробуйте позже."
-                )
+            await message.answer(
+                "❌ Произошла ошибка при подписке.\n"
+                "Попробуйте позже."
+            )
     except Exception as e:
         logger.error(f"Ошибка в start_command: {e}")
         await message.answer(
@@ -88,10 +214,11 @@ async def unsubscribe_command(message: Message):
 
 
 @router.message(Command("send"))
-async def send_command(message: Message):
+async def send_command(message: Message, command: CommandObject):
     """
     Обработчик команды /send
-    Отправляет сообщение всем подписанным пользователям
+    Отправляет сообщение всем подписанным пользователям или сегменту.
+    В ответ на сообщение рассылает его самого: текст, медиа или альбом
     Доступно только администратору
     """
     # Проверяем права администратора
@@ -99,53 +226,36 @@ async def send_command(message: Message):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
     
-    # Извлекаем текст сообщения
-    if not message.text or len(message.text.split()) < 2:
+    try:
+        segment, content = _broadcast_request(message, command.args or "")
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    if content is None:
         await message.answer(
-            "📝 Использование: /send <текст сообщения>\n\n"
-            "Пример: /send Привет всем! Это тестовая рассылка."
+            "📝 Использование: /send [фильтры] <текст сообщения>\n"
+            "или ответьте /send [фильтры] на сообщение с фото, видео, документом или альбомом\n\n"
+            "Фильтры: lang:ru,en since:2024-05-01 tag:vip sample:10% (или sample:10-20%)\n\n"
+            "Пример: /send Привет всем! Это тестовая рассылка.\n"
+            "Пример: /send lang:ru sample:5% Тестовая рассылка на 5% русскоязычных."
         )
         return
     
-    message_text = message.text.split(' ', 1)[1]
-    
     try:
-        # Получаем список всех пользователей
-        users = await db.get_all_users()
-        if not users:
+        users_count = await db.get_users_count(segment)
+        if not users_count:
             await message.answer("📭 Нет подписанных пользователей для рассылки.")
             return
         
-        # Отправляем сообщение каждому пользователю
-        successful_sends = 0
-        failed_sends = 0
-        total_users = len(users)
-        
-        await message.answer(f"📤 Начинаю рассылку для {total_users} пользователей...")
-        
-        for user_id_to_send in users:
-            try:
-                await message.bot.send_message(user_id_to_send, message_text)
-                successful_sends += 1
-            except TelegramBadRequest as e:
-                # Пользователь заблокировал бота или чат не найден
-                failed_sends += 1
-                logger.warning(f"Не удалось отправить сообщение пользователю {user_id_to_send}: {e}")
-            except Exception as e:
-                failed_sends += 1
-                logger.error(f"Ошибка при отправке сообщения пользователю {user_id_to_send}: {e}")
-        
-        # Отправляем отчет администратору
-        report = (
-            f"📊 Рассылка завершена!\n\n"
-            f"✅ Успешно отправлено: {successful_sends}\n"
-            f"❌ Не удалось отправить: {failed_sends}\n"
-            f"📝 Всего пользователей: {total_users}"
+        # Рассылка идет в фоне и читает подписчиков из базы порциями,
+        # отчет придет по завершении
+        job = await broadcaster.create(message.bot, message.chat.id, content, segment)
+        await message.answer(
+            f"📤 Рассылка #{job.id} ({content.describe()}) запущена для {users_count} пользователей...\n"
+            f"🎯 Получатели: {segment.describe()}\n\n"
+            f"Управление: /job {job.id}, /pause {job.id}, /cancel {job.id}"
         )
         
-        await message.answer(report)
-        logger.info(f"Рассылка завершена: {successful_sends} успешно, {failed_sends} ошибок")
-        
     except Exception as e:
         logger.error(f"Ошибка в send_command: {e}")
         await message.answer(
@@ -153,11 +263,61 @@ async def send_command(message: Message):
         )
 
 
+@router.message(Command("schedule"))
+async def schedule_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /schedule <время> [spread:<длительность>] [фильтры] <текст>
+    Планирует рассылку на указанное время (также в ответ на сообщение с медиа)
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    try:
+        scheduled_at, rest = parse_schedule_time(command.args or "")
+        spread = None
+        if rest.startswith("spread:"):
+            token, _, rest = rest.partition(" ")
+            spread = parse_duration(token[len("spread:"):])
+        segment, content = _broadcast_request(message, rest)
+    except ValueError as e:
+        await message.answer(
+            f"❌ {e}\n\n"
+            "📝 Использование: /schedule <время> [spread:30m] [фильтры] <текст>\n"
+            "Время: +30m, +2h, 18:30 или 2024-06-01 18:30"
+        )
+        return
+    if content is None:
+        await message.answer("📝 Использование: /schedule <время> [spread:30m] [фильтры] <текст>")
+        return
+    
+    try:
+        users_count = await db.get_users_count(segment)
+        # Крупную рассылку растягиваем во времени, чтобы не создавать пик
+        # запросов к Bot API и к базе данных
+        if spread is None:
+            spread = SCHEDULE_SPREAD_WINDOW if users_count > SCHEDULE_SPREAD_THRESHOLD else 0
+        max_rate = users_count * content.cost / spread if spread and users_count else None
+        
+        job_id = await broadcaster.schedule(message.chat.id, content, scheduled_at, segment, max_rate)
+        scheduler.add(job_id, scheduled_at)
+        await message.answer(
+            f"⏰ Рассылка #{job_id} ({content.describe()}) запланирована на {_format_time(scheduled_at)}\n"
+            f"🎯 Получатели: {segment.describe()} (сейчас {users_count})\n"
+            + (f"🐢 Растянута на {spread / 60:.0f} мин (до {max_rate:.1f} сообщ./с)\n" if max_rate else "")
+            + f"\nОтменить: /cancel {job_id}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в schedule_command: {e}")
+        await message.answer("❌ Произошла ошибка при планировании рассылки. Попробуйте позже.")
+
+
 @router.message(Command("stats"))
 async def stats_command(message: Message):
     """
     Обработчик команды /stats
-    Показывает статистику подписок
+    Показывает число подписчиков, динамику подписок по дням и итоги последней рассылки
     Доступно только администратору
     """
     # Проверяем права администратора
@@ -166,10 +326,46 @@ async def stats_command(message: Message):
         return
     
     try:
-        users_count = await db.get_users_count()
+        # Счетчик и дневная история вместо COUNT(*) по всей таблице users
+        users_count = await reconciler.subscribers()
+        history = await db.get_daily_stats(max(STATS_PERIODS))
+        periods = "\n".join(
+            _format_period("📈 Сегодня" if days == 1 else f"📅 {days} дн.", summarize(history, users_count, days))
+            for days in STATS_PERIODS
+        )
+        daily = "\n".join(
+            f"  {row['day']:%d.%m}: +{row['subscribed']} −{row['unsubscribed']} 🚫{row['blocked']}"
+            for row in history[-STATS_DAILY_ROWS:]
+        )
+
+        # Итоги последней рассылки (для идущей в этом процессе — актуальные)
+        last_broadcast = ""
+        recent = await db.get_recent_broadcasts(limit=1)
+        if recent:
+            job = broadcaster.get_job(recent[0]['id'])
+            row = job.snapshot() if job else recent[0]
+            total = row['successful'] + row['failed']
+            last_broadcast = (
+                f"📬 Последняя рассылка #{row['id']}: доставлено {row['successful']} из {total}"
+                + (f" ({row['successful'] / total:.1%})" if total else "")
+                + (f"\n❌ {_format_failures(row)}" if row['failed'] else "")
+                + "\n\n"
+            )
+
+        cache_stats = db.cache.stats()
+        pool_stats = db.get_pool_stats()
         await message.answer(
             f"📊 Статистика бота:\n\n"
-            f"👥 Всего подписчиков: {users_count}"
+            f"👥 Всего подписчиков: {users_count}\n\n"
+            f"{periods}\n"
+            + (f"\n🗓 По дням:\n{daily}\n" if daily else "")
+            + "\n"
+            + last_broadcast
+            + f"🗂 Кэш подписок: {cache_stats['size']}/{cache_stats['max_size']}, "
+            f"попаданий {cache_stats['hits']}, промахов {cache_stats['misses']} "
+            f"({cache_stats['hit_ratio']:.0%})\n"
+            f"🔌 Пул БД: {pool_stats.get('size', 0)} соединений, свободно {pool_stats.get('idle', 0)}, "
+            f"ожидание {pool_stats['wait_avg'] * 1000:.1f} мс (макс. {pool_stats['wait_max'] * 1000:.1f} мс)"
         )
     except Exception as e:
         logger.error(f"Ошибка в stats_command: {e}")
@@ -178,6 +374,278 @@ async def stats_command(message: Message):
         )
 
 
+@router.message(Command("jobs"))
+async def jobs_command(message: Message):
+    """
+    Обработчик команды /jobs
+    Показывает последние рассылки
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    rows = await db.get_recent_broadcasts()
+    if not rows:
+        await message.answer("📭 Рассылок еще не было.")
+        return
+    
+    # Для рассылок, идущих в этом процессе, показываем актуальный прогресс
+    lines = []
+    for row in rows:
+        job = broadcaster.get_job(row['id'])
+        lines.append(_format_broadcast(job.snapshot() if job else row))
+    await message.answer("📋 Последние рассылки:\n\n" + "\n\n".join(lines))
+
+
+@router.message(Command("job"))
+async def job_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /job <id>
+    Показывает состояние рассылки
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    job_id = _parse_job_id(command)
+    if job_id is None:
+        await message.answer("📝 Использование: /job <номер рассылки>")
+        return
+    
+    job = broadcaster.get_job(job_id)
+    row = job.snapshot() if job else await db.get_broadcast(job_id)
+    if row is None:
+        await message.answer(f"❓ Рассылка #{job_id} не найдена.")
+        return
+    
+    await message.answer("📊 " + _format_broadcast(row))
+
+
+@router.message(Command("pause"))
+async def pause_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /pause <id>
+    Приостанавливает рассылку
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    job_id = _parse_job_id(command)
+    if job_id is None:
+        await message.answer("📝 Использование: /pause <номер рассылки>")
+        return
+    
+    if await broadcaster.pause(job_id):
+        await message.answer(
+            f"⏸ Рассылка #{job_id} приостановлена.\n"
+            f"Используйте /resume {job_id} для продолжения."
+        )
+    else:
+        await message.answer(f"ℹ️ Рассылка #{job_id} сейчас не выполняется.")
+
+
+@router.message(Command("resume"))
+async def resume_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /resume <id>
+    Продолжает приостановленную рассылку
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    job_id = _parse_job_id(command)
+    if job_id is None:
+        await message.answer("📝 Использование: /resume <номер рассылки>")
+        return
+    
+    try:
+        if await broadcaster.resume(message.bot, job_id):
+            await message.answer(f"▶️ Рассылка #{job_id} продолжена.")
+        else:
+            await message.answer(f"ℹ️ Рассылка #{job_id} не приостановлена.")
+    except Exception as e:
+        logger.error(f"Ошибка в resume_command: {e}")
+        await message.answer("❌ Произошла ошибка. Попробуйте позже.")
+
+
+@router.message(Command("cancel"))
+async def cancel_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /cancel <id>
+    Отменяет рассылку
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    job_id = _parse_job_id(command)
+    if job_id is None:
+        await message.answer("📝 Использование: /cancel <номер рассылки>")
+        return
+    
+    if await broadcaster.cancel(job_id):
+        await message.answer(f"🚫 Рассылка #{job_id} отменена.")
+    else:
+        await message.answer(f"ℹ️ Рассылка #{job_id} уже завершена или не найдена.")
+
+
+@router.message(Command("tag"))
+async def tag_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /tag <тег> <id> [id ...]
+    Добавляет тег подписчикам для адресных рассылок
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    parsed = _parse_tag_args(command)
+    if parsed is None:
+        await message.answer("📝 Использование: /tag <тег> <id пользователя> [id ...]")
+        return
+    
+    tag, user_ids = parsed
+    tagged = await db.tag_users(tag, user_ids)
+    await message.answer(f"🏷 Тег «{tag}» добавлен пользователям: {tagged} из {len(user_ids)}.")
+
+
+@router.message(Command("untag"))
+async def untag_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /untag <тег> <id> [id ...]
+    Снимает тег с подписчиков
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    parsed = _parse_tag_args(command)
+    if parsed is None:
+        await message.answer("📝 Использование: /untag <тег> <id пользователя> [id ...]")
+        return
+    
+    tag, user_ids = parsed
+    removed = await db.untag_users(tag, user_ids)
+    await message.answer(f"🏷 Тег «{tag}» снят у пользователей: {removed} из {len(user_ids)}.")
+
+
+def _start_transfer(coro):
+    """Запустить выгрузку или загрузку в фоне, не занимая обработчик апдейтов"""
+    task = asyncio.create_task(coro)
+    _transfers.add(task)
+    task.add_done_callback(_transfers.discard)
+
+
+class _TransferProgress:
+    """Сообщение о ходе /export и /import, обновляется не чаще TRANSFER_PROGRESS_INTERVAL"""
+
+    def __init__(self, status: Message, title: str):
+        self.status = status
+        self.title = title
+        self._updated_at = time.monotonic()
+
+    async def __call__(self, rows: int):
+        now = time.monotonic()
+        if now - self._updated_at < TRANSFER_PROGRESS_INTERVAL:
+            return
+        self._updated_at = now
+        try:
+            await self.status.edit_text(f"⏳ {self.title}: обработано строк {rows}...")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение о ходе переноса: {e}")
+
+
+async def _run_export(message: Message, status: Message, fmt: str):
+    directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="export-")
+    path = os.path.join(directory, f"users-{datetime.now():%Y%m%d-%H%M%S}.{fmt}.gz")
+    try:
+        count = await export_users(db, path, fmt, progress=_TransferProgress(status, "Выгрузка"))
+        await message.answer_document(FSInputFile(path), caption=f"📦 Выгружено пользователей: {count}")
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте пользователей: {e}")
+        await message.answer(f"❌ Не удалось выгрузить пользователей: {e}")
+    finally:
+        await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+
+
+async def _run_import(message: Message, status: Message, document, fmt: str):
+    file_name = document.file_name
+    directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="import-")
+    path = os.path.join(directory, os.path.basename(file_name))
+    try:
+        await message.bot.download(document, destination=path, timeout=120)
+        report = await import_users(db, path, fmt, progress=_TransferProgress(status, f"Импорт из {file_name}"))
+        await message.answer(f"📥 Импорт из {file_name} завершен.\n\n{report.summary()}")
+    except Exception as e:
+        logger.error(f"Ошибка при импорте пользователей из {file_name}: {e}")
+        await message.answer(f"❌ Не удалось загрузить пользователей: {e}")
+    finally:
+        await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+
+
+@router.message(Command("export"))
+async def export_command(message: Message, command: CommandObject):
+    """
+    Обработчик команды /export [csv|jsonl]
+    Присылает файл со всеми пользователями (сжатый gzip). Выгрузка идет
+    в фоне, о ходе сообщает обновляемое сообщение
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    fmt = (command.args or CSV).strip().lower()
+    if fmt not in (CSV, JSONL):
+        await message.answer("📝 Использование: /export [csv|jsonl]")
+        return
+
+    status = await message.answer("⏳ Выгрузка пользователей начата...")
+    _start_transfer(_run_export(message, status, fmt))
+
+
+@router.message(Command("import"))
+async def import_command(message: Message):
+    """
+    Обработчик команды /import
+    Загружает пользователей из файла .csv или .jsonl (можно .gz): команда
+    в подписи к файлу или в ответ на сообщение с файлом. Загрузка идет
+    в фоне, о ходе сообщает обновляемое сообщение
+    Доступно только администратору
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if document is None:
+        await message.answer("📝 Отправьте файл .csv или .jsonl с подписью /import или ответьте /import на сообщение с файлом.")
+        return
+
+    file_name = document.file_name or ""
+    try:
+        fmt = detect_format(file_name)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("❌ Файл больше 20 МБ: боты не могут скачивать такие файлы. "
+                             "Сожмите его (.gz) или загрузите командой python transfer.py import.")
+        return
+
+    status = await message.answer(f"⏳ Импорт из {file_name} начат...")
+    _start_transfer(_run_import(message, status, document, fmt))
+
+
 # Команды /help и обработчик неизвестных команд остаются без изменений,
 # так как они не взаимодействуют с базой данных.
 @router.message(Command("help"))
@@ -198,13 +666,33 @@ async def help_command(message: Message):
     if is_admin:
         help_text += (
             "\n\n🔧 Команды администратора:\n"
-            "📤 /send <текст> - Отправить рассылку всем подписчикам\n"
-            "📊 /stats - Показать статистику подписок"
+            "📤 /send [фильтры] <текст> - Отправить рассылку всем подписчикам или сегменту\n"
+            "🖼 /send [фильтры] в ответ на сообщение - Разослать фото, видео, документ или альбом\n"
+            "⏰ /schedule <время> [фильтры] <текст> - Запланировать рассылку\n"
+            "🏷 /tag, /untag <тег> <id ...> - Управление тегами подписчиков\n"
+            "📦 /export [csv|jsonl] - Выгрузить пользователей в файл\n"
+            "📥 /import - Загрузить пользователей из файла (в подписи к файлу)\n"
+            "📊 /stats - Показать статистику подписок\n"
+            "📋 /jobs - Последние рассылки\n"
+            "🔎 /job <id> - Состояние рассылки\n"
+            "⏸ /pause <id> - Приостановить рассылку\n"
+            "▶️ /resume <id> - Продолжить рассылку\n"
+            "🚫 /cancel <id> - Отменить рассылку"
         )
     
     await message.answer(help_text)
 
 
+# Регистрируется после всех команд: элемент альбома с командой в подписи
+# (например, /import у файла) должен попасть в обработчик команды
+@router.message(F.media_group_id, F.from_user.id == ADMIN_ID)
+async def admin_album_message(message: Message):
+    """
+    Элементы альбомов администратора без команды остаются без ответа
+    Их уже запомнил AlbumMiddleware для /send в ответ на альбом
+    """
+
+
 @router.message()
 async def handle_unknown_message(message: Message):
     """
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Прием апдейтов из вебхука через очередь.
+
+Вебхук только проверяет секрет, кладет апдейт в очередь и сразу отвечает
+Telegram 200 OK. Обработку выполняет пул обработчиков. Апдейты одного чата
+всегда попадают в один и тот же обработчик и выполняются по порядку.
+
+Бэкенды очереди:
+- AsyncioUpdateQueue — задачи asyncio в текущем процессе;
+- ProcessUpdateQueue — отдельные процессы со своим ботом и пулом БД,
+  чтобы использовать несколько ядер. Рассылки в этом режиме выполняет
+  только основной процесс: процессы-обработчики передают ему события
+  рассылок через обратную очередь (см. scheduler.py).
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from config import (
+    SUBSCRIPTION_CACHE_PROCESS_TTL,
+    UPDATE_QUEUE_BACKEND,
+    UPDATE_QUEUE_SIZE,
+    UPDATE_WORKER_METRICS_INTERVAL,
+    UPDATE_WORKERS,
+    WEBHOOK_SECRET,
+)
+from metrics import REGISTRY
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Как долго поток ждет событие процессов-обработчиков, прежде чем проверить остановку
+EVENT_POLL_TIMEOUT = 0.5
+# Событие с метриками процесса-обработчика: (METRICS_EVENT, номер процесса, снимок)
+METRICS_EVENT = 'metrics'
+
+UPDATES_QUEUED = REGISTRY.counter(
+    "bot_ingest_updates_total", "Апдейты, принятые вебхуком в очередь", ("result",))
+
+
+def chat_key(update: Dict[str, Any]) -> int:
+    """
+    Ключ упорядочивания апдейта: ID чата, а если его нет — ID пользователя.
+
+    Апдейты без чата и пользователя распределяются по update_id.
+    """
+    for name, payload in update.items():
+        if name == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user and "id" in user:
+            return user["id"]
+    return update.get("update_id", 0)
+
+
+class UpdateQueue:
+    """Общая часть бэкендов очереди: прием вебхука и распределение по обработчикам"""
+
+    def __init__(self, workers: int = UPDATE_WORKERS, max_size: int = UPDATE_QUEUE_SIZE,
+                 secret_token: Optional[str] = WEBHOOK_SECRET or None):
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self.secret_token = secret_token
+        self.accepting = False
+        REGISTRY.gauge(
+            "bot_ingest_queue_size", "Апдейты в очередях обработчиков", ("worker",),
+            callback=lambda: {(str(i),): size for i, size in enumerate(self.sizes())},
+        )
+
+    def _shard(self, update: Dict[str, Any]) -> int:
+        return hash(chat_key(update)) % self.workers
+
+    def put(self, update: Dict[str, Any]) -> bool:
+        """Положить апдейт в очередь. False, если очередь обработчика переполнена"""
+        raise NotImplementedError
+
+    def sizes(self) -> List[int]:
+        """Длина очереди каждого обработчика"""
+        raise NotImplementedError
+
+    async def start(self):
+        self.accepting = True
+
+    async def stop(self, timeout: float) -> bool:
+        """
+        Перестать принимать апдейты и дождаться обработки очереди.
+
+        Returns:
+            bool: True если очередь обработана до истечения timeout
+        """
+        raise NotImplementedError
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Обработчик вебхука: подтверждает апдейт сразу после постановки в очередь"""
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=401, text="Unauthorized")
+
+        if not self.accepting:
+            # Очередь еще не запущена или уже останавливается: Telegram повторит доставку позже
+            UPDATES_QUEUED.inc("rejected")
+            return web.Response(status=503, text="Not accepting updates")
+
+        try:
+            update = await request.json()
+        except Exception:
+            return web.Response(status=400, text="Bad request")
+
+        if not self.put(update):
+            UPDATES_QUEUED.inc("overflow")
+            logger.warning("Очередь апдейтов переполнена, Telegram повторит доставку")
+            return web.Response(status=503, text="Queue is full")
+
+        UPDATES_QUEUED.inc("accepted")
+        return web.Response(text="ok")
+
+
+class AsyncioUpdateQueue(UpdateQueue):
+    """Обработчики — задачи asyncio в текущем процессе"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, **kwargs):
+        super().__init__(**kwargs)
+        self.dp = dp
+        self.bot = bot
+        self._queues = [asyncio.Queue(maxsize=self.max_size) for _ in range(self.workers)]
+        self._tasks = []
+
+    def put(self, update: Dict[str, Any]) -> bool:
+        try:
+            self._queues[self._shard(update)].put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def sizes(self) -> List[int]:
+        return [q.qsize() for q in self._queues]
+
+    async def _worker(self, updates: asyncio.Queue):
+        while True:
+            update = await updates.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+            finally:
+                updates.task_done()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        await super().start()
+        logger.info(f"Запущено обработчиков апдейтов: {self.workers}")
+
+    async def stop(self, timeout: float) -> bool:
+        self.accepting = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+            drained = True
+        except asyncio.TimeoutError:
+            drained = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        return drained
+
+
+def _process_worker_main(index: int, updates: multiprocessing.Queue, events: multiprocessing.Queue):
+    """Точка входа процесса-обработчика"""
+    # Ctrl-C получает вся группа процессов. Обработчик не прерывается сам,
+    # а дорабатывает очередь до сигнала завершения от основного процесса
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_process_worker(index, updates, events))
+
+
+async def _push_metrics(index: int, events: multiprocessing.Queue, interval: float):
+    """Периодически отправлять метрики процесса основному процессу"""
+    while True:
+        await asyncio.sleep(interval)
+        events.put((METRICS_EVENT, index, REGISTRY.snapshot()))
+
+
+async def _process_worker(index: int, updates: multiprocessing.Queue, events: multiprocessing.Queue):
+    # Процесс запущен через spawn, поэтому бот, диспетчер и пул БД создаются заново
+    from bootstrap import create_bot, create_dispatcher
+    from database import db
+    from scheduler import scheduler
+
+    await db.connect()
+    bot = create_bot()
+    dp = create_dispatcher(bot)
+    # Рассылки и планировщик работают только в основном процессе: команды
+    # этого процесса создают рассылки и меняют их статус в базе, а события
+    # о новых и продолженных рассылках уходят основному процессу
+    scheduler.forward_to(events.put)
+    db.cache.share(SUBSCRIPTION_CACHE_PROCESS_TTL)
+    pusher = asyncio.create_task(_push_metrics(index, events, UPDATE_WORKER_METRICS_INTERVAL))
+    loop = asyncio.get_running_loop()
+    logger.info(f"Процесс-обработчик апдейтов #{index} запущен")
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            try:
+                await dp.feed_raw_update(bot, json.loads(raw))
+            except Exception as e:
+                logger.error(f"Ошибка при обработке апдейта в процессе #{index}: {e}")
+    finally:
+        pusher.cancel()
+        await bot.session.close()
+        await db.close()
+
+
+class ProcessUpdateQueue(UpdateQueue):
+    """
+    Обработчики — отдельные процессы, апдейты передаются через multiprocessing.Queue.
+
+    Обратная очередь events несет события рассылок от процессов-обработчиков
+    и снимки их метрик: события основной процесс передает в on_event по мере
+    поступления, а метрики добавляет к своим (см. metrics.Registry.merge).
+    """
+
+    def __init__(self, on_event: Optional[Callable[[tuple], Awaitable[None]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(maxsize=self.max_size) for _ in range(self.workers)]
+        self._events = self._context.Queue()
+        self.on_event = on_event
+        self._listening = False
+        self._listener = None
+        self._processes = []
+
+    def put(self, update: Dict[str, Any]) -> bool:
+        try:
+            self._queues[self._shard(update)].put_nowait(json.dumps(update))
+            return True
+        except queue.Full:
+            return False
+
+    def sizes(self) -> List[int]:
+        try:
+            return [q.qsize() for q in self._queues]
+        except NotImplementedError:
+            # qsize недоступен на macOS
+            return []
+
+    async def start(self):
+        for index, updates in enumerate(self._queues):
+            process = self._context.Process(
+                target=_process_worker_main, args=(index, updates, self._events),
+                name=f"update-worker-{index}", daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        self._listening = True
+        self._listener = asyncio.create_task(self._listen())
+        await super().start()
+        logger.info(f"Запущено процессов-обработчиков апдейтов: {self.workers}")
+
+    def _next_event(self) -> Optional[tuple]:
+        try:
+            return self._events.get(timeout=EVENT_POLL_TIMEOUT)
+        except queue.Empty:
+            return None
+
+    async def _listen(self):
+        """Передавать события процессов-обработчиков в on_event"""
+        loop = asyncio.get_running_loop()
+        while self._listening:
+            # Ожидание с таймаутом, чтобы поток не остался заблокированным после stop
+            event = await loop.run_in_executor(None, self._next_event)
+            if event is None:
+                continue
+            if event[0] == METRICS_EVENT:
+                _, index, snapshot = event
+                REGISTRY.merge(str(index), snapshot)
+                continue
+            if self.on_event is None:
+                continue
+            try:
+                await self.on_event(event)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке события {event}: {e}")
+
+    @staticmethod
+    async def _put_stop_signal(updates: multiprocessing.Queue, deadline: float) -> bool:
+        """
+        Поставить сигнал завершения, не блокируя цикл событий.
+
+        Если очередь заполнена, место освобождает процесс-обработчик;
+        ждем этого до deadline, после чего процесс будет остановлен.
+        """
+        while True:
+            try:
+                updates.put_nowait(None)
+                return True
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    return False
+                await asyncio.sleep(0.05)
+
+    async def stop(self, timeout: float) -> bool:
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        # Сигнал завершения встает в очередь после уже принятых апдейтов
+        await asyncio.gather(*(self._put_stop_signal(updates, deadline) for updates in self._queues))
+
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+
+        drained = True
+        for process in self._processes:
+            if process.is_alive():
+                drained = False
+                process.terminate()
+
+        # Необработанные события не теряются: рассылки уже в базе, и основной
+        # процесс загрузит их при следующем запуске
+        self._listening = False
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        return drained
+
+
+def create_update_queue(dp: Dispatcher, bot: Bot, backend: str = UPDATE_QUEUE_BACKEND,
+                        on_event: Optional[Callable[[tuple], Awaitable[None]]] = None) -> UpdateQueue:
+    """
+    Очередь апдейтов выбранного бэкенда.
+
+    on_event получает события рассылок от процессов-обработчиков (только для process)
+    """
+    if backend == "process":
+        return ProcessUpdateQueue(on_event=on_event)
+    if backend != "asyncio":
+        logger.warning(f"Неизвестный UPDATE_QUEUE_BACKEND={backend}, используется asyncio")
+    return AsyncioUpdateQueue(dp, bot)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Остановка процесса бота по сигналу.
+
+Render, Heroku и Railway останавливают сервис сигналом SIGTERM и через
+некоторое время завершают процесс принудительно. Lifecycle ловит SIGTERM
+и SIGINT и останавливает бота по шагам, укладываясь в SHUTDOWN_TIMEOUT:
+
+1. вебхук перестает принимать апдейты (Telegram получает 503 и повторит доставку);
+2. уже принятые апдейты дорабатываются обработчиками очереди;
+3. останавливаются планировщик и фоновая сверка статистики;
+4. рассылки завершают начатые отправки и сохраняют контрольную точку;
+5. закрываются aiohttp-сервер, сессия бота и пул соединений с базой.
+
+Ошибка на одном шаге не мешает выполнить следующие.
+"""
+
+import asyncio
+import logging
+import signal
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from broadcast import broadcaster
+from config import SHUTDOWN_TIMEOUT
+from database import db
+from ingestion import UpdateQueue
+from scheduler import scheduler
+from stats import reconciler
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """Ожидание сигнала остановки и упорядоченное завершение работы"""
+
+    def __init__(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """
+        Args:
+            timeout (float): сколько секунд дается на остановку
+        """
+        self.timeout = timeout
+        self._stop = asyncio.Event()
+
+    def install_signal_handlers(self):
+        """Перехватить SIGTERM и SIGINT (на Windows сигналы в цикле событий недоступны)"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    def request_stop(self, sig: Optional[signal.Signals] = None):
+        if not self._stop.is_set():
+            logger.info(f"🛑 Получен сигнал {sig.name if sig else 'остановки'}, останавливаю бота...")
+        self._stop.set()
+
+    async def wait(self):
+        """Дождаться сигнала остановки"""
+        await self._stop.wait()
+
+    @staticmethod
+    async def _step(name: str, coro):
+        try:
+            return await coro
+        except Exception as e:
+            logger.error(f"Ошибка при остановке ({name}): {e}")
+            return None
+
+    async def shutdown(self, bot: Optional[Bot] = None,
+                       update_queue: Optional[UpdateQueue] = None,
+                       runner: Optional[web.AppRunner] = None) -> float:
+        """
+        Остановить бота. Части, которые не были запущены, передаются как None.
+
+        Returns:
+            float: длительность остановки в секундах
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        if update_queue is not None:
+            drained = await self._step("очередь апдейтов", update_queue.stop(timeout=remaining()))
+            drain_time = time.monotonic() - started
+            if drained:
+                logger.info(f"📥 Очередь апдейтов обработана за {drain_time:.1f} с")
+            else:
+                lost = sum(update_queue.sizes() or [0])
+                logger.warning(
+                    f"📥 Очередь апдейтов не обработана за {drain_time:.1f} с, "
+                    f"не обработано апдейтов: {lost}"
+                )
+
+        await self._step("планировщик", scheduler.stop())
+        await self._step("сверка статистики", reconciler.stop())
+
+        stopped = await self._step("рассылки", broadcaster.shutdown(timeout=remaining()))
+        if stopped:
+            logger.info(f"📤 Рассылок сохранено и продолжится после перезапуска: {stopped}")
+
+        if runner is not None:
+            await self._step("веб-сервер", runner.cleanup())
+        if bot is not None:
+            await self._step("сессия бота", bot.session.close())
+        await self._step("база данных", db.close())
+
+        elapsed = time.monotonic() - started
+        logger.info(f"👋 Бот остановлен за {elapsed:.1f} с")
+        return elapsed
@@ -4,15 +4,25 @@
 """
 
 import asyncio
+import hashlib
+import hmac
 import logging
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+import sys
+import time
 
 from aiohttp import web
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp.abc import AbstractAccessLogger
+from aiogram import Bot
+from aiogram.webhook.aiohttp_server import setup_application
 from config import BOT_TOKEN, PORT, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET
-from handlers import router
+from bootstrap import create_bot, create_dispatcher
 from database import db
+from broadcast import broadcaster
+from scheduler import scheduler
+from stats import reconciler
+from ingestion import create_update_queue
+from lifecycle import Lifecycle
+import metrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,14 +32,92 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def webhook_url() -> str:
+    """
+    URL вебхука. К нему добавляется версия WEBHOOK_SECRET: getWebhookInfo не
+    возвращает секрет, поэтому так смена секрета видна по изменению URL.
+
+    Версия — HMAC секрета с ключом BOT_TOKEN: без токена по ней нельзя
+    перебрать секрет, а токен и так дает полный доступ к боту
+    """
+    url = f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
+    if WEBHOOK_SECRET:
+        version = hmac.new(BOT_TOKEN.encode(), WEBHOOK_SECRET.encode(), hashlib.sha256).hexdigest()[:16]
+        url += f"?v={version}"
+    return url
+
+
+async def ensure_webhook(bot: Bot) -> bool:
+    """
+    Установить вебхук, только если Telegram знает другой URL.
+
+    Returns:
+        bool: True если вебхук был переустановлен
+    """
+    url = webhook_url()
+    # Версия секрета в логи не попадает
+    public_url = f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
+    info = await bot.get_webhook_info()
+    if info.url == url:
+        logger.info(f"🔗 Webhook уже установлен: {public_url}")
+        return False
+    await bot.set_webhook(url=url, secret_token=WEBHOOK_SECRET or None)
+    logger.info(f"🔗 Webhook установлен: {public_url}")
+    return True
+
+
+async def timed(phase: str, coro):
+    """Выполнить шаг запуска и записать его длительность в лог"""
+    started = time.perf_counter()
+    result = await coro
+    logger.info(f"⏱ {phase}: {time.perf_counter() - started:.2f} с")
+    return result
+
+
+async def start_broadcasts(bot: Bot):
+    # Сначала продолжаем прерванные рассылки, затем запускаем планировщик:
+    # рассылка, которую он запустит, не должна быть возобновлена второй раз
+    resumed = await broadcaster.resume_unfinished(bot)
+    if resumed:
+        logger.info(f"📤 Возобновлено рассылок: {resumed}")
+    scheduled = await scheduler.start(bot)
+    logger.info(f"⏰ Отложенных рассылок в расписании: {scheduled}")
+
+
+class PathAccessLogger(AbstractAccessLogger):
+    """Журнал запросов без query-строки: в URL вебхука есть версия секрета"""
+
+    def log(self, request, response, time):
+        self.logger.info(f'{request.remote} "{request.method} {request.path}" {response.status} {time:.3f}s')
+
+
+async def serve(app: web.Application) -> web.AppRunner:
+    """Открыть порт для вебхуков, health-check и метрик"""
+    runner = web.AppRunner(app, access_log_class=PathAccessLogger)
+    await runner.setup()
+    site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
+    await site.start()
+    logger.info(f"🛰️ Слушаю порт {PORT} для вебхуков...")
+    return runner
+
+
 async def main():
     """
-    Основная функция запуска бота
+    Основная функция запуска бота.
+
+    В режиме вебхука порт открывается первым, чтобы health-check платформы
+    проходил сразу; до готовности очередь отвечает Telegram 503, и он повторяет
+    доставку. Подключение к базе, getMe и проверка вебхука выполняются
+    одновременно, затем одновременно запускаются части, которым нужна база.
     """
-    # Инициализируем подключение к базе данных
-    await db.connect()
+    started = time.perf_counter()
+    # SIGTERM и SIGINT запускают упорядоченную остановку (см. lifecycle.py)
+    lifecycle = Lifecycle()
+    lifecycle.install_signal_handlers()
 
     bot = None
+    update_queue = None
+    runner = None
     try:
         # Проверяем наличие токена
         if not BOT_TOKEN:
@@ -37,34 +125,17 @@ async def main():
             return
 
         # Создаем экземпляры бота и диспетчера
-        bot = Bot(token=BOT_TOKEN)
-        dp = Dispatcher(storage=MemoryStorage())
-
-        # Подключаем роутер с обработчиками
-        dp.include_router(router)
+        bot = create_bot()
+        dp = create_dispatcher(bot)
 
-        # Получаем информацию о боте
-        bot_info = await bot.get_me()
-        logger.info(f"🤖 Бот запущен: @{bot_info.username} ({bot_info.first_name})")
-        
         # Если задан WEBHOOK_BASE_URL — запускаем webhook-сервер, иначе polling
         if WEBHOOK_BASE_URL:
-            # Настраиваем webhook
-            webhook_url = f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
-            await bot.set_webhook(
-                url=webhook_url,
-                secret_token=WEBHOOK_SECRET or None,
-            )
-            logger.info(f"🔗 Webhook установлен: {webhook_url}")
-
-            # Создаем aiohttp-приложение и регистрируем обработчик aiogram
+            # Создаем aiohttp-приложение. Вебхук подтверждает апдейт сразу,
+            # а обработку выполняет пул обработчиков из очереди
             app = web.Application()
-            request_handler = SimpleRequestHandler(
-                dispatcher=dp,
-                bot=bot,
-                secret_token=WEBHOOK_SECRET or None,
-            )
-            request_handler.register(app, path=WEBHOOK_PATH)
+            # События рассылок из процессов-обработчиков сразу попадают в планировщик
+            update_queue = create_update_queue(dp, bot, on_event=scheduler.handle_event)
+            update_queue.register(app, path=WEBHOOK_PATH)
             setup_application(app, dp, bot=bot)
 
             # health-check endpoint для Render
@@ -72,27 +143,39 @@ async def main():
                 return web.Response(text="ok")
 
             app.router.add_get("/", health)
+            app.router.add_get("/metrics", metrics.metrics_handler)
+            runner = await timed("порт открыт", serve(app))
+
+        # Независимые шаги запуска. Без базы бот работать не может, поэтому
+        # ошибка любого шага завершает процесс с ненулевым кодом (платформа его перезапустит)
+        bot_info, *_ = await asyncio.gather(
+            timed("данные бота (getMe)", bot.me()),
+            timed("база данных", db.connect()),
+            *([timed("вебхук", ensure_webhook(bot))] if WEBHOOK_BASE_URL else []),
+        )
+        logger.info(f"🤖 Бот запущен: @{bot_info.username} ({bot_info.first_name})")
 
-            logger.info(f"🛰️ Слушаю порт {PORT} для вебхуков...")
-            runner = web.AppRunner(app)
-            await runner.setup()
-            site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
-            await site.start()
+        # Части, которым нужна база: рассылки, сверка счетчика подписчиков для /stats
+        # и обработчики очереди апдейтов
+        await asyncio.gather(
+            timed("рассылки и расписание", start_broadcasts(bot)),
+            timed("сверка статистики", reconciler.start()),
+            *([timed("обработчики апдейтов", update_queue.start())] if update_queue else []),
+        )
+        logger.info(f"🚀 Бот готов к работе за {time.perf_counter() - started:.2f} с")
 
-            # Ждем бесконечно, пока процесс работает
-            while True:
-                await asyncio.sleep(3600)
+        if WEBHOOK_BASE_URL:
+            # Работаем до SIGTERM/SIGINT
+            await lifecycle.wait()
         else:
             logger.info("📡 WEBHOOK_BASE_URL не задан — запускаю polling (локальный режим)")
-            await dp.start_polling(bot)
+            # Сессию бота закрывает lifecycle.shutdown после остановки рассылок
+            await dp.start_polling(bot, close_bot_session=False)
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка при запуске бота: {e}")
     finally:
-        # Закрываем сессию бота, если он был создан
-        if bot is not None:
-            await bot.session.close()
-            await db.close()
+        # Дорабатываем принятые апдейты, сохраняем рассылки и закрываем
+        # сервер, сессию бота и базу — в таком порядке
+        await lifecycle.shutdown(bot, update_queue=update_queue, runner=runner)
 
 
 if __name__ == '__main__':
@@ -103,3 +186,4 @@ if __name__ == '__main__':
         logger.info("👋 Бот остановлен пользователем")
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
+        sys.exit(1)
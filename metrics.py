@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Счетчики и гистограммы хранятся в памяти процесса и отдаются по /metrics
+на том же aiohttp-сервере, что и вебхук. Запись метрики — это обновление
+словаря без блокировок, поэтому накладные расходы на апдейт минимальны.
+
+Процессы-обработчики (UPDATE_QUEUE_BACKEND=process) периодически отправляют
+основному процессу снимок своих метрик (Registry.snapshot), и он добавляет
+их к своим (Registry.merge): счетчики и гистограммы суммируются, а значения
+gauge выводятся отдельно с меткой worker.
+"""
+
+import inspect
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Iterable, Sequence, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+# Границы корзин гистограмм длительности, в секундах
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Базовый класс метрики с набором меток"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def snapshot(self) -> dict:
+        """Значения по меткам для передачи в другой процесс"""
+        return dict(self._values)
+
+    def samples(self, remote: Sequence[Tuple[str, dict]] = ()) -> Iterable[str]:
+        """Строки значений; remote — снимки (источник, значения) из других процессов"""
+        raise NotImplementedError
+
+    def render(self, remote: Sequence[Tuple[str, dict]] = ()) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples(remote))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self, remote: Sequence[Tuple[str, dict]] = ()) -> Iterable[str]:
+        values = dict(self._values)
+        for _, other in remote:
+            for labels, value in other.items():
+                values[labels] = values.get(labels, 0.0) + value
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Metric):
+    """
+    Текущее значение.
+
+    Может вычисляться при каждом чтении: callback возвращает число
+    или словарь {кортеж меток: значение}.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Callable[[], Any] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self.callback = callback
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def snapshot(self) -> dict:
+        if self.callback is not None:
+            result = self.callback()
+            return dict(result) if isinstance(result, dict) else {(): result}
+        return dict(self._values)
+
+    def samples(self, remote: Sequence[Tuple[str, dict]] = ()) -> Iterable[str]:
+        for labels, value in self.snapshot().items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+        # Текущие значения разных процессов не складываются
+        for source, other in remote:
+            for labels, value in other.items():
+                worker = f'worker="{_escape(source)}"'
+                yield f"{self.name}{_format_labels(self.labelnames, labels, worker)} {value}"
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по корзинам (последняя — +Inf), сумма, количество]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def snapshot(self) -> dict:
+        return {labels: [list(counts), total, count] for labels, (counts, total, count) in self._values.items()}
+
+    def samples(self, remote: Sequence[Tuple[str, dict]] = ()) -> Iterable[str]:
+        values = self.snapshot()
+        for _, other in remote:
+            for labels, (counts, total, count) in other.items():
+                state = values.setdefault(labels, [[0] * len(counts), 0.0, 0])
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+        for labels, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        # Последние снимки метрик других процессов: источник -> {имя: значения}
+        self._remote: Dict[str, Dict[str, dict]] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              callback: Callable[[], Any] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Значения всех метрик процесса (передаются через multiprocessing.Queue)"""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def merge(self, source: str, snapshot: Dict[str, dict]):
+        """Заменить снимок метрик процесса source; счетчики в снимке накопительные"""
+        self._remote[source] = snapshot
+
+    def render(self) -> str:
+        return "\n".join(
+            metric.render([(source, snapshot[name]) for source, snapshot in self._remote.items()
+                           if name in snapshot])
+            for name, metric in self._metrics.items()
+        ) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATES_TOTAL = REGISTRY.counter(
+    "bot_updates_total", "Обработанные апдейты", ("type",))
+UPDATES_IN_PROGRESS = REGISTRY.gauge(
+    "bot_updates_in_progress", "Апдейты, обрабатываемые в данный момент")
+UPDATE_SECONDS = REGISTRY.histogram(
+    "bot_update_duration_seconds", "Время обработки апдейта", ("type",))
+UPDATE_ERRORS = REGISTRY.counter(
+    "bot_update_errors_total", "Исключения при обработке апдейтов", ("type", "error"))
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика", ("handler",))
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "bot_api_request_duration_seconds", "Время запроса к Bot API", ("method",))
+API_ERRORS = REGISTRY.counter(
+    "bot_api_errors_total", "Ошибки Bot API по классам", ("method", "error"))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "bot_db_query_duration_seconds", "Время операции с базой данных", ("method",))
+DB_ERRORS = REGISTRY.counter(
+    "bot_db_errors_total", "Исключения в операциях с базой данных", ("method",))
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "bot_broadcast_messages_total", "Сообщения рассылки по результату", ("result",))
+BROADCAST_RETRY_AFTER = REGISTRY.counter(
+    "bot_broadcast_retry_after_total", "Ответы TelegramRetryAfter во время рассылки")
+BROADCAST_QUEUE_SIZE = REGISTRY.gauge(
+    "bot_broadcast_queue_size", "Получатели в очередях воркеров рассылки")
+BROADCASTS_ACTIVE = REGISTRY.gauge(
+    "bot_broadcasts_active", "Рассылки, выполняющиеся в процессе")
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: время обработки и количество апдейтов по типу"""
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event, data: Dict[str, Any]) -> Any:
+        update_type = getattr(event, "event_type", "unknown")
+        UPDATES_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            UPDATE_ERRORS.inc(update_type, type(e).__name__)
+            raise
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, update_type)
+            UPDATES_TOTAL.inc(update_type)
+            UPDATES_IN_PROGRESS.dec()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время работы конкретного обработчика"""
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время запросов к Bot API и классы ошибок"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        method_name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method_name, type(e).__name__)
+            raise
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - started, method_name)
+
+
+def _timed(name: str, func: Callable[..., Awaitable[Any]]):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def instrument_storage(storage):
+    """Обернуть корутинные методы хранилища замером времени"""
+    if getattr(storage, "_metrics_instrumented", False):
+        return
+    # Внутренние методы пакетной записи и точечной проверки показывают
+    # реальную стоимость запросов, публичные — стоимость с учетом кэша и пакетов
+    names = [name for name in dir(type(storage))
+             if (not name.startswith("_") and name not in ("connect", "close"))
+             or name in ("_insert_users", "_delete_users", "_fetch_subscribed")]
+    for name in names:
+        attribute = getattr(storage, name, None)
+        if inspect.iscoroutinefunction(attribute):
+            setattr(storage, name, _timed(name, attribute))
+    # Пакетная запись получила ссылки на методы до обертки
+    storage.writer.add_many = storage._insert_users
+    storage.writer.remove_many = storage._delete_users
+    storage._metrics_instrumented = True
+
+    REGISTRY.gauge(
+        "bot_subscription_cache", "Счетчики кэша подписок", ("field",),
+        callback=lambda: {(key,): value for key, value in storage.cache.stats().items()},
+    )
+    REGISTRY.gauge(
+        "bot_db_pool", "Состояние пула соединений и время ожидания (секунды)", ("field",),
+        callback=lambda: {(key,): value for key, value in storage.get_pool_stats().items()},
+    )
+
+
+def setup(dp, bot: Bot, storage):
+    """Подключить сбор метрик к диспетчеру, сессии бота и хранилищу"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+    instrument_storage(storage)
+
+
+async def metrics_handler(_: web.Request) -> web.Response:
+    """Эндпоинт /metrics"""
+    return web.Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={
+            "Content-Type": "text/plain; version=0.0.4; charset=utf-8",
+            "Cache-Control": "no-cache",
+        },
+    )
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик отложенных рассылок.
+
+Отложенные рассылки хранятся в таблице broadcasts со статусом 'scheduled'.
+Планировщик держит в памяти кучу (heap) времен запуска и спит до ближайшего
+из них — база данных не опрашивается. При старте процесса куча заполняется
+из базы, поэтому запланированные рассылки переживают перезапуск.
+
+Запуск рассылки — условное обновление статуса в базе, поэтому несколько
+процессов с планировщиком не запустят одну рассылку дважды, а отмененная
+рассылка просто пропускается, когда подходит ее время.
+
+С UPDATE_QUEUE_BACKEND=process команды выполняются в процессах-обработчиках,
+а рассылки и планировщик работают только в основном процессе. Тогда
+планировщик процесса-обработчика не ведет свое расписание, а пересылает
+события /send, /schedule и /resume основному процессу через очередь
+(см. Scheduler.forward_to и ingestion.ProcessUpdateQueue), и тот сразу
+добавляет рассылку в расписание или запускает ее.
+"""
+
+import asyncio
+import heapq
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+
+from broadcast import Broadcaster, broadcaster
+from config import SCHEDULE_TIMEZONE
+from database import db
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Максимальный сон без пересчета: если системные часы переведут,
+# планировщик заметит это не позже чем через столько секунд
+MAX_SLEEP = 300.0
+
+# События процессов-обработчиков для основного процесса
+EVENT_SCHEDULED = 'scheduled'  # (EVENT_SCHEDULED, ID рассылки, время запуска в секундах unix)
+EVENT_RUNNING = 'running'      # (EVENT_RUNNING, ID рассылки) — рассылку нужно выполнить
+
+DURATION_RE = re.compile(r"^(\d+)([smhd])$")
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value: str) -> float:
+    """Длительность вида 90s, 30m, 2h, 1d в секундах"""
+    match = DURATION_RE.match(value)
+    if not match:
+        raise ValueError(f"Некорректная длительность: {value}. Пример: 30m, 2h, 1d")
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_schedule_time(args: str, now: Optional[datetime] = None,
+                        tz_name: str = SCHEDULE_TIMEZONE) -> Tuple[datetime, str]:
+    """
+    Отделить время запуска от остальных аргументов /schedule.
+
+    Поддерживаются форматы:
+    - +30m, +2h, +1d — через указанное время;
+    - 18:30 — сегодня в 18:30 (или завтра, если это время уже прошло);
+    - 2024-06-01 18:30 — дата и время.
+
+    Время указывается в часовом поясе SCHEDULE_TIMEZONE.
+
+    Returns:
+        tuple: (время запуска в UTC, остаток аргументов)
+
+    Raises:
+        ValueError: если время не указано, некорректно или уже прошло
+    """
+    zone = ZoneInfo(tz_name)
+    now = now or datetime.now(timezone.utc)
+    parts = args.split(maxsplit=1)
+    if not parts:
+        raise ValueError("Не указано время запуска")
+    first, rest = parts[0], parts[1] if len(parts) > 1 else ""
+
+    if first.startswith("+"):
+        return now + timedelta(seconds=parse_duration(first[1:])), rest
+
+    local_now = now.astimezone(zone)
+    try:
+        if re.match(r"^\d{4}-\d{2}-\d{2}$", first):
+            time_part, _, rest = rest.partition(" ")
+            local = datetime.strptime(f"{first} {time_part}", "%Y-%m-%d %H:%M").replace(tzinfo=zone)
+        else:
+            clock = datetime.strptime(first, "%H:%M")
+            local = local_now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+            if local <= local_now:
+                local += timedelta(days=1)
+    except ValueError:
+        raise ValueError(f"Некорректное время: {first}. Пример: +30m, 18:30 или 2024-06-01 18:30")
+
+    scheduled_at = local.astimezone(timezone.utc)
+    if scheduled_at <= now:
+        raise ValueError("Время запуска уже прошло")
+    return scheduled_at, rest.strip()
+
+
+class Scheduler:
+    """Запуск отложенных рассылок в назначенное время"""
+
+    def __init__(self, engine: Broadcaster):
+        self.engine = engine
+        self.bot = None
+        # Куча (время запуска в секундах unix, ID рассылки)
+        self._heap = []
+        # ID рассылок в куче, чтобы одна рассылка не попала в нее дважды
+        self._queued = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Процесс-обработчик: отправка события основному процессу
+        self._forward = None
+        self._started = asyncio.Event()
+
+    def add(self, job_id: int, scheduled_at: datetime):
+        """Добавить рассылку в расписание и разбудить планировщик"""
+        if self._forward is not None:
+            self._forward((EVENT_SCHEDULED, job_id, scheduled_at.timestamp()))
+            return
+        if job_id in self._queued:
+            return
+        self._queued.add(job_id)
+        heapq.heappush(self._heap, (scheduled_at.timestamp(), job_id))
+        self._wakeup.set()
+
+    def forward_to(self, send: Callable[[tuple], None]):
+        """
+        Передавать рассылки основному процессу вместо собственного расписания.
+
+        Вызывается в процессе-обработчике апдейтов: send кладет событие
+        в очередь, которую читает основной процесс и передает в handle_event.
+        """
+        self._forward = send
+        self.engine.runs_jobs = False
+        self.engine.handoff = lambda job_id: send((EVENT_RUNNING, job_id))
+
+    async def handle_event(self, event: tuple):
+        """Событие процесса-обработчика (в основном процессе)"""
+        # До запуска планировщика нет бота, а прерванные рассылки еще не продолжены
+        await self._started.wait()
+        kind, job_id, *args = event
+        if kind == EVENT_SCHEDULED:
+            self.add(job_id, datetime.fromtimestamp(args[0], timezone.utc))
+        elif kind == EVENT_RUNNING:
+            # Рассылка уже в статусе 'running': запускаем все такие, кроме выполняющихся
+            await self.engine.resume_unfinished(self.bot)
+        else:
+            logger.warning(f"Неизвестное событие рассылки: {event}")
+
+    @property
+    def pending(self) -> int:
+        """Количество рассылок в расписании этого процесса"""
+        return len(self._heap)
+
+    async def start(self, bot: Bot) -> int:
+        """
+        Загрузить отложенные рассылки из базы и запустить планировщик.
+
+        Returns:
+            int: количество загруженных рассылок
+        """
+        self.bot = bot
+        rows = await db.get_scheduled_broadcasts()
+        for row in rows:
+            self.add(row['id'], row['scheduled_at'])
+        self._task = asyncio.create_task(self._run())
+        self._started.set()
+        return len(rows)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            due, job_id = self._heap[0]
+            delay = due - time.time()
+            if delay > 0:
+                # Новая рассылка может оказаться раньше текущей ближайшей — тогда будят заново
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            self._queued.discard(job_id)
+            try:
+                job = await self.engine.start_scheduled(self.bot, job_id)
+                if job is not None:
+                    logger.info(f"⏰ Отложенная рассылка #{job_id} запущена")
+            except Exception as e:
+                logger.error(f"Ошибка при запуске отложенной рассылки #{job_id}: {e}")
+
+
+# Общий планировщик процесса
+scheduler = Scheduler(broadcaster)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Сегменты подписчиков для адресных рассылок.
+
+Сегмент задается фильтрами в начале команды /send:
+
+    /send lang:ru,uk since:2024-05-01 tag:vip sample:10% Текст рассылки
+
+- lang:ru,uk        — язык клиента Telegram (любой из перечисленных);
+- since:2024-05-01  — подписались начиная с даты (UTC);
+- tag:vip           — пользователи с тегом, можно указать несколько (нужны все);
+- sample:10%        — выборка 10% подписчиков, sample:10-20% — следующие 10%.
+
+Выборка детерминирована: пользователь попадает в корзину user_id % 100,
+поэтому группы A/B не пересекаются, а повторная «канареечная» рассылка
+уходит тем же пользователям.
+
+Каждому фильтру соответствует частичный индекс по активным подписчикам.
+Список языков и диапазон корзин читаются по частям (см. Segment.parts):
+у каждой части равенство по первой колонке индекса, а потоки ID частей
+сливаются по возрастанию. Сегмент по дате подписки без языка и выборки
+читается в порядке (subscribed_at, user_id) — по индексу этой даты.
+"""
+
+import json
+import re
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+# Количество корзин для выборки
+SAMPLE_BUCKETS = 100
+
+FILTER_RE = re.compile(r"\s*(lang|since|tag|sample):(\S+)(?:\s+|$)")
+SAMPLE_RE = re.compile(r"^(?:(\d{1,3})-)?(\d{1,3})%?$")
+TAG_RE = re.compile(r"^[\w\-.]{1,64}$")
+
+
+class Segment:
+    """Условия выбора получателей рассылки"""
+
+    def __init__(self, since: Optional[date] = None, languages: Iterable[str] = (),
+                 tags: Iterable[str] = (), sample: Optional[Tuple[int, int]] = None):
+        """
+        Args:
+            since (date): подписались не раньше этой даты
+            languages: коды языков клиента (любой из них)
+            tags: теги, которые должны быть у пользователя (все)
+            sample (tuple): полуинтервал корзин [от, до) из SAMPLE_BUCKETS
+        """
+        self.since = since
+        self.languages = tuple(sorted(set(languages)))
+        self.tags = tuple(sorted(set(tags)))
+        self.sample = tuple(sample) if sample else None
+
+    def __bool__(self) -> bool:
+        return bool(self.since or self.languages or self.tags or self.sample)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Segment) and self.to_dict() == other.to_dict()
+
+    @property
+    def by_subscription(self) -> bool:
+        """
+        Сегмент читается в порядке (subscribed_at, user_id), а не по user_id.
+
+        Фильтр since — диапазон по первой колонке индекса (subscribed_at, user_id),
+        поэтому по возрастанию user_id этот индекс строки не отдает. Если в сегменте
+        есть язык или выборка, он читается по их индексам, а since остается фильтром.
+        """
+        return bool(self.since) and not self.languages and not self.sample
+
+    def parts(self) -> List["Segment"]:
+        """
+        Части сегмента с равенством по первой колонке индекса:
+        по одной на язык из списка или на корзину выборки.
+        """
+        if len(self.languages) > 1:
+            return [Segment(self.since, (language,), self.tags, self.sample) for language in self.languages]
+        if not self.languages and self.sample and self.sample[1] - self.sample[0] > 1:
+            return [Segment(self.since, (), self.tags, (bucket, bucket + 1)) for bucket in range(*self.sample)]
+        return [self]
+
+    def where(self, param: Callable[[Any], str]) -> str:
+        """
+        Условие WHERE для таблицы users.
+
+        Args:
+            param: добавляет значение в список параметров запроса
+                и возвращает его плейсхолдер ($1 или ?)
+
+        Один язык и одна корзина выборки записываются равенством,
+        чтобы индекс использовался и для условия user_id > ... .
+        """
+        conditions = ["blocked_at IS NULL"]
+        if self.since:
+            since = datetime(self.since.year, self.since.month, self.since.day, tzinfo=timezone.utc)
+            conditions.append(f"subscribed_at >= {param(since)}")
+        if len(self.languages) == 1:
+            conditions.append(f"language_code = {param(self.languages[0])}")
+        elif self.languages:
+            placeholders = ", ".join(param(language) for language in self.languages)
+            conditions.append(f"language_code IN ({placeholders})")
+        for tag in self.tags:
+            conditions.append(f"user_id IN (SELECT user_id FROM user_tags WHERE tag = {param(tag)})")
+        if self.sample:
+            low, high = self.sample
+            if high - low == 1:
+                conditions.append(f"(user_id % {SAMPLE_BUCKETS}) = {param(low)}")
+            else:
+                conditions.append(
+                    f"(user_id % {SAMPLE_BUCKETS}) >= {param(low)} "
+                    f"AND (user_id % {SAMPLE_BUCKETS}) < {param(high)}"
+                )
+        return " AND ".join(conditions)
+
+    def describe(self) -> str:
+        """Описание сегмента для администратора"""
+        if not self:
+            return "все подписчики"
+        parts = []
+        if self.languages:
+            parts.append("язык " + ", ".join(self.languages))
+        if self.since:
+            parts.append(f"с {self.since.isoformat()}")
+        if self.tags:
+            parts.append("теги " + ", ".join(self.tags))
+        if self.sample:
+            low, high = self.sample
+            parts.append(f"выборка {high - low}%" + (f" (корзины {low}-{high})" if low else ""))
+        return "; ".join(parts)
+
+    def to_dict(self) -> dict:
+        return {
+            'since': self.since.isoformat() if self.since else None,
+            'languages': list(self.languages),
+            'tags': list(self.tags),
+            'sample': list(self.sample) if self.sample else None,
+        }
+
+    def to_json(self) -> Optional[str]:
+        """JSON для сохранения в таблице broadcasts (None — без фильтров)"""
+        return json.dumps(self.to_dict()) if self else None
+
+    @classmethod
+    def from_json(cls, raw: Optional[str]) -> "Segment":
+        if not raw:
+            return cls()
+        data = json.loads(raw) if isinstance(raw, str) else raw
+        return cls(
+            since=date.fromisoformat(data['since']) if data.get('since') else None,
+            languages=data.get('languages') or (),
+            tags=data.get('tags') or (),
+            sample=data.get('sample'),
+        )
+
+
+def _parse_sample(value: str) -> Tuple[int, int]:
+    match = SAMPLE_RE.match(value)
+    if not match:
+        raise ValueError(f"Некорректная выборка: {value}. Пример: sample:10% или sample:10-20%")
+    if match.group(1) is None:
+        low, high = 0, int(match.group(2))
+    else:
+        low, high = int(match.group(1)), int(match.group(2))
+    if not 0 <= low < high <= SAMPLE_BUCKETS:
+        raise ValueError(f"Выборка должна быть в пределах 0-{SAMPLE_BUCKETS}%: {value}")
+    return low, high
+
+
+def parse_segment(args: str) -> Tuple[Segment, str]:
+    """
+    Отделить фильтры сегмента от текста рассылки.
+
+    Returns:
+        tuple: (сегмент, текст без фильтров)
+
+    Raises:
+        ValueError: если значение фильтра некорректно
+    """
+    since = None
+    languages = []
+    tags = []
+    sample = None
+
+    position = 0
+    while True:
+        match = FILTER_RE.match(args, position)
+        if not match:
+            break
+        key, value = match.groups()
+        if key == "lang":
+            languages.extend(code.lower() for code in value.split(",") if code)
+        elif key == "since":
+            try:
+                since = date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Некорректная дата: {value}. Формат: ГГГГ-ММ-ДД")
+        elif key == "tag":
+            if not TAG_RE.match(value):
+                raise ValueError(f"Некорректный тег: {value}")
+            tags.append(value)
+        elif key == "sample":
+            sample = _parse_sample(value)
+        position = match.end()
+
+    return Segment(since, languages, tags, sample), args[position:].strip()
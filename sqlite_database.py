@@ -0,0 +1,793 @@
+# -*- coding: utf-8 -*-
+"""
+Модуль для работы с локальной базой данных SQLite.
+
+Используется для локального запуска и небольших развертываний,
+когда PostgreSQL не нужен. База работает в режиме WAL: чтение
+не блокируется записью, а записи выполняются пакетами в одной транзакции.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+import aiosqlite
+
+from config import BROADCAST_BATCH_SIZE, DATABASE_NAME
+from segments import Segment
+from storage import USER_COLUMNS, BaseStorage, Position, stats_day
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Максимальное количество параметров в одном запросе (ограничение старых версий SQLite — 999)
+MAX_VARIABLES = 500
+
+# Формат CURRENT_TIMESTAMP, в котором хранятся subscribed_at и blocked_at (UTC)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+SQL_CREATE_MIGRATIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# Миграции схемы: (версия, описание, шаги). Шаг — SQL или (таблица, колонка, определение)
+# для добавления колонки, если ее еще нет (в SQLite нет ADD COLUMN IF NOT EXISTS).
+# DDL в SQLite не откатывается вместе с транзакцией, поэтому шаги идемпотентны:
+# база, созданная до появления schema_migrations, проходит миграции 1-7 без изменений.
+MIGRATIONS = (
+    (1, "Пользователи и рассылки", (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            subscribed_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            report_chat_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER,
+            done_ahead TEXT NOT NULL DEFAULT '[]',
+            successful INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )
+        ''',
+    )),
+    # Недоступные пользователи помечаются и пропускаются при рассылке
+    (2, "Недоступные пользователи", (
+        ("users", "blocked_at", "TEXT"),
+        ("broadcasts", "pruned", "INTEGER NOT NULL DEFAULT 0"),
+    )),
+    # Атрибуты для адресных рассылок и частичные индексы по активным подписчикам
+    (3, "Сегменты: язык, теги и индексы", (
+        ("users", "language_code", "TEXT"),
+        ("broadcasts", "segment", "TEXT"),
+        '''
+        CREATE TABLE IF NOT EXISTS user_tags (
+            tag TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            PRIMARY KEY (tag, user_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS user_tags_user_id_idx ON user_tags (user_id)",
+        "CREATE INDEX IF NOT EXISTS users_language_code_idx "
+        "ON users (language_code, user_id) WHERE blocked_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS users_subscribed_at_idx "
+        "ON users (subscribed_at, user_id) WHERE blocked_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS users_sample_bucket_idx "
+        "ON users ((user_id % 100), user_id) WHERE blocked_at IS NULL",
+    )),
+    (4, "Медиа-рассылки", (
+        ("broadcasts", "payload", "TEXT"),
+    )),
+    # Время запуска отложенной рассылки хранится в секундах unix
+    (5, "Отложенные рассылки", (
+        ("broadcasts", "scheduled_at", "REAL"),
+        ("broadcasts", "max_rate", "REAL"),
+        "CREATE INDEX IF NOT EXISTS broadcasts_scheduled_at_idx "
+        "ON broadcasts (scheduled_at) WHERE status = 'scheduled'",
+    )),
+    (6, "Состояния FSM и обработанные апдейты", (
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            processed_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS processed_updates_processed_at_idx "
+        "ON processed_updates (processed_at)",
+    )),
+    # Статистика: счетчик подписчиков, дневная история и итоги рассылок по типам
+    (7, "Статистика подписчиков", (
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL,
+            reconciled_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            subscribed INTEGER NOT NULL DEFAULT 0,
+            unsubscribed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        ("broadcasts", "outcomes", "TEXT"),
+    )),
+    # Контрольная точка рассылки по дате подписки: позиция (subscribed_at, user_id)
+    (8, "Позиция рассылки по дате подписки", (
+        ("broadcasts", "last_subscribed_at", "TEXT"),
+    )),
+    # Версия записи FSM растет при каждой записи: по ней процесс проверяет свой кэш
+    (9, "Версия записей FSM", (
+        ("fsm_storage", "version", "INTEGER NOT NULL DEFAULT 0"),
+    )),
+)
+
+
+def _chunks(items: list, size: int = MAX_VARIABLES):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _segment_where(segment: Segment) -> Tuple[str, list]:
+    """Условие сегмента с плейсхолдерами ? и значения параметров"""
+    params = []
+
+    def param(value) -> str:
+        if isinstance(value, datetime):
+            # subscribed_at хранится как CURRENT_TIMESTAMP: 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' в UTC
+            value = value.strftime(TIMESTAMP_FORMAT)
+        params.append(value)
+        return "?"
+
+    return segment.where(param), params
+
+
+def _load_timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc) if value else None
+
+
+def _dump_timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT) if value else None
+
+
+def _broadcast_from_row(row) -> dict:
+    """Строка таблицы broadcasts в том же формате, что и у PostgreSQL"""
+    data = dict(row)
+    data['done_ahead'] = json.loads(data['done_ahead'] or '[]')
+    if data.get('scheduled_at') is not None:
+        data['scheduled_at'] = datetime.fromtimestamp(data['scheduled_at'], timezone.utc)
+    if 'last_subscribed_at' in data:
+        data['last_subscribed_at'] = _load_timestamp(data['last_subscribed_at'])
+    return data
+
+
+class SqliteDatabase(BaseStorage):
+    """Класс для асинхронной работы с базой данных SQLite"""
+
+    def __init__(self, path: str = DATABASE_NAME):
+        """
+        Args:
+            path (str): путь к файлу базы данных
+        """
+        super().__init__()
+        self.path = path
+        self.conn = None
+        # SQLite допускает одного писателя, поэтому транзакции выполняются по очереди
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        """Открытие базы данных и инициализация таблиц"""
+        if self.conn:
+            return
+        self.conn = await aiosqlite.connect(self.path)
+        self.conn.row_factory = aiosqlite.Row
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+        await self.conn.execute("PRAGMA busy_timeout=5000")
+        # Теги удаляются вместе с пользователем (ON DELETE CASCADE)
+        await self.conn.execute("PRAGMA foreign_keys=ON")
+        logger.info(f"База данных SQLite открыта: {self.path}")
+        await self.init_database()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Транзакция на запись с учетом времени ожидания очереди писателей"""
+        started = time.perf_counter()
+        async with self._lock:
+            acquired = time.perf_counter()
+            try:
+                yield self.conn
+                await self.conn.commit()
+            except BaseException:
+                await self.conn.rollback()
+                raise
+            finally:
+                self.pool_stats.record(acquired - started, time.perf_counter() - acquired)
+
+    async def _fetchall(self, query: str, params=()) -> list:
+        async with self.conn.execute(query, params) as cursor:
+            return await cursor.fetchall()
+
+    async def _fetchone(self, query: str, params=()):
+        async with self.conn.execute(query, params) as cursor:
+            return await cursor.fetchone()
+
+    async def init_database(self):
+        """Применение миграций схемы, которых еще нет в schema_migrations"""
+        try:
+            async with self.transaction() as conn:
+                await conn.execute(SQL_CREATE_MIGRATIONS_TABLE)
+                async with conn.execute("SELECT version FROM schema_migrations") as cursor:
+                    applied = {row[0] for row in await cursor.fetchall()}
+                pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+                for version, name, steps in pending:
+                    for step in steps:
+                        if isinstance(step, tuple):
+                            await self._add_column(conn, *step)
+                        else:
+                            await conn.execute(step)
+                    await conn.execute(
+                        "INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (?, ?)", (version, name)
+                    )
+                    logger.info(f"Миграция {version} применена: {name}")
+            if not pending:
+                logger.info(f"Схема базы данных актуальна (версия {max(applied)})")
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации таблицы: {e}")
+            raise
+
+    @staticmethod
+    async def _add_column(conn, table: str, column: str, definition: str):
+        """ALTER TABLE ... ADD COLUMN, если колонки еще нет (в SQLite нет IF NOT EXISTS)"""
+        async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if column not in columns:
+            await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    async def _existing_user_ids(self, conn, user_ids: List[int], active_only: bool = False) -> Set[int]:
+        placeholders = ",".join("?" * len(user_ids))
+        condition = " AND blocked_at IS NULL" if active_only else ""
+        async with conn.execute(
+            f"SELECT user_id FROM users WHERE user_id IN ({placeholders}){condition}", user_ids
+        ) as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+    @staticmethod
+    async def _record_stats(conn, subscribed: int = 0, unsubscribed: int = 0, blocked: int = 0):
+        """Обновление счетчика подписчиков и дневной статистики в текущей транзакции"""
+        if not (subscribed or unsubscribed or blocked):
+            return
+        await conn.execute('''
+            INSERT INTO stats_daily (day, subscribed, unsubscribed, blocked) VALUES (?, ?, ?, ?)
+            ON CONFLICT (day) DO UPDATE
+            SET subscribed = subscribed + excluded.subscribed,
+                unsubscribed = unsubscribed + excluded.unsubscribed,
+                blocked = blocked + excluded.blocked
+        ''', (stats_day().isoformat(), subscribed, unsubscribed, blocked))
+        # Пока счетчика нет (до первой сверки), обновление ничего не меняет
+        await conn.execute(
+            "UPDATE stats_counters SET value = value + ? WHERE name = 'subscribers'",
+            (subscribed - unsubscribed - blocked,),
+        )
+
+    async def _insert_users(self, rows: List[Tuple]) -> Set[int]:
+        """Пакетное добавление пользователей в одной транзакции"""
+        inserted = set()
+        async with self.transaction() as conn:
+            for chunk in _chunks(rows):
+                existing = await self._existing_user_ids(
+                    conn, [row[0] for row in chunk], active_only=True
+                )
+                new_rows = [row for row in chunk if row[0] not in existing]
+                # Пользователь, ранее помеченный недоступным, снова становится подписчиком
+                await conn.executemany('''
+                    INSERT INTO users (user_id, username, first_name, last_name, language_code)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET blocked_at = NULL, language_code = COALESCE(excluded.language_code, language_code)
+                ''', new_rows)
+                inserted.update(row[0] for row in new_rows)
+            await self._record_stats(conn, subscribed=len(inserted))
+        return inserted
+
+    async def _delete_users(self, user_ids: List[int]) -> Set[int]:
+        """Пакетное удаление пользователей в одной транзакции"""
+        deleted = set()
+        active = 0
+        async with self.transaction() as conn:
+            for chunk in _chunks(user_ids):
+                existing = await self._existing_user_ids(conn, chunk)
+                # Недоступные пользователи уже вычтены из счетчика при пометке
+                active += len(await self._existing_user_ids(conn, chunk, active_only=True))
+                placeholders = ",".join("?" * len(chunk))
+                await conn.execute(f"DELETE FROM users WHERE user_id IN ({placeholders})", chunk)
+                deleted.update(existing)
+            await self._record_stats(conn, unsubscribed=active)
+        return deleted
+
+    async def _fetch_subscribed(self, user_id: int) -> bool:
+        return await self._fetchone("SELECT 1 FROM users WHERE user_id = ? AND blocked_at IS NULL", (user_id,)) is not None
+
+    async def get_all_users(self) -> list:
+        """Получение списка ID всех подписанных пользователей"""
+        try:
+            rows = await self._fetchall("SELECT user_id FROM users WHERE blocked_at IS NULL")
+            return [row['user_id'] for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка пользователей: {e}")
+            return []
+
+    async def _iter_id_pages(self, segment: Segment, after: Optional[int],
+                             batch_size: int) -> AsyncIterator[List[int]]:
+        """Keyset-пагинация ID подписчиков сегмента по возрастанию user_id"""
+        where, params = _segment_where(segment)
+        last_id = after
+        while True:
+            if last_id is None:
+                rows = await self._fetchall(
+                    f"SELECT user_id FROM users WHERE {where} ORDER BY user_id LIMIT ?",
+                    (*params, batch_size),
+                )
+            else:
+                rows = await self._fetchall(
+                    f"SELECT user_id FROM users WHERE {where} AND user_id > ? "
+                    f"ORDER BY user_id LIMIT ?",
+                    (*params, last_id, batch_size),
+                )
+            if not rows:
+                return
+
+            batch = [row['user_id'] for row in rows]
+            last_id = batch[-1]
+            yield batch
+
+            if len(batch) < batch_size:
+                return
+
+    async def _iter_subscription_pages(self, segment: Segment, after: Optional[Position],
+                                       batch_size: int) -> AsyncIterator[List[Position]]:
+        """Keyset-пагинация подписчиков сегмента по индексу (subscribed_at, user_id)"""
+        where, params = _segment_where(segment)
+        position = (_dump_timestamp(after[0]), after[1]) if after else None
+        while True:
+            if position is None:
+                rows = await self._fetchall(
+                    f"SELECT subscribed_at, user_id FROM users WHERE {where} "
+                    f"ORDER BY subscribed_at, user_id LIMIT ?",
+                    (*params, batch_size),
+                )
+            else:
+                rows = await self._fetchall(
+                    f"SELECT subscribed_at, user_id FROM users WHERE {where} "
+                    f"AND (subscribed_at, user_id) > (?, ?) "
+                    f"ORDER BY subscribed_at, user_id LIMIT ?",
+                    (*params, *position, batch_size),
+                )
+            if not rows:
+                return
+
+            position = tuple(rows[-1])
+            yield [(_load_timestamp(row['subscribed_at']), row['user_id']) for row in rows]
+
+            if len(rows) < batch_size:
+                return
+
+    async def get_users_count(self, segment: Optional[Segment] = None) -> int:
+        """Получение количества подписанных пользователей (всех или сегмента)"""
+        where, params = _segment_where(segment or Segment())
+        try:
+            row = await self._fetchone(f"SELECT COUNT(*) FROM users WHERE {where}", params)
+            return row[0]
+        except Exception as e:
+            logger.error(f"Ошибка при подсчете пользователей: {e}")
+            return 0
+
+    async def iter_user_records(self, batch_size: int = BROADCAST_BATCH_SIZE) -> AsyncIterator[List[tuple]]:
+        """Постраничное чтение всех строк users для экспорта (колонки USER_COLUMNS)"""
+        columns = ", ".join(USER_COLUMNS)
+        last_id = None
+        while True:
+            if last_id is None:
+                rows = await self._fetchall(
+                    f"SELECT {columns} FROM users ORDER BY user_id LIMIT ?", (batch_size,)
+                )
+            else:
+                rows = await self._fetchall(
+                    f"SELECT {columns} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (last_id, batch_size),
+                )
+            if not rows:
+                return
+
+            last_id = rows[-1]['user_id']
+            yield [
+                (*tuple(row)[:5], _load_timestamp(row['subscribed_at']), _load_timestamp(row['blocked_at']))
+                for row in rows
+            ]
+
+            if len(rows) < batch_size:
+                return
+
+    async def import_user_records(self, records: List[tuple]) -> Set[int]:
+        """Загрузка пачки строк users в одной транзакции. Существующие пользователи не изменяются"""
+        inserted = set()
+        active = 0
+        async with self.transaction() as conn:
+            for chunk in _chunks(records):
+                existing = await self._existing_user_ids(conn, [record[0] for record in chunk])
+                new_records = {}
+                for record in chunk:
+                    if record[0] not in existing and record[0] not in new_records:
+                        new_records[record[0]] = record
+                await conn.executemany(f'''
+                    INSERT INTO users ({', '.join(USER_COLUMNS)})
+                    VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+                ''', [
+                    (*record[:5], _dump_timestamp(record[5]), _dump_timestamp(record[6]))
+                    for record in new_records.values()
+                ])
+                inserted.update(new_records)
+                active += sum(1 for record in new_records.values() if record[6] is None)
+            # Перенос подписчиков — не новые подписки, поэтому дневная история не меняется
+            await conn.execute(
+                "UPDATE stats_counters SET value = value + ? WHERE name = 'subscribers'", (active,)
+            )
+        for user_id in inserted:
+            self.cache.invalidate(user_id)
+        return inserted
+
+    async def mark_users_unreachable(self, user_ids: List[int]) -> int:
+        """Пометка пользователей, которым невозможно доставить сообщение"""
+        if not user_ids:
+            return 0
+        marked = 0
+        try:
+            async with self.transaction() as conn:
+                for chunk in _chunks(user_ids):
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = await conn.execute(
+                        f"UPDATE users SET blocked_at = CURRENT_TIMESTAMP "
+                        f"WHERE user_id IN ({placeholders}) AND blocked_at IS NULL",
+                        chunk,
+                    )
+                    marked += cursor.rowcount
+                await self._record_stats(conn, blocked=marked)
+            for user_id in user_ids:
+                self.cache.set(user_id, False)
+            return marked
+        except Exception as e:
+            logger.error(f"Ошибка при пометке недоступных пользователей: {e}")
+            return 0
+
+    async def get_subscribers_count(self) -> Optional[int]:
+        """Количество подписчиков по счетчику (None — счетчик еще не сверялся)"""
+        try:
+            row = await self._fetchone("SELECT value FROM stats_counters WHERE name = 'subscribers'")
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при чтении счетчика подписчиков: {e}")
+            return None
+
+    async def reconcile_subscribers_count(self) -> Tuple[Optional[int], int]:
+        """Пересчет счетчика подписчиков по таблице users. Возвращает (было, стало)"""
+        # Записи выполняются по очереди, поэтому подсчет внутри транзакции точен
+        async with self.transaction() as conn:
+            async with conn.execute("SELECT value FROM stats_counters WHERE name = 'subscribers'") as cursor:
+                row = await cursor.fetchone()
+            async with conn.execute("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL") as cursor:
+                actual = (await cursor.fetchone())[0]
+            await conn.execute('''
+                INSERT INTO stats_counters (name, value) VALUES ('subscribers', ?)
+                ON CONFLICT (name) DO UPDATE
+                SET value = excluded.value, reconciled_at = CURRENT_TIMESTAMP
+            ''', (actual,))
+        return (row[0] if row else None), actual
+
+    async def get_daily_stats(self, days: int) -> list:
+        """Подписки, отписки и недоступные по дням за последние days суток (по возрастанию)"""
+        try:
+            rows = await self._fetchall(
+                "SELECT day, subscribed, unsubscribed, blocked FROM stats_daily WHERE day > ? ORDER BY day",
+                ((stats_day() - timedelta(days=days)).isoformat(),),
+            )
+            return [{**dict(row), 'day': date.fromisoformat(row['day'])} for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении дневной статистики: {e}")
+            return []
+
+    async def get_user_tags(self, user_ids: List[int]) -> Dict[int, List[str]]:
+        """Теги пользователей для экспорта: user_id -> теги по алфавиту"""
+        tags = {}
+        for chunk in _chunks(user_ids):
+            placeholders = ",".join("?" * len(chunk))
+            rows = await self._fetchall(
+                f"SELECT user_id, tag FROM user_tags WHERE user_id IN ({placeholders}) ORDER BY user_id, tag",
+                tuple(chunk),
+            )
+            for row in rows:
+                tags.setdefault(row['user_id'], []).append(row['tag'])
+        return tags
+
+    async def tag_users(self, tag: str, user_ids: List[int]) -> int:
+        """Добавление тега пользователям. Возвращает количество новых тегов"""
+        if not user_ids:
+            return 0
+        tagged = 0
+        try:
+            async with self.transaction() as conn:
+                for chunk in _chunks(user_ids):
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = await conn.execute(
+                        f"INSERT OR IGNORE INTO user_tags (tag, user_id) "
+                        f"SELECT ?, user_id FROM users WHERE user_id IN ({placeholders})",
+                        (tag, *chunk),
+                    )
+                    tagged += cursor.rowcount
+            return tagged
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении тега {tag}: {e}")
+            return 0
+
+    async def untag_users(self, tag: str, user_ids: List[int]) -> int:
+        """Удаление тега у пользователей. Возвращает количество снятых тегов"""
+        if not user_ids:
+            return 0
+        removed = 0
+        try:
+            async with self.transaction() as conn:
+                for chunk in _chunks(user_ids):
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = await conn.execute(
+                        f"DELETE FROM user_tags WHERE tag = ? AND user_id IN ({placeholders})",
+                        (tag, *chunk),
+                    )
+                    removed += cursor.rowcount
+            return removed
+        except Exception as e:
+            logger.error(f"Ошибка при удалении тега {tag}: {e}")
+            return 0
+
+    async def create_broadcast(self, text: str, report_chat_id: int,
+                               segment: Optional[str] = None,
+                               payload: Optional[str] = None,
+                               scheduled_at: Optional[datetime] = None,
+                               max_rate: Optional[float] = None) -> int:
+        """Создание записи о рассылке. Возвращает ID рассылки"""
+        async with self.transaction() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO broadcasts (text, report_chat_id, segment, payload, status, scheduled_at, max_rate) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    text, report_chat_id, segment, payload,
+                    'scheduled' if scheduled_at else 'running',
+                    scheduled_at.timestamp() if scheduled_at else None,
+                    max_rate,
+                ),
+            )
+            return cursor.lastrowid
+
+    async def start_scheduled_broadcast(self, broadcast_id: int) -> bool:
+        """Перевод отложенной рассылки в статус 'running'. False, если она уже не запланирована"""
+        try:
+            async with self.transaction() as conn:
+                cursor = await conn.execute(
+                    "UPDATE broadcasts SET status = 'running', updated_at = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND status = 'scheduled'",
+                    (broadcast_id,),
+                )
+                return cursor.rowcount == 1
+        except Exception as e:
+            logger.error(f"Ошибка при запуске отложенной рассылки {broadcast_id}: {e}")
+            return False
+
+    async def save_broadcast_progress(self, broadcast_id: int, last_user_id: Optional[int],
+                                      done_ahead: List[int], successful: int, failed: int,
+                                      status: Optional[str] = None, pruned: int = 0,
+                                      outcomes: Optional[dict] = None,
+                                      last_subscribed_at: Optional[datetime] = None) -> Optional[str]:
+        """
+        Сохранение контрольной точки рассылки. Завершенная или отмененная
+        рассылка сохраняет свой статус. Возвращает статус рассылки в базе
+        """
+        try:
+            async with self.transaction() as conn:
+                await conn.execute('''
+                    UPDATE broadcasts
+                    SET last_user_id = :last_user_id, done_ahead = :done_ahead,
+                        successful = :successful, failed = :failed,
+                        status = CASE WHEN status IN ('completed', 'cancelled')
+                                      THEN status ELSE COALESCE(:status, status) END,
+                        pruned = :pruned,
+                        outcomes = COALESCE(:outcomes, outcomes),
+                        last_subscribed_at = :last_subscribed_at,
+                        updated_at = CURRENT_TIMESTAMP,
+                        finished_at = CASE WHEN :status IN ('completed', 'cancelled')
+                                                AND status NOT IN ('completed', 'cancelled')
+                                           THEN CURRENT_TIMESTAMP ELSE finished_at END
+                    WHERE id = :id
+                ''', {
+                    'id': broadcast_id,
+                    'last_user_id': last_user_id,
+                    'done_ahead': json.dumps(list(done_ahead)),
+                    'successful': successful,
+                    'failed': failed,
+                    'status': status,
+                    'pruned': pruned,
+                    'outcomes': json.dumps(outcomes) if outcomes else None,
+                    'last_subscribed_at': _dump_timestamp(last_subscribed_at),
+                })
+                async with conn.execute("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,)) as cursor:
+                    row = await cursor.fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении прогресса рассылки {broadcast_id}: {e}")
+            return None
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str,
+                                   expected: Sequence[str] = ()) -> bool:
+        """
+        Изменение статуса рассылки (только из статусов expected, если они указаны).
+        Возвращает True, если рассылка найдена и статус изменен
+        """
+        condition = f"AND status IN ({','.join('?' * len(expected))})" if expected else ""
+        try:
+            async with self.transaction() as conn:
+                cursor = await conn.execute(f'''
+                    UPDATE broadcasts
+                    SET status = ?1,
+                        updated_at = CURRENT_TIMESTAMP,
+                        finished_at = CASE WHEN ?1 IN ('completed', 'cancelled')
+                                           THEN CURRENT_TIMESTAMP ELSE finished_at END
+                    WHERE id = ?2 {condition}
+                ''', (status, broadcast_id, *expected))
+                return cursor.rowcount == 1
+        except Exception as e:
+            logger.error(f"Ошибка при изменении статуса рассылки {broadcast_id}: {e}")
+            return False
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        """Получение рассылки по ID"""
+        try:
+            row = await self._fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+            return _broadcast_from_row(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении рассылки {broadcast_id}: {e}")
+            return None
+
+    async def get_unfinished_broadcasts(self) -> list:
+        """Получение рассылок, которые были прерваны во время выполнения"""
+        try:
+            rows = await self._fetchall(
+                "SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id"
+            )
+            return [_broadcast_from_row(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении незавершенных рассылок: {e}")
+            return []
+
+    async def get_scheduled_broadcasts(self) -> list:
+        """Получение отложенных рассылок в порядке времени запуска"""
+        try:
+            rows = await self._fetchall(
+                "SELECT * FROM broadcasts WHERE status = 'scheduled' ORDER BY scheduled_at"
+            )
+            return [_broadcast_from_row(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении отложенных рассылок: {e}")
+            return []
+
+    async def get_recent_broadcasts(self, limit: int = 10) -> list:
+        """Получение последних рассылок"""
+        try:
+            rows = await self._fetchall(
+                "SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,)
+            )
+            return [_broadcast_from_row(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка рассылок: {e}")
+            return []
+
+    async def get_fsm(self, key: str) -> Optional[Tuple[Optional[str], dict, int]]:
+        """Состояние, данные и версия записи FSM по ключу или None, если записи нет"""
+        row = await self._fetchone("SELECT state, data, version FROM fsm_storage WHERE key = ?", (key,))
+        if row is None:
+            return None
+        return row['state'], json.loads(row['data']), row['version']
+
+    async def get_fsm_version(self, key: str) -> int:
+        """Версия записи FSM (0, если записи нет)"""
+        row = await self._fetchone("SELECT version FROM fsm_storage WHERE key = ?", (key,))
+        return row['version'] if row else 0
+
+    async def _upsert_fsm(self, key: str, column: str, value) -> int:
+        """Запись колонки state или data с увеличением версии"""
+        async with self.transaction() as conn:
+            await conn.execute(f'''
+                INSERT INTO fsm_storage (key, {column}, version) VALUES (?, ?, 1)
+                ON CONFLICT (key) DO UPDATE
+                SET {column} = excluded.{column}, updated_at = CURRENT_TIMESTAMP,
+                    version = fsm_storage.version + 1
+            ''', (key, value))
+            async with conn.execute("SELECT version FROM fsm_storage WHERE key = ?", (key,)) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def set_fsm_state(self, key: str, state: Optional[str]) -> int:
+        """Сохранение состояния FSM. Возвращает новую версию записи"""
+        return await self._upsert_fsm(key, "state", state)
+
+    async def set_fsm_data(self, key: str, data: dict) -> int:
+        """Сохранение данных FSM. Возвращает новую версию записи"""
+        return await self._upsert_fsm(key, "data", json.dumps(data))
+
+    async def claim_update(self, update_id: int) -> bool:
+        """Отметка апдейта как обрабатываемого. False, если он уже обработан"""
+        try:
+            async with self.transaction() as conn:
+                cursor = await conn.execute(
+                    "INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?, ?)",
+                    (update_id, time.time()),
+                )
+                return cursor.rowcount == 1
+        except Exception as e:
+            # Лучше обработать апдейт повторно, чем потерять его
+            logger.error(f"Ошибка при отметке апдейта {update_id}: {e}")
+            return True
+
+    async def release_update(self, update_id: int):
+        """Снятие отметки с апдейта, обработка которого завершилась ошибкой"""
+        try:
+            async with self.transaction() as conn:
+                await conn.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+        except Exception as e:
+            logger.error(f"Ошибка при снятии отметки с апдейта {update_id}: {e}")
+
+    async def prune_processed_updates(self, max_age: float) -> int:
+        """Удаление отметок об апдейтах старше max_age секунд"""
+        try:
+            async with self.transaction() as conn:
+                cursor = await conn.execute(
+                    "DELETE FROM processed_updates WHERE processed_at < ?",
+                    (time.time() - max_age,),
+                )
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка при очистке обработанных апдейтов: {e}")
+            return 0
+
+    async def close(self):
+        """Запись накопленных операций и закрытие базы данных"""
+        if self.conn:
+            await self.writer.drain()
+            await self.conn.close()
+            self.conn = None
+            logger.info("База данных SQLite закрыта")
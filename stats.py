@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Статистика подписчиков без полного сканирования таблицы users.
+
+Количество активных подписчиков хранится счетчиком (таблица stats_counters),
+а подписки, отписки и ставшие недоступными по дням — в таблице stats_daily.
+Оба обновляются в той же транзакции, что и пакетная запись подписок, поэтому
+/stats читает одну строку счетчика и несколько десятков строк истории
+независимо от размера базы.
+
+Счетчик может разойтись с таблицей (ручные правки в базе, записи во время
+сверки), поэтому StatsReconciler периодически пересчитывает его в фоне.
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List
+
+from config import STATS_RECONCILE_INTERVAL
+from database import db
+from storage import stats_day
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PeriodStats:
+    """Итоги подписок за последние несколько суток"""
+
+    def __init__(self, days: int, subscribed: int, unsubscribed: int, blocked: int, subscribers: int):
+        """
+        Args:
+            days (int): длина периода в сутках (включая текущие)
+            subscribed (int): новые и вернувшиеся подписчики
+            unsubscribed (int): отписавшиеся
+            blocked (int): ставшие недоступными (заблокировали бота)
+            subscribers (int): подписчиков сейчас
+        """
+        self.days = days
+        self.subscribed = subscribed
+        self.unsubscribed = unsubscribed
+        self.blocked = blocked
+        self.subscribers = subscribers
+
+    @property
+    def lost(self) -> int:
+        return self.unsubscribed + self.blocked
+
+    @property
+    def net(self) -> int:
+        """Прирост за период"""
+        return self.subscribed - self.lost
+
+    @property
+    def churn(self) -> float:
+        """Отток: доля подписчиков на начало периода, которые ушли за период"""
+        start = self.subscribers - self.net
+        return self.lost / start if start > 0 else 0.0
+
+
+def summarize(history: List[dict], subscribers: int, days: int) -> PeriodStats:
+    """Итоги за последние days суток по строкам db.get_daily_stats"""
+    since = stats_day() - timedelta(days=days)
+    rows = [row for row in history if row['day'] > since]
+    return PeriodStats(
+        days,
+        sum(row['subscribed'] for row in rows),
+        sum(row['unsubscribed'] for row in rows),
+        sum(row['blocked'] for row in rows),
+        subscribers,
+    )
+
+
+class StatsReconciler:
+    """Фоновая сверка счетчика подписчиков с таблицей users"""
+
+    def __init__(self, interval: float = STATS_RECONCILE_INTERVAL):
+        """
+        Args:
+            interval (float): период сверки в секундах (0 — только начальная сверка)
+        """
+        self.interval = interval
+        self._task = None
+
+    async def reconcile(self) -> int:
+        """Пересчитать счетчик. Возвращает фактическое количество подписчиков"""
+        previous, actual = await db.reconcile_subscribers_count()
+        if previous is None:
+            logger.info(f"📊 Счетчик подписчиков создан: {actual}")
+        elif previous != actual:
+            logger.warning(f"📊 Счетчик подписчиков расходился с таблицей: {previous} → {actual}")
+        return actual
+
+    async def subscribers(self) -> int:
+        """Количество подписчиков по счетчику; при первом запуске счетчик создается"""
+        count = await db.get_subscribers_count()
+        if count is None:
+            count = await self.reconcile()
+        return count
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _reconcile_logged(self):
+        try:
+            await self.reconcile()
+        except Exception as e:
+            logger.error(f"Ошибка при сверке счетчика подписчиков: {e}")
+
+    async def _run(self):
+        # Без счетчика /stats пришлось бы считать строки, поэтому
+        # на новой базе первая сверка выполняется сразу
+        if await db.get_subscribers_count() is None:
+            await self._reconcile_logged()
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._reconcile_logged()
+
+
+# Общий сверщик статистики процесса
+reconciler = StatsReconciler()
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Общий интерфейс хранилища подписчиков.
+
+Бот работает с базой данных только через методы, описанные в Storage.
+Реализации: database.Database (PostgreSQL) и sqlite_database.SqliteDatabase (SQLite).
+Общая для них логика — кэш подписок, пакетная запись и порядок чтения
+сегментов — находится в BaseStorage.
+"""
+
+import heapq
+import logging
+from collections import deque
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Protocol, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from batching import WriteBatcher
+from cache import SubscriptionCache
+from config import BROADCAST_BATCH_SIZE, STATS_TIMEZONE
+from segments import Segment
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Колонки таблицы users при импорте и экспорте, в этом порядке
+USER_COLUMNS = (
+    'user_id', 'username', 'first_name', 'last_name', 'language_code', 'subscribed_at', 'blocked_at',
+)
+
+
+# Позиция получателя в рассылке: (subscribed_at, user_id) для сегментов,
+# которые читаются по дате подписки, и (None, user_id) для остальных
+Position = Tuple[Optional[datetime], int]
+
+
+def stats_day(moment: Optional[datetime] = None) -> date:
+    """Сутки дневной статистики в часовом поясе STATS_TIMEZONE"""
+    moment = moment or datetime.now(timezone.utc)
+    return moment.astimezone(ZoneInfo(STATS_TIMEZONE)).date()
+
+
+async def merge_batches(streams: List[AsyncIterator[List[int]]], batch_size: int) -> AsyncIterator[List[int]]:
+    """
+    Слияние потоков ID, отсортированных по возрастанию, в один такой же поток.
+
+    Из каждого потока в памяти находится не больше одной страницы,
+    следующая страница запрашивается, когда предыдущая разобрана.
+    """
+    heap = []
+    pages = {}
+
+    async def advance(index: int):
+        page = await anext(streams[index], None)
+        if page:
+            pages[index] = deque(page)
+            heapq.heappush(heap, (page[0], index))
+
+    for index in range(len(streams)):
+        await advance(index)
+
+    batch = []
+    while heap:
+        user_id, index = heapq.heappop(heap)
+        page = pages[index]
+        page.popleft()
+        batch.append(user_id)
+        if page:
+            heapq.heappush(heap, (page[0], index))
+        else:
+            await advance(index)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Storage(Protocol):
+    """Интерфейс хранилища, которым пользуются обработчики и движок рассылки"""
+
+    cache: SubscriptionCache
+
+    async def connect(self): ...
+
+    async def close(self): ...
+
+    async def add_user(self, user_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None,
+                       language_code: str = None) -> bool: ...
+
+    async def remove_user(self, user_id: int) -> bool: ...
+
+    def cached_subscription(self, user_id: int) -> Optional[bool]: ...
+
+    async def is_user_subscribed(self, user_id: int) -> bool: ...
+
+    async def get_all_users(self) -> list: ...
+
+    def iter_user_batches(self, batch_size: int = ..., after: Optional[int] = None,
+                          segment: Optional[Segment] = None) -> AsyncIterator[List[int]]: ...
+
+    def iter_recipients(self, segment: Segment, after: Optional[Position] = None,
+                        batch_size: int = ...) -> AsyncIterator[List[Position]]: ...
+
+    async def get_users_count(self, segment: Optional[Segment] = None) -> int: ...
+
+    def iter_user_records(self, batch_size: int = ...) -> AsyncIterator[List[tuple]]: ...
+
+    async def import_user_records(self, records: List[tuple]) -> Set[int]: ...
+
+    async def get_user_tags(self, user_ids: List[int]) -> Dict[int, List[str]]: ...
+
+    async def tag_users(self, tag: str, user_ids: List[int]) -> int: ...
+
+    async def untag_users(self, tag: str, user_ids: List[int]) -> int: ...
+
+    async def mark_users_unreachable(self, user_ids: List[int]) -> int: ...
+
+    async def get_subscribers_count(self) -> Optional[int]: ...
+
+    async def reconcile_subscribers_count(self) -> Tuple[Optional[int], int]: ...
+
+    async def get_daily_stats(self, days: int) -> list: ...
+
+    async def create_broadcast(self, text: str, report_chat_id: int,
+                               segment: Optional[str] = None,
+                               payload: Optional[str] = None,
+                               scheduled_at: Optional[datetime] = None,
+                               max_rate: Optional[float] = None) -> int: ...
+
+    async def start_scheduled_broadcast(self, broadcast_id: int) -> bool: ...
+
+    async def save_broadcast_progress(self, broadcast_id: int, last_user_id: Optional[int],
+                                      done_ahead: List[int], successful: int, failed: int,
+                                      status: Optional[str] = None, pruned: int = 0,
+                                      outcomes: Optional[dict] = None,
+                                      last_subscribed_at: Optional[datetime] = None) -> Optional[str]: ...
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str,
+                                   expected: Sequence[str] = ()) -> bool: ...
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]: ...
+
+    async def get_unfinished_broadcasts(self) -> list: ...
+
+    async def get_scheduled_broadcasts(self) -> list: ...
+
+    async def get_recent_broadcasts(self, limit: int = 10) -> list: ...
+
+    async def get_fsm(self, key: str) -> Optional[Tuple[Optional[str], dict, int]]: ...
+
+    async def get_fsm_version(self, key: str) -> int: ...
+
+    async def set_fsm_state(self, key: str, state: Optional[str]) -> int: ...
+
+    async def set_fsm_data(self, key: str, data: dict) -> int: ...
+
+    async def claim_update(self, update_id: int) -> bool: ...
+
+    async def release_update(self, update_id: int): ...
+
+    async def prune_processed_updates(self, max_age: float) -> int: ...
+
+    def get_pool_stats(self) -> dict: ...
+
+
+class PoolStats:
+    """Счетчики ожидания и использования соединений"""
+
+    def __init__(self):
+        self.acquires = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def record(self, wait: float, hold: float):
+        self.acquires += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.hold_total += hold
+        self.hold_max = max(self.hold_max, hold)
+
+    def snapshot(self) -> dict:
+        return {
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+            'wait_avg': self.wait_total / self.acquires if self.acquires else 0.0,
+            'wait_max': self.wait_max,
+            'hold_avg': self.hold_total / self.acquires if self.acquires else 0.0,
+            'hold_max': self.hold_max,
+        }
+
+
+class BaseStorage:
+    """
+    Общая часть реализаций хранилища.
+
+    Наследник реализует пакетные _insert_users/_delete_users, точечную
+    проверку _fetch_subscribed и чтение страниц сегмента _iter_id_pages /
+    _iter_subscription_pages, а кэш, объединение записей и порядок чтения
+    сегментов берет отсюда.
+    Пакетные записи обновляют счетчики статистики (см. stats.py) в той же
+    транзакции, что и таблицу users.
+    """
+
+    def __init__(self):
+        self.pool_stats = PoolStats()
+        # Кэш подписок: заполняется лениво и обновляется при каждой записи
+        self.cache = SubscriptionCache()
+        # Подписки и отписки записываются пакетами
+        self.writer = WriteBatcher(self._insert_users, self._delete_users)
+
+    async def _insert_users(self, rows: List[Tuple]) -> Set[int]:
+        """
+        Пакетное добавление пользователей.
+
+        Args:
+            rows: кортежи (user_id, username, first_name, last_name, language_code)
+                с уникальными user_id
+
+        Returns:
+            Set[int]: ID пользователей, которых не было в базе
+        """
+        raise NotImplementedError
+
+    async def _delete_users(self, user_ids: List[int]) -> Set[int]:
+        """Пакетное удаление пользователей. Возвращает ID удаленных"""
+        raise NotImplementedError
+
+    async def _fetch_subscribed(self, user_id: int) -> bool:
+        """Проверка подписки запросом к базе"""
+        raise NotImplementedError
+
+    def _iter_id_pages(self, segment: Segment, after: Optional[int],
+                       batch_size: int) -> AsyncIterator[List[int]]:
+        """Keyset-пагинация ID подписчиков сегмента по возрастанию user_id"""
+        raise NotImplementedError
+
+    def _iter_subscription_pages(self, segment: Segment, after: Optional[Position],
+                                 batch_size: int) -> AsyncIterator[List[Position]]:
+        """Keyset-пагинация подписчиков сегмента в порядке (subscribed_at, user_id)"""
+        raise NotImplementedError
+
+    async def add_user(self, user_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None,
+                       language_code: str = None) -> bool:
+        """
+        Добавление пользователя в базу данных.
+
+        Запись выполняется пакетом вместе с другими подписками,
+        пришедшими в течение нескольких миллисекунд.
+
+        Returns:
+            bool: True если пользователь добавлен, False если уже существует
+        """
+        try:
+            added = await self.writer.add(user_id, username, first_name, last_name, language_code)
+            # В обоих случаях пользователь теперь подписан
+            self.cache.set(user_id, True)
+
+            if added:
+                logger.info(f"Пользователь {user_id} добавлен в базу данных")
+                return True
+            else:
+                logger.info(f"Пользователь {user_id} уже существует")
+                return False
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении пользователя: {e}")
+            return False
+
+    async def remove_user(self, user_id: int) -> bool:
+        """
+        Удаление пользователя из базы данных.
+
+        Запись выполняется пакетом вместе с другими отписками.
+
+        Returns:
+            bool: True если пользователь удален, False если не найден
+        """
+        try:
+            removed = await self.writer.remove(user_id)
+            self.cache.set(user_id, False)
+            if removed:
+                logger.info(f"Пользователь {user_id} удален из базы данных")
+                return True
+            else:
+                logger.info(f"Пользователь {user_id} не найден в базе данных")
+                return False
+        except Exception as e:
+            logger.error(f"Ошибка при удалении пользователя: {e}")
+            return False
+
+    def cached_subscription(self, user_id: int) -> Optional[bool]:
+        """
+        Состояние подписки из кэша без обращения к базе (None — неизвестно).
+
+        Если кэш общий с другими процессами, ответ «подписан» не возвращается:
+        рассылка в основном процессе могла пометить пользователя недоступным,
+        и его /start должен пройти через add_user, который вернет подписку.
+        """
+        cached = self.cache.get(user_id)
+        if cached and not self.cache.exclusive:
+            return None
+        return cached
+
+    async def is_user_subscribed(self, user_id: int) -> bool:
+        """Проверка подписки пользователя"""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        try:
+            subscribed = await self._fetch_subscribed(user_id)
+            self.cache.set(user_id, subscribed)
+            return subscribed
+        except Exception as e:
+            logger.error(f"Ошибка при проверке подписки: {e}")
+            return False
+
+    async def iter_user_batches(self, batch_size: int = BROADCAST_BATCH_SIZE,
+                                after: Optional[int] = None,
+                                segment: Optional[Segment] = None) -> AsyncIterator[List[int]]:
+        """
+        Постраничное чтение ID подписчиков.
+
+        Каждая страница — короткий индексный запрос (keyset-пагинация),
+        соединение не удерживается между страницами, а в памяти находится
+        не больше batch_size ID на каждую часть сегмента.
+
+        Args:
+            batch_size (int): размер порции
+            after (int): начать с ID строго больше указанного (для продолжения рассылки)
+            segment (Segment): читать только подписчиков сегмента
+
+        Yields:
+            List[int]: очередная порция ID, отсортированных по возрастанию
+                (для сегментов Segment.by_subscription — по дате подписки)
+        """
+        segment = segment or Segment()
+        if segment.by_subscription:
+            if after is not None:
+                raise ValueError("Сегмент по дате подписки продолжается с позиции, см. iter_recipients")
+            async for batch in self._iter_subscription_pages(segment, None, batch_size):
+                yield [user_id for _, user_id in batch]
+            return
+
+        parts = segment.parts()
+        if len(parts) == 1:
+            batches = self._iter_id_pages(segment, after, batch_size)
+        else:
+            batches = merge_batches([self._iter_id_pages(part, after, batch_size) for part in parts], batch_size)
+        async for batch in batches:
+            yield batch
+
+    async def iter_recipients(self, segment: Segment, after: Optional[Position] = None,
+                              batch_size: int = BROADCAST_BATCH_SIZE) -> AsyncIterator[List[Position]]:
+        """
+        Получатели рассылки с позициями для контрольной точки.
+
+        Args:
+            after (Position): позиция, после которой продолжить рассылку
+
+        Yields:
+            List[Position]: очередная порция в порядке чтения сегмента
+        """
+        if segment.by_subscription and (after is None or after[0] is not None):
+            async for batch in self._iter_subscription_pages(segment, after, batch_size):
+                yield batch
+            return
+
+        # Контрольная точка без subscribed_at сохранена до появления порядка
+        # по дате подписки — такая рассылка продолжается по user_id
+        after_id = after[1] if after else None
+        if segment.by_subscription:
+            batches = self._iter_id_pages(segment, after_id, batch_size)
+        else:
+            batches = self.iter_user_batches(batch_size, after_id, segment)
+        async for batch in batches:
+            yield [(None, user_id) for user_id in batch]
+
+    def get_pool_stats(self) -> dict:
+        """Метрики ожидания соединений"""
+        return self.pool_stats.snapshot()
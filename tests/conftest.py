@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Модули бота лежат в корне проекта — добавляем его в sys.path для тестов"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
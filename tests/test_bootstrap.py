@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Порядок middleware диспетчера: ограничение частоты раньше отметки апдейтов в базе"""
+
+import asyncio
+
+from aiogram import Bot
+from aiogram.types import Update
+
+import bootstrap
+from dedup import UpdateDeduplicator
+from sqlite_database import SqliteDatabase
+from throttling import ThrottlingMiddleware
+
+
+def test_flood_is_shed_before_update_is_claimed(tmp_path, monkeypatch):
+    db = SqliteDatabase(str(tmp_path / "bootstrap.db"))
+    monkeypatch.setattr(bootstrap, "db", db)
+    bot = Bot(token="1:x")
+    dp = bootstrap.create_dispatcher(bot)
+    middlewares = list(dp.update.outer_middleware)
+    throttler = next(m for m in middlewares if isinstance(m, ThrottlingMiddleware))
+    dedup = next(m for m in middlewares if isinstance(m, UpdateDeduplicator))
+    assert middlewares.index(throttler) < middlewares.index(dedup)
+
+    claimed = []
+
+    async def claim_update(update_id):
+        claimed.append(update_id)
+        return True
+
+    monkeypatch.setattr(db, "claim_update", claim_update)
+    monkeypatch.setattr(dedup, "shared", True)
+    monkeypatch.setattr(dedup, "_schedule_prune", lambda now: None)
+    throttler.limiter.rules = {"default": (5, 60.0)}
+    throttler.exempt = set()
+
+    async def flood():
+        await db.connect()
+        for update_id in range(1, 21):
+            # Правка сообщения: обработчика нет, поэтому бот не обращается к Bot API
+            await dp.feed_update(bot, Update.model_validate({
+                "update_id": update_id,
+                "edited_message": {
+                    "message_id": 1, "date": 0, "edit_date": 0, "text": "флуд",
+                    "chat": {"id": 42, "type": "private"},
+                    "from": {"id": 42, "is_bot": False, "first_name": "user"},
+                },
+            }))
+        await bot.session.close()
+        await db.close()
+
+    asyncio.run(flood())
+    assert claimed == [1, 2, 3, 4, 5]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Сбор альбомов администратора до выбора обработчика"""
+
+import asyncio
+
+from aiogram.types import Message
+
+from content import AlbumCollector, AlbumMiddleware
+
+ADMIN = 7
+
+
+def _message(message_id: int, user_id: int = ADMIN, caption: str = None, media_group_id: str = "g") -> Message:
+    return Message.model_validate({
+        "message_id": message_id, "date": 0, "media_group_id": media_group_id, "caption": caption,
+        "photo": [{"file_id": f"P{message_id}", "file_unique_id": f"U{message_id}", "width": 1, "height": 1}],
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+    })
+
+
+def test_album_items_collected_even_when_a_command_handles_them():
+    collector = AlbumCollector()
+    middleware = AlbumMiddleware(collector, ADMIN)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.message_id)
+        return "ok"
+
+    async def run():
+        results = [await middleware(handler, _message(1, caption="/send"), {})]
+        results.append(await middleware(handler, _message(2), {}))
+        results.append(await middleware(handler, _message(3, user_id=99), {}))
+        results.append(await middleware(handler, _message(4, media_group_id=None), {}))
+        return results
+
+    assert asyncio.run(run()) == ["ok"] * 4
+    assert handled == [1, 2, 3, 4]
+    assert [message.message_id for message in collector.get("g")] == [1, 2]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Отбрасывание повторных доставок апдейтов и снятие отметки при ошибке"""
+
+import asyncio
+
+import pytest
+from aiogram.types import Update
+
+from dedup import UpdateDeduplicator
+from sqlite_database import SqliteDatabase
+
+
+def _run(tmp_path, scenario):
+    async def run():
+        db = SqliteDatabase(str(tmp_path / "dedup.db"))
+        await db.connect()
+        try:
+            await scenario(db)
+        finally:
+            await db.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_redelivery_dropped_after_success(tmp_path, shared):
+    async def scenario(db):
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event.update_id)
+
+        replica = UpdateDeduplicator(db, shared=shared)
+        await replica(handler, Update(update_id=1), {})
+        await replica(handler, Update(update_id=1), {})
+        assert handled == [1]
+
+        # Повтор на другой реплике отбрасывается только с общей отметкой в базе
+        await UpdateDeduplicator(db, shared=shared)(handler, Update(update_id=1), {})
+        assert handled == ([1] if shared else [1, 1])
+
+    _run(tmp_path, scenario)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_failed_update_released_for_redelivery(tmp_path, shared):
+    async def scenario(db):
+        handled = []
+
+        async def failing(event, data):
+            raise RuntimeError("обработчик упал")
+
+        async def handler(event, data):
+            handled.append(event.update_id)
+
+        replica = UpdateDeduplicator(db, shared=shared)
+        with pytest.raises(RuntimeError):
+            await replica(failing, Update(update_id=2), {})
+        await replica(handler, Update(update_id=2), {})
+        assert handled == [2]
+        if shared:
+            await UpdateDeduplicator(db, shared=shared)(handler, Update(update_id=2), {})
+            assert handled == [2]
+
+    _run(tmp_path, scenario)
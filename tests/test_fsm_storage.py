@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Состояния FSM, общие для нескольких процессов с собственным кэшем"""
+
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import DatabaseFSMStorage
+from sqlite_database import SqliteDatabase
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def _run(tmp_path, scenario):
+    async def run():
+        first, second = SqliteDatabase(str(tmp_path / "fsm.db")), SqliteDatabase(str(tmp_path / "fsm.db"))
+        await first.connect()
+        await second.connect()
+        try:
+            await scenario(DatabaseFSMStorage(first), DatabaseFSMStorage(second))
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
+
+
+def test_replica_sees_state_written_by_another(tmp_path):
+    async def scenario(replica_a, replica_b):
+        await replica_a.set_state(KEY, "Form:name")
+        await replica_a.set_data(KEY, {"step": 1})
+        assert await replica_b.get_state(KEY) == "Form:name"
+
+        # Реплика B продвигает диалог, у A в кэше старая версия
+        await replica_b.set_state(KEY, "Form:age")
+        await replica_b.set_data(KEY, {"step": 2})
+        assert await replica_a.get_state(KEY) == "Form:age"
+        assert await replica_a.get_data(KEY) == {"step": 2}
+
+        await replica_a.set_state(KEY, None)
+        assert await replica_b.get_state(KEY) is None
+        assert await replica_b.get_data(KEY) == {"step": 2}
+
+    _run(tmp_path, scenario)
+
+
+def test_cache_hit_only_for_own_last_write(tmp_path):
+    async def scenario(replica_a, replica_b):
+        await replica_a.set_state(KEY, "Form:name")
+        await replica_a.set_data(KEY, {"step": 1})
+
+        hits = replica_a.cache.hits
+        assert await replica_a.get_data(KEY) == {"step": 1}
+        assert replica_a.cache.hits == hits + 1
+
+        # Запись другой реплики между чтением и записью A: вторая колонка в кэше A устарела
+        await replica_b.set_data(KEY, {"step": 2})
+        await replica_a.set_state(KEY, "Form:age")
+        assert len(replica_a.cache) == 0
+        assert await replica_a.get_data(KEY) == {"step": 2}
+        assert await replica_a.get_state(KEY) == "Form:age"
+
+    _run(tmp_path, scenario)
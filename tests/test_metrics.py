@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Метрики процессов-обработчиков в /metrics основного процесса"""
+
+from metrics import Registry
+
+
+def _worker_registry(updates: int, in_progress: float) -> Registry:
+    registry = Registry()
+    counter = registry.counter("updates_total", "Апдейты", ("type",))
+    gauge = registry.gauge("in_progress", "В обработке")
+    histogram = registry.histogram("seconds", "Время", buckets=(0.1, 1.0))
+    for _ in range(updates):
+        counter.inc("message")
+        histogram.observe(0.5)
+    gauge.set(in_progress)
+    return registry
+
+
+def test_worker_snapshots_are_merged():
+    main = _worker_registry(1, 0)
+    main.merge("0", _worker_registry(2, 3).snapshot())
+    main.merge("1", _worker_registry(4, 1).snapshot())
+    # Повторный снимок заменяет предыдущий, а не добавляется к нему
+    main.merge("1", _worker_registry(5, 2).snapshot())
+
+    lines = main.render().splitlines()
+    assert 'updates_total{type="message"} 8.0' in lines
+    assert 'seconds_bucket{le="0.1"} 0' in lines
+    assert 'seconds_bucket{le="1.0"} 8' in lines
+    assert 'seconds_count 8' in lines
+    assert 'in_progress 0' in lines
+    assert 'in_progress{worker="0"} 3' in lines
+    assert 'in_progress{worker="1"} 2' in lines
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Планировщик: разбор времени запуска /schedule и передача рассылок основному процессу"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from broadcast import Broadcaster
+from scheduler import EVENT_RUNNING, EVENT_SCHEDULED, Scheduler, parse_schedule_time
+
+# 15:00 по Москве, 08:00 в Нью-Йорке (летнее время)
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_relative_time_ignores_zone():
+    assert parse_schedule_time("+90m текст", NOW, "Europe/Moscow") == (NOW + timedelta(minutes=90), "текст")
+    assert parse_schedule_time("+1d", NOW, "America/New_York") == (NOW + timedelta(days=1), "")
+
+
+@pytest.mark.parametrize("args, tz_name, expected", [
+    # Сегодня по местному времени
+    ("18:30 текст", "Europe/Moscow", utc(2024, 6, 1, 15, 30)),
+    ("18:30 текст", "America/New_York", utc(2024, 6, 1, 22, 30)),
+    ("18:30 текст", "UTC", utc(2024, 6, 1, 18, 30)),
+    # Уже прошло по местному времени — завтра
+    ("14:59 текст", "Europe/Moscow", utc(2024, 6, 2, 11, 59)),
+    ("15:00 текст", "Europe/Moscow", utc(2024, 6, 2, 12, 0)),
+    # В UTC 13:00 еще впереди, а по Москве уже прошло
+    ("13:00 текст", "UTC", utc(2024, 6, 1, 13, 0)),
+    ("13:00 текст", "Europe/Moscow", utc(2024, 6, 2, 10, 0)),
+])
+def test_clock_time_in_zone(args, tz_name, expected):
+    assert parse_schedule_time(args, NOW, tz_name) == (expected, "текст")
+
+
+def test_clock_time_uses_local_date():
+    # 22:00 UTC — по Москве уже 2 июня 01:00, поэтому 00:30 — это 3 июня
+    now = utc(2024, 6, 1, 22, 0)
+    assert parse_schedule_time("00:30", now, "Europe/Moscow") == (utc(2024, 6, 2, 21, 30), "")
+    assert parse_schedule_time("00:30", now, "UTC") == (utc(2024, 6, 2, 0, 30), "")
+
+
+@pytest.mark.parametrize("args, tz_name, expected", [
+    ("2024-06-01 18:30 текст", "America/New_York", utc(2024, 6, 1, 22, 30)),
+    # Зимнее время в Нью-Йорке — другое смещение
+    ("2024-12-01 18:30 текст", "America/New_York", utc(2024, 12, 1, 23, 30)),
+    ("2024-06-02 00:00 текст", "Europe/Moscow", utc(2024, 6, 1, 21, 0)),
+])
+def test_date_time_in_zone(args, tz_name, expected):
+    assert parse_schedule_time(args, NOW, tz_name) == (expected, "текст")
+
+
+@pytest.mark.parametrize("args, tz_name", [
+    ("2024-05-31 18:30 текст", "UTC"),
+    # 15:00 по Москве — ровно сейчас
+    ("2024-06-01 15:00 текст", "Europe/Moscow"),
+    # 14:00 в UTC еще впереди, а по Москве уже прошло
+    ("2024-06-01 14:00 текст", "Europe/Moscow"),
+])
+def test_past_date_time_rejected(args, tz_name):
+    with pytest.raises(ValueError, match="уже прошло"):
+        parse_schedule_time(args, NOW, tz_name)
+
+
+@pytest.mark.parametrize("args", [
+    "", "   ", "25:00 текст", "18:60 текст", "18.30 текст", "2024-13-01 18:30 текст",
+    "2024-06-01", "2024-06-01 текст", "+5x текст", "+ текст",
+])
+def test_malformed_time_rejected(args):
+    with pytest.raises(ValueError):
+        parse_schedule_time(args, NOW, "Europe/Moscow")
+
+
+def test_worker_forwards_broadcasts_to_main_process():
+    events = []
+    worker = Scheduler(Broadcaster())
+    worker.forward_to(events.append)
+    assert worker.engine.runs_jobs is False
+
+    worker.add(5, utc(2024, 6, 1, 18, 30))
+    worker.engine.handoff(6)
+    assert worker.pending == 0
+    assert events == [(EVENT_SCHEDULED, 5, utc(2024, 6, 1, 18, 30).timestamp()), (EVENT_RUNNING, 6)]
+
+    main = Scheduler(Broadcaster())
+    # Как после start(): события до запуска ждут его
+    main._started.set()
+    asyncio.run(main.handle_event(events[0]))
+    asyncio.run(main.handle_event(events[0]))
+    assert main.pending == 1
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Сегменты подписчиков: чтение страниц по индексам фильтров (SQLite)"""
+
+import asyncio
+from datetime import date
+
+import pytest
+
+from segments import Segment, parse_segment
+from sqlite_database import SqliteDatabase
+
+
+def _query_plans(tmp_path, segment: Segment, after=None) -> list:
+    """Планы запросов, которыми iter_recipients читает сегмент"""
+
+    async def run():
+        db = SqliteDatabase(str(tmp_path / "segments.db"))
+        await db.connect()
+        try:
+            await db.import_user_records([
+                (user_id, None, None, None, ("ru", "en")[user_id % 2], None, None)
+                for user_id in range(1, 501)
+            ])
+            queries = []
+            fetchall = db._fetchall
+
+            async def recording_fetchall(query, params=()):
+                queries.append((query, params))
+                return await fetchall(query, params)
+
+            db._fetchall = recording_fetchall
+            async for _ in db.iter_recipients(segment, after, batch_size=100):
+                pass
+
+            plans = []
+            for query, params in queries:
+                rows = await fetchall(f"EXPLAIN QUERY PLAN {query}", params)
+                plans.append(" ".join(row['detail'] for row in rows))
+            return plans
+        finally:
+            await db.close()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("segment, index", [
+    (Segment(sample=(0, 10)), "users_sample_bucket_idx (<expr>=? AND user_id>?)"),
+    (Segment(sample=(7, 8)), "users_sample_bucket_idx (<expr>=? AND user_id>?)"),
+    (Segment(languages=["ru", "en"]), "users_language_code_idx (language_code=? AND user_id>?)"),
+    (Segment(languages=["ru"], sample=(0, 50)), "users_language_code_idx (language_code=? AND user_id>?)"),
+])
+def test_next_pages_search_segment_index(tmp_path, segment, index):
+    plans = _query_plans(tmp_path, segment, after=(None, 0))
+    assert plans
+    assert all(f"SEARCH users USING INDEX {index}" in plan for plan in plans), plans
+
+
+def test_since_pages_by_subscription_index(tmp_path):
+    segment = Segment(since=date(2000, 1, 1))
+    assert segment.by_subscription
+
+    plans = _query_plans(tmp_path, segment)
+    assert len(plans) > 1
+    assert all("USING INDEX users_subscribed_at_idx" in plan for plan in plans), plans
+    assert not any("TEMP B-TREE" in plan for plan in plans), plans
+
+
+def test_parts_split_languages_and_buckets():
+    assert [part.languages for part in Segment(languages=["uk", "ru"]).parts()] == [("ru",), ("uk",)]
+    assert [part.sample for part in Segment(sample=(3, 6)).parts()] == [(3, 4), (4, 5), (5, 6)]
+    # С языком выборка остается фильтром, а since не меняет порядок чтения
+    segment = Segment(since=date(2024, 1, 1), languages=["ru"], sample=(0, 10))
+    assert segment.parts() == [segment]
+    assert not segment.by_subscription
+
+
+@pytest.mark.parametrize("args, sample, text", [
+    ("sample:10% привет", (0, 10), "привет"),
+    ("sample:10-20 привет", (10, 20), "привет"),
+    ("sample:0-100% привет", (0, 100), "привет"),
+    ("sample:99-100%", (99, 100), ""),
+])
+def test_parse_sample(args, sample, text):
+    segment, rest = parse_segment(args)
+    assert segment.sample == sample
+    assert rest == text
+
+
+@pytest.mark.parametrize("value", [
+    "0%", "20-10%", "10-10%", "101%", "0-101%", "abc", "10%%", "-10%", "10-%", "1000%", "5.5%",
+])
+def test_parse_sample_rejects_malformed_range(value):
+    with pytest.raises(ValueError):
+        parse_segment(f"sample:{value} привет")
+
+
+def test_parse_segment_stops_at_text():
+    segment, rest = parse_segment("lang:ru,EN текст sample:abc")
+    assert segment.languages == ("en", "ru")
+    assert segment.sample is None
+    assert rest == "текст sample:abc"
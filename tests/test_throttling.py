@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Ограничение частоты: граница окна у ведра токенов"""
+
+import asyncio
+
+import pytest
+from aiogram.types import Update, User
+
+import throttling
+from throttling import THROTTLE_NOTICE, ThrottlingMiddleware, UserRateLimiter
+
+# 3 команды подряд, затем одна раз в 20 секунд
+RULES = {"start": (3, 60.0), "default": (1, 10.0)}
+
+
+def test_burst_then_refill_at_window_boundary():
+    limiter = UserRateLimiter(RULES)
+    assert [limiter.hit(1, "start", now=100.0) for _ in range(3)] == [(True, False)] * 3
+    assert limiter.hit(1, "start", now=100.0) == (False, True)
+    assert limiter.hit(1, "start", now=119.99) == (False, False)
+    # Ровно через 60 / 3 секунд накапливается один токен
+    assert limiter.hit(1, "start", now=120.0) == (True, False)
+    assert limiter.hit(1, "start", now=120.0) == (False, True)
+
+
+def test_rejected_hits_do_not_delay_refill():
+    limiter = UserRateLimiter(RULES)
+    for _ in range(3):
+        limiter.hit(1, "start", now=0.0)
+    for now in (5.0, 10.0, 15.0):
+        assert limiter.hit(1, "start", now=now)[0] is False
+    assert limiter.hit(1, "start", now=20.0) == (True, False)
+
+
+def test_full_window_restores_burst_without_overflow():
+    limiter = UserRateLimiter(RULES)
+    for _ in range(3):
+        limiter.hit(1, "start", now=0.0)
+    # За окно вдвое длиннее ведро наполняется только до емкости
+    allowed = [limiter.hit(1, "start", now=120.0)[0] for _ in range(4)]
+    assert allowed == [True, True, True, False]
+
+
+def test_buckets_are_per_user_and_rule():
+    limiter = UserRateLimiter(RULES)
+    assert limiter.hit(1, "default", now=0.0) == (True, False)
+    assert limiter.hit(1, "default", now=9.99) == (False, True)
+    assert limiter.hit(2, "default", now=9.99) == (True, False)
+    assert limiter.hit(1, "start", now=9.99) == (True, False)
+    assert limiter.hit(1, "default", now=10.0) == (True, False)
+
+
+def test_rule_for_falls_back_to_default():
+    limiter = UserRateLimiter(RULES)
+    assert limiter.rule_for("start") == "start"
+    assert limiter.rule_for("help") == "default"
+    assert limiter.rule_for(None) == "default"
+    assert UserRateLimiter({"start": (1, 1.0)}).rule_for("help") is None
+
+
+def test_least_recent_bucket_evicted():
+    limiter = UserRateLimiter(RULES, max_size=2)
+    limiter.hit(1, "default", now=0.0)
+    limiter.hit(2, "default", now=0.0)
+    limiter.hit(1, "default", now=1.0)
+    limiter.hit(3, "default", now=1.0)
+    assert len(limiter) == 2
+    # Ведро пользователя 2 вытеснено, и он снова получает полный лимит
+    assert limiter.hit(2, "default", now=1.0) == (True, False)
+    assert limiter.hit(3, "default", now=1.0) == (False, True)
+
+
+class _Bot:
+    """Записывает вызовы Bot API вместо отправки"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, method, request_timeout=None):
+        self.sent.append(method.text)
+
+
+def _update(bot, update_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "user"},
+        },
+    }, context={"bot": bot})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_middleware_window_boundary(clock):
+    bot = _Bot()
+    middleware = ThrottlingMiddleware(RULES, exempt=())
+    user = User(id=1, is_bot=False, first_name="user")
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    async def feed(update_id, text="/start"):
+        await middleware(handler, _update(bot, update_id, text), {"event_from_user": user})
+
+    async def run():
+        for update_id in range(1, 6):
+            await feed(update_id)
+        clock[0] += 19.99
+        await feed(6)
+        clock[0] += 0.01
+        await feed(7)
+        await feed(8)
+
+    asyncio.run(run())
+    assert handled == [1, 2, 3, 7]
+    # Одно предупреждение на серию отказов
+    assert bot.sent == [THROTTLE_NOTICE, THROTTLE_NOTICE]
+
+
+def test_middleware_skips_exempt_users(clock):
+    middleware = ThrottlingMiddleware(RULES, exempt=(1,))
+    user = User(id=1, is_bot=False, first_name="user")
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    async def run():
+        for update_id in range(1, 6):
+            await middleware(handler, _update(_Bot(), update_id, "/start"), {"event_from_user": user})
+
+    asyncio.run(run())
+    assert handled == [1, 2, 3, 4, 5]
+    assert len(middleware.limiter) == 0
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Перенос подписчиков: теги выгружаются и восстанавливаются при загрузке"""
+
+import asyncio
+
+import pytest
+
+from sqlite_database import SqliteDatabase
+from transfer import CSV, JSONL, export_users, import_users, parse_record, parse_tags
+
+
+def _run(tmp_path, scenario):
+    async def run():
+        source, target = SqliteDatabase(str(tmp_path / "source.db")), SqliteDatabase(str(tmp_path / "target.db"))
+        await source.connect()
+        await target.connect()
+        try:
+            await scenario(source, target)
+        finally:
+            await source.close()
+            await target.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("fmt", [CSV, JSONL])
+def test_tags_survive_roundtrip(tmp_path, fmt):
+    path = str(tmp_path / f"users.{fmt}")
+
+    async def scenario(source, target):
+        await source.import_user_records([parse_record({"user_id": user_id}) for user_id in (1, 2, 3)])
+        await source.tag_users("vip", [1, 2])
+        await source.tag_users("beta", [1])
+        assert await export_users(source, path) == 3
+
+        # Пользователь 2 уже есть в базе: его теги не трогаются
+        await target.import_user_records([parse_record({"user_id": 2})])
+        report = await import_users(target, path)
+        assert (report.inserted, report.conflicts, report.tagged) == (2, 1, 2)
+        assert await target.get_user_tags([1, 2, 3]) == {1: ["beta", "vip"]}
+
+    _run(tmp_path, scenario)
+
+
+def test_file_without_tags_column(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("user_id,username\n1,first\n2,second\n", encoding="utf-8")
+
+    async def scenario(source, target):
+        report = await import_users(target, str(path))
+        assert (report.inserted, report.tagged, report.errors) == (2, 0, 0)
+        assert await target.get_user_tags([1, 2]) == {}
+
+    _run(tmp_path, scenario)
+
+
+def test_parse_tags():
+    assert parse_tags("vip; beta;") == ["vip", "beta"]
+    assert parse_tags(["vip", "beta"]) == ["vip", "beta"]
+    assert parse_tags(None) == parse_tags("") == []
+    for value in ("vip;bad tag", ["bad/tag"], {"tag": "vip"}):
+        with pytest.raises(ValueError):
+            parse_tags(value)
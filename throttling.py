@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Ограничение частоты апдейтов от одного пользователя.
+
+Middleware стоит перед обработчиками: лишние апдейты отбрасываются до того,
+как обработчик обратится к базе или отправит ответ, поэтому один
+пользователь, засыпающий бота сообщениями, не расходует пул соединений
+и лимит запросов к Bot API.
+
+Для каждой пары (пользователь, правило) хранится «ведро токенов»: правило
+start=3/60 разрешает 3 команды /start подряд и затем по одной раз в 20 секунд.
+Ведра лежат в LRU-словаре ограниченного размера, поэтому память не растет
+с числом пользователей.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from config import ADMIN_ID, THROTTLE_MAX_USERS, THROTTLE_RULES
+from metrics import REGISTRY
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+THROTTLED_UPDATES = REGISTRY.counter(
+    "bot_throttled_updates_total", "Апдейты, отброшенные ограничением частоты", ("rule",))
+
+# Правило для апдейтов без собственного правила
+DEFAULT_RULE = 'default'
+
+THROTTLE_NOTICE = "⏳ Слишком много запросов. Подождите немного и попробуйте снова."
+
+
+def parse_rules(spec: str) -> Dict[str, Tuple[int, float]]:
+    """
+    Правила вида "start=3/60,default=20/60".
+
+    Returns:
+        dict: правило -> (количество, период в секундах); некорректные правила пропускаются
+    """
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            name, limit = item.split("=", 1)
+            count, period = limit.split("/", 1)
+            count, period = int(count), float(period)
+            if count < 1 or period <= 0:
+                raise ValueError
+        except ValueError:
+            logger.warning(f"Некорректное правило THROTTLE_RULES: {item}")
+            continue
+        rules[name.strip().lstrip("/").lower()] = (count, period)
+    return rules
+
+
+def command_name(update: Update) -> Optional[str]:
+    """Имя команды из текста сообщения (/start@bot arg -> start) или None"""
+    message = update.message
+    if message is None or not message.text or not message.text.startswith("/"):
+        return None
+    return message.text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated_at', 'notified')
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+        # Пользователь уже предупрежден об ограничении в текущей серии отказов
+        self.notified = False
+
+
+class UserRateLimiter:
+    """Ведра токенов по парам (пользователь, правило) с вытеснением давних"""
+
+    def __init__(self, rules: Dict[str, Tuple[int, float]], max_size: int = THROTTLE_MAX_USERS):
+        self.rules = rules
+        self.max_size = max(1, max_size)
+        self._buckets = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def rule_for(self, command: Optional[str]) -> Optional[str]:
+        """Правило для команды: собственное, иначе default (None — без ограничения)"""
+        if command in self.rules:
+            return command
+        return DEFAULT_RULE if DEFAULT_RULE in self.rules else None
+
+    def hit(self, user_id: int, rule: str, now: Optional[float] = None) -> Tuple[bool, bool]:
+        """
+        Учесть апдейт пользователя.
+
+        Returns:
+            tuple: (разрешен ли апдейт, первый ли это отказ в серии)
+        """
+        now = time.monotonic() if now is None else now
+        count, period = self.rules[rule]
+        key = (user_id, rule)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(count, now)
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(count, bucket.tokens + (now - bucket.updated_at) * count / period)
+            bucket.updated_at = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.notified = False
+            return True, False
+
+        first = not bucket.notified
+        bucket.notified = True
+        return False, first
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для dp.update.
+
+    Лишний апдейт не передается обработчикам. О первом отказе в серии
+    пользователь получает одно предупреждение, следующие отбрасываются молча.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Tuple[int, float]]] = None,
+                 max_size: int = THROTTLE_MAX_USERS, exempt: Iterable[int] = (ADMIN_ID,)):
+        self.limiter = UserRateLimiter(parse_rules(THROTTLE_RULES) if rules is None else rules, max_size)
+        self.exempt = set(exempt)
+        REGISTRY.gauge(
+            "bot_throttle_tracked", "Пары (пользователь, правило) в памяти ограничителя частоты",
+            callback=lambda: len(self.limiter),
+        )
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Update,
+                       data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        rule = self.limiter.rule_for(command_name(event))
+        if rule is None:
+            return await handler(event, data)
+
+        allowed, first = self.limiter.hit(user.id, rule)
+        if allowed:
+            return await handler(event, data)
+
+        THROTTLED_UPDATES.inc(rule)
+        if first:
+            logger.info(f"Пользователь {user.id} превысил лимит '{rule}', апдейты отбрасываются")
+            if event.message is not None:
+                try:
+                    await event.message.answer(THROTTLE_NOTICE)
+                except Exception as e:
+                    logger.warning(f"Не удалось предупредить пользователя {user.id}: {e}")
+        return None